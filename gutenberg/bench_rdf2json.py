@@ -0,0 +1,93 @@
+"""
+gutenberg/bench_rdf2json.py
+
+Checks that run_gutenberg.rdf2json (one iterparse pass) gives the same output as rdf2json_rdflib (xml2json, then
+rdflib for the file URIs), and compares their throughput. Needs rdflib for the reference parser.
+
+rdflib finds the URI of a file by its modified time and size, so if two files of a book have the same ones, it may
+give either URI for both. Those files are reported separately, as rdf2json reads each file's own URI.
+
+Usage:
+    python gutenberg/bench_rdf2json.py                           # gutenberg/samples/*.rdf
+    python gutenberg/bench_rdf2json.py --rdf-list cache/rdf_list.txt --limit 2000
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+
+from run_gutenberg import rdf2json, rdf2json_rdflib
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples', '*.rdf')
+
+parser = argparse.ArgumentParser(description='check and benchmark rdf2json against the rdflib parser')
+parser.add_argument('paths', nargs='*', help='RDF files (default: {})'.format(SAMPLES))
+parser.add_argument('--rdf-list', help='file with one RDF path per line, as written by run_all.py')
+parser.add_argument('--limit', type=int, default=0, help='max RDF files, 0 for all')
+parser.add_argument('--repeat', type=int, default=3, help='number of timed passes over the files')
+
+
+def run(func, rdf):
+    try:
+        return func(rdf)
+    except Exception as e:
+        return 'EXCEPTION {}: {}'.format(type(e).__name__, e)
+
+
+def is_ambiguous(expected, actual):
+    """ Whether expected and actual differ only in the URIs of files that share their modified time and size."""
+    if not isinstance(expected, dict) or not isinstance(actual, dict) or 'files' not in expected:
+        return False
+    if {k: v for k, v in expected.items() if k != 'files'} != {k: v for k, v in actual.items() if k != 'files'}:
+        return False
+    keys = Counter((x['modified_at'], x['size']) for x in expected['files'])
+    for x, y in zip(expected['files'], actual.get('files', [])):
+        if x != y and (keys[(x['modified_at'], x['size'])] < 2 or dict(x, uri=None) != dict(y, uri=None)):
+            return False
+    return len(expected['files']) == len(actual.get('files', []))
+
+
+def time_passes(func, rdf_names, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for rdf in rdf_names:
+            run(func, rdf)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.rdf_list:
+        with open(args.rdf_list, 'r') as f:
+            rdf_names = [x.strip() for x in f if x.strip()]
+    else:
+        rdf_names = sorted(x for pattern in args.paths or [SAMPLES] for x in glob.glob(pattern))
+    if args.limit:
+        rdf_names = rdf_names[:args.limit]
+    print('{} RDF files'.format(len(rdf_names)))
+
+    mismatches, ambiguous = [], []
+    for rdf in rdf_names:
+        expected, actual = run(rdf2json_rdflib, rdf), run(rdf2json, rdf)
+        if expected == actual:
+            continue
+        if is_ambiguous(expected, actual):
+            ambiguous.append(rdf)
+        else:
+            mismatches.append(rdf)
+            print('MISMATCH {}\n  rdflib:    {}\n  iterparse: {}'.format(rdf, expected, actual))
+    for rdf in ambiguous:
+        print('ambiguous file URIs (same modified time and size) in', rdf)
+
+    results = [('rdflib', time_passes(rdf2json_rdflib, rdf_names, args.repeat)),
+               ('iterparse', time_passes(rdf2json, rdf_names, args.repeat))]
+    for name, secs in results:
+        print('{:10} {:8.3f}s  {:8.1f} files/s  {:5.1f}x'.format(
+            name, secs, len(rdf_names) / secs if secs else 0, results[0][1] / secs if secs else 0))
+    print('{} mismatches, {} with ambiguous file URIs'.format(len(mismatches), len(ambiguous)))
+    sys.exit(1 if mismatches else 0)
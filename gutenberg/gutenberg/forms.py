@@ -25,6 +25,7 @@ class BookFilterForm(forms.Form):
     )
 
     ORDER_BY_CHOICES = (
+        ('rank', '按相关程度'),
         ('downloads', '按下载数量'),
         ('id', '按收录顺序'),
         ('issued', '按出版日期'),
@@ -1,10 +1,35 @@
+import time
+from collections import OrderedDict, defaultdict
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
 from path import Path
 from ...rdfparser import rdf2json, print_json
 from ... import models as m
 
+BATCH_SIZE = 1000  # books per transaction with --bulk
+M2M_MODELS = [
+    ('languages', m.Language),
+    ('subjects', m.Subject),
+    ('bookshelves', m.Bookshelf),
+]
+BOOK_FIELDS = ['title', 'alternative', 'issued', 'downloads', 'category_id', 'cover_small', 'cover_medium']
+AUTHOR_FIELDS = ['aliases', 'webpage', 'birthdate', 'deathdate']
+FILE_FIELDS = ['book_id', 'format', 'modified_at', 'size']
+
+
+def get_author_data(agent):
+    data = agent.get('agent', {})
+    name = data.pop('name', '')[:m.COMMON_STR_LEN]
+    aliases = data.pop('alias', [])
+    if isinstance(aliases, str):
+        aliases = [aliases]
+    data['aliases'] = [alias[:m.COMMON_STR_LEN] for alias in aliases]
+    return name, data
+
 
-def process_rdf(rdf_path, full=False):
+def process_rdf(rdf_path, full=False, touched=None):
+    """ Import one rdf file. Adds the ids of the items linked to the book to touched, {model: ids}, if given."""
     name = rdf_path.namebase  # pg1234
     id = int(name[2:])
     if m.Book.objects.filter(id=id).exists() and not full:
@@ -27,29 +52,36 @@ def process_rdf(rdf_path, full=False):
     files = rdf_json.pop('files', [])
 
     book, created = m.Book.objects.get_or_create(id=id, **rdf_json)
+    changed_authors = []  # their other books need a new search document
+    if touched is None:
+        touched = defaultdict(set)
     if full or created:
         if category:
             obj, _ = m.Category.objects.get_or_create(name=category)
+            if book.category_id is not None and book.category_id != obj.id:
+                touched[m.Category].add(book.category_id)  # lost a book
             book.category = obj
+            touched[m.Category].add(obj.id)
         for name in languages:
             obj, _ = m.Language.objects.get_or_create(name=name)
             book.languages.add(obj)
+            touched[m.Language].add(obj.id)
         for name in subjects:
             obj, _ = m.Subject.objects.get_or_create(name=name)
             book.subjects.add(obj)
+            touched[m.Subject].add(obj.id)
         for name in bookshelves:
             obj, _ = m.Bookshelf.objects.get_or_create(name=name)
             book.bookshelves.add(obj)
+            touched[m.Bookshelf].add(obj.id)
         for agent in authors:
-            data = agent.get('agent', {})
-            name = data.pop('name', '')[:m.COMMON_STR_LEN]
-            aliases = data.pop('alias', [])
-            if isinstance(aliases, str):
-                aliases = [aliases]
-            data['aliases'] = [alias[:m.COMMON_STR_LEN] for alias in aliases]
+            name, data = get_author_data(agent)
+            old_aliases = m.Author.objects.filter(name=name).values_list('aliases', flat=True).first()
             obj, _ = m.Author.objects.update_or_create(
                 name=name, defaults=data,
             )
+            if old_aliases is not None and old_aliases != obj.aliases:
+                changed_authors.append(obj.id)
             book.authors.add(obj)
         for data in files:
             uri = data.pop('uri', '')
@@ -71,6 +103,204 @@ def process_rdf(rdf_path, full=False):
                         book=book, uri=uri, defaults=data
                     )
         book.save()
+        m.update_search_index(set([book.id]) | m.get_author_book_ids(changed_authors))
+
+
+def to_python(model, data):
+    """ data with each value converted by its model field, so it compares equal to the value read from the db."""
+    return {k: model._meta.get_field(k).to_python(v) for k, v in data.items()}
+
+
+class BulkImport(object):
+    """
+    Import books in batches: one transaction and a fixed number of queries per batch instead of per book.
+
+    Names of categories, languages, subjects, bookshelves and authors, and the ids of existing books, are loaded once
+    up front. Books, lookup rows, files and M2M through rows are then inserted with bulk_create, and changed rows
+    are updated with bulk_update. The search index of the books in the batch, and of the other books of authors
+    whose aliases changed, is rebuilt. As with process_rdf, M2M relations are only ever added. At the end, the
+    counts of the categories, languages, subjects and bookshelves of the imported books are recomputed.
+    """
+
+    def __init__(self, full=False, batch_size=BATCH_SIZE):
+        self.full = full
+        self.batch_size = batch_size
+        self.book_ids = set(m.Book.objects.values_list('id', flat=True))
+        self.lookup_ids = {model: dict(model.objects.values_list('name', 'id'))
+                           for model in [m.Category] + [model for _, model in M2M_MODELS]}
+        self.authors = {}  # name -> (id, {field: value}), the lowest id if the name is repeated
+        for row in m.Author.objects.order_by('-id').values('id', 'name', *AUTHOR_FIELDS):
+            self.authors[row.pop('name')] = (row.pop('id'), row)
+        self.changed_authors = set()  # of the current batch, see get_author_ids
+        self.touched = defaultdict(set)  # model -> ids of the items linked to imported books, to recount
+        self.counts = OrderedDict((k, 0) for k in ['parsed', 'created', 'updated', 'unchanged', 'skipped'])
+        self.start = time.time()
+
+    def get_ids(self, model, names):
+        """ {name: id} for names in a BaseItem model. Missing names are created with one bulk_create."""
+        ids = self.lookup_ids[model]
+        missing = [name for name in OrderedDict.fromkeys(names) if name and name not in ids]
+        if missing:
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([model(name=name) for name in missing])
+            except IntegrityError:  # created meanwhile by another import
+                for name in missing:
+                    model.objects.get_or_create(name=name)
+            ids.update(model.objects.filter(name__in=missing).values_list('name', 'id'))
+        return {name: ids[name] for name in names if name}
+
+    def get_author_ids(self, authors):
+        """
+        authors is {name: data}. Creates the new authors and updates the changed ones, returns {name: id}.
+
+        The ids of the authors whose aliases changed are added to self.changed_authors.
+        """
+        new, changed = [], {}
+        for name, data in authors.items():
+            if name not in self.authors:
+                new.append(name)
+                continue
+            id, row = self.authors[name]
+            data = to_python(m.Author, data)
+            if any(row.get(k) != v for k, v in data.items()):
+                changed[id] = data
+                if 'aliases' in data and row.get('aliases') != data['aliases']:
+                    self.changed_authors.add(id)
+                row.update(data)
+        if changed:
+            m.bulk_update(m.Author, changed, AUTHOR_FIELDS)
+        if new:
+            m.Author.objects.bulk_create([m.Author(name=name, **authors[name]) for name in new])
+            for row in m.Author.objects.filter(name__in=new).order_by('-id').values('id', 'name', *AUTHOR_FIELDS):
+                self.authors[row.pop('name')] = (row.pop('id'), row)
+        return {name: self.authors[name][0] for name in authors}
+
+    def parse(self, rdf_path):
+        """ Returns (id, rdf_json) of a book to import, or None if it is skipped."""
+        id = int(rdf_path.namebase[2:])  # pg1234
+        if id in self.book_ids and not self.full:
+            self.counts['skipped'] += 1
+            return None
+        rdf_json = rdf2json(rdf_path)
+        self.counts['parsed'] += 1
+        if not rdf_json.get('title'):
+            print('book {} has no title, skip'.format(id))
+            self.counts['skipped'] += 1
+            return None
+        return id, rdf_json
+
+    def import_batch(self, batch):
+        """ batch is [(id, rdf_json), ...], as returned by parse."""
+        books, files, authors = OrderedDict(), OrderedDict(), OrderedDict()
+        relations = {field: {} for field, _ in M2M_MODELS + [('authors', m.Author)]}
+        for id, rdf_json in batch:
+            data = OrderedDict((k, rdf_json[k]) for k in ['title', 'alternative', 'issued', 'downloads']
+                               if k in rdf_json)
+            data['category_id'] = rdf_json.get('category', '')
+            for field, _ in M2M_MODELS:
+                relations[field][id] = rdf_json.get(field, [])
+            relations['authors'][id] = []
+            for agent in rdf_json.get('authors', []):
+                name, author = get_author_data(agent)
+                authors[name] = author
+                relations['authors'][id].append(name)
+            for file in rdf_json.get('files', []):
+                uri = file.get('uri', '')
+                formats = file.get('formats', [])
+                if len(formats) != 1:  # skip all zip ones
+                    continue
+                fmt = formats[0]
+                if fmt.startswith("image"):
+                    for cover, key in [('cover.medium', 'cover_medium'), ('cover.small', 'cover_small')]:
+                        if cover in uri:
+                            data.setdefault(key, uri)
+                            break
+                elif not fmt.startswith(("text/rdf", "text/xml", "application/rdf+xml")):
+                    files[uri] = {'book_id': id, 'format': fmt, 'modified_at': file['modified_at'],
+                                  'size': file['size']}
+            books[id] = data
+
+        category_ids = self.get_ids(m.Category, [data['category_id'] for data in books.values()])
+        for data in books.values():
+            data['category_id'] = category_ids.get(data['category_id'])
+        name_ids = {field: self.get_ids(model, [name for names in relations[field].values() for name in names])
+                    for field, model in M2M_MODELS}
+        self.changed_authors = set()
+        self.touched[m.Category].update(x for x in category_ids.values())
+        for field, model in M2M_MODELS:
+            self.touched[model].update(name_ids[field].values())
+        name_ids['authors'] = self.get_author_ids(authors)
+        relations = {field: {id: [name_ids[field][name] for name in names if name in name_ids[field]]
+                             for id, names in ids.items()}
+                     for field, ids in relations.items()}
+
+        existing = [id for id in books if id in self.book_ids]
+        new = [id for id in books if id not in self.book_ids]
+        changed = {}
+        for row in m.Book.objects.filter(id__in=existing).values('id', *BOOK_FIELDS):
+            data = to_python(m.Book, books[row['id']])
+            for key in ['cover_small', 'cover_medium']:  # only set if missing
+                if row[key]:
+                    data.pop(key, None)
+            if any(row[k] != v for k, v in data.items()):
+                changed[row['id']] = data
+                if row['category_id'] != data['category_id'] and row['category_id'] is not None:
+                    self.touched[m.Category].add(row['category_id'])  # lost a book
+        m.bulk_update(m.Book, changed, BOOK_FIELDS, touch=True)
+        m.Book.objects.bulk_create([m.Book(id=id, **books[id]) for id in new])
+        self.book_ids.update(new)
+
+        for field, ids in relations.items():
+            book_field = m.Book._meta.get_field(field)
+            through = book_field.remote_field.through
+            from_name, to_name = book_field.m2m_field_name() + '_id', book_field.m2m_reverse_field_name() + '_id'
+            pairs = set(through.objects.filter(**{from_name + '__in': existing}).values_list(from_name, to_name)) \
+                if existing else set()
+            rows = []
+            for id, to_ids in ids.items():
+                for to_id in OrderedDict.fromkeys(to_ids):
+                    if (id, to_id) not in pairs:
+                        rows.append(through(**{from_name: id, to_name: to_id}))
+            through.objects.bulk_create(rows, batch_size=self.batch_size)
+
+        file_ids = dict(m.File.objects.filter(uri__in=list(files)).values_list('uri', 'id'))
+        m.bulk_update(m.File, {file_ids[uri]: data for uri, data in files.items() if uri in file_ids}, FILE_FIELDS,
+                      touch=True)
+        m.File.objects.bulk_create([m.File(uri=uri, **data) for uri, data in files.items() if uri not in file_ids],
+                                   batch_size=self.batch_size)
+
+        # the other books of an author whose aliases changed have them in their search document too
+        m.update_search_index(set(books) | m.get_author_book_ids(self.changed_authors))
+
+        self.counts['created'] += len(new)
+        self.counts['updated'] += len(changed)
+        self.counts['unchanged'] += len(existing) - len(changed)
+
+    def report(self):
+        secs = time.time() - self.start
+        total = sum(self.counts[k] for k in ['created', 'updated', 'unchanged', 'skipped'])
+        print('{} books in {:.0f}s ({:.1f} books/s): {}'.format(
+            total, secs, total / secs if secs else 0, ', '.join('{} {}'.format(v, k) for k, v in self.counts.items())))
+
+    def run(self, rdf_paths):
+        batch = []
+        for rdf_path in rdf_paths:
+            item = self.parse(rdf_path)
+            if item:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    self.import_batch(batch)
+                batch = []
+                self.report()
+        if batch:
+            with transaction.atomic():
+                self.import_batch(batch)
+        self.report()
+        changed = m.update_item_counts(self.touched)
+        print('counts updated: {}'.format(', '.join(
+            '{} {}'.format(n, model._meta.verbose_name_plural) for model, n in changed.items())))
 
 
 class Command(BaseCommand):
@@ -79,12 +309,27 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('path', help='path rdf dir or file')
         parser.add_argument('--full', dest='full', action='store_true')
+        parser.add_argument('--bulk', dest='bulk', action='store_true',
+                            help='import in batches, with bulk inserts and one transaction per batch')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=BATCH_SIZE,
+                            help='books per batch with --bulk')
 
     def handle(self, *args, **options):
         path = Path(options['path'])
         full = options["full"]
-        if path.isfile():
-            process_rdf(path, full=True)
-        else:
-            for rdf_path in path.walkfiles(pattern='*.rdf'):
-                process_rdf(rdf_path, full=full)
+        try:
+            if options['bulk']:
+                if path.isfile():
+                    BulkImport(full=True, batch_size=options['batch_size']).run([path])
+                else:
+                    BulkImport(full=full, batch_size=options['batch_size']).run(path.walkfiles(pattern='*.rdf'))
+            else:
+                touched = defaultdict(set)
+                if path.isfile():
+                    process_rdf(path, full=True, touched=touched)
+                else:
+                    for rdf_path in path.walkfiles(pattern='*.rdf'):
+                        process_rdf(rdf_path, full=full, touched=touched)
+                m.update_item_counts(touched)
+        finally:
+            m.invalidate_book_counts()
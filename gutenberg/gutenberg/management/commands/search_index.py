@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from ... import models as m
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search document and vector of books'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='book ids, all books if none')
+
+    def handle(self, *args, **options):
+        ids = options['ids'] or None
+        m.update_search_index(ids)
+        print('search index rebuilt for {} books'.format(len(ids) if ids else m.Book.objects.count()))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from ... import models as m
+
+MODELS = {model._meta.model_name: model for model in [m.Category, m.Language, m.Subject, m.Bookshelf]}
+
+
+class Command(BaseCommand):
+    help = 'Recompute the book count of categories, languages, subjects and bookshelves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='models to recount ({}), all if none'.format(
+            ', '.join(sorted(MODELS))))
+        parser.add_argument('--ids', nargs='+', type=int, help='only recount these items (needs one model)')
+
+    def handle(self, *args, **options):
+        unknown = set(options['models']) - set(MODELS)
+        if unknown:
+            raise CommandError('unknown models: {}'.format(', '.join(sorted(unknown))))
+        models = [MODELS[name] for name in options['models']] or list(MODELS.values())
+        ids = options['ids']
+        if ids and len(models) != 1:
+            raise CommandError('--ids needs exactly one model')
+        for model in models:
+            changed = model.update_counts(ids)
+            print('{}: {} counts changed'.format(model._meta.verbose_name_plural, changed))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gutenberg', '0002_auto_20170604_1704'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='book',
+            name='search_document',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX gutenberg_book_search_vector ON gutenberg_book USING gin (search_vector)',
+            'DROP INDEX gutenberg_book_search_vector',
+        ),
+        # matches the UPPER(...) LIKE UPPER(...) of search_document__icontains
+        migrations.RunSQL(
+            'CREATE INDEX gutenberg_book_search_document_trgm ON gutenberg_book '
+            'USING gin (UPPER(search_document) gin_trgm_ops)',
+            'DROP INDEX gutenberg_book_search_document_trgm',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gutenberg', '0003_book_search'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='book',
+            index_together=set([('downloads', 'id'), ('issued', 'id')]),
+        ),
+    ]
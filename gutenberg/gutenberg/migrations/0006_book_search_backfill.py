@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def backfill_search_index(apps, schema_editor):
+    # fills search_document and search_vector of the books imported before 0003, in batches
+    from ..models import update_search_index
+    update_search_index(book_model=apps.get_model('gutenberg', 'Book'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gutenberg', '0005_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,15 @@
+import hashlib
 import json
 import requests
 from os.path import basename
 from django.db import models
 from django.urls import reverse
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
 
 from base.utils import sizeof_fmt
 
@@ -13,6 +18,9 @@ log = logging.getLogger(__name__)
 
 
 COMMON_STR_LEN = 200
+BATCH_SIZE = 1000  # rows per UPDATE in bulk_update and update_search_index
+SEARCH_CONFIG = 'english'  # text search configuration of Book.search_vector
+COUNT_TIMEOUT = 24 * 3600  # seconds a book count stays cached, unless an import invalidates it first
 
 def show_str(s, n=50):
     if len(s) < n:
@@ -45,6 +53,30 @@ class BaseItem(models.Model):
         self.count = self.book_set.all().count()
         self.save(update_fields=['count'])
 
+    @classmethod
+    def update_counts(cls, ids=None):
+        """
+        Recompute count of all rows, or of ids, with one grouped aggregate, and write back the changed ones with
+        bulk_update. Returns the number of rows changed.
+        """
+        book_field = cls._meta.get_field('book').field  # Book.category, Book.subjects, ...
+        if book_field.many_to_many:
+            rows = book_field.remote_field.through.objects
+            key, count_key = book_field.m2m_reverse_field_name() + '_id', 'book_id'
+        else:
+            rows = Book.objects
+            key, count_key = book_field.attname, 'id'
+        items = cls.objects.all()
+        if ids is not None:
+            ids = list(ids)
+            items = items.filter(id__in=ids)
+            rows = rows.filter(**{key + '__in': ids})
+        counts = dict(rows.values_list(key).annotate(n=models.Count(count_key)).order_by())
+        changed = {id: {'count': counts.get(id, 0)} for id, count in items.values_list('id', 'count')
+                   if counts.get(id, 0) != count}
+        bulk_update(cls, changed, ['count'])
+        return len(changed)
+
 
 class Subject(BaseItem):
     pass
@@ -95,8 +127,17 @@ class Book(models.Model):
 
     push_count = models.PositiveIntegerField(default=0)
 
+    # title, alternative title, author names and aliases, and subjects; see update_search_index
+    search_document = models.TextField(blank=True, default='')
+    search_vector = SearchVectorField(blank=True, null=True)
+
     class Meta:
         ordering = ['-downloads']
+        # for paging by (order key, id), see views.keyset_paging
+        index_together = [
+            ('downloads', 'id'),
+            ('issued', 'id'),
+        ]
 
     def __str__(self):
         return show_str(self.title)
@@ -178,3 +219,111 @@ class File(models.Model):
         log.info('file {} push_count +1'.format(self.pk))
         self.__class__.objects.filter(id=self.id).update(push_count=models.F('push_count')+1)
         return push
+
+
+class CatalogVersion(models.Model):
+    """
+    One row, whose version is bumped by invalidate_book_counts after each import.
+
+    It is kept in the db rather than in the cache, so that every process sees it whatever the cache backend.
+    """
+    version = models.PositiveIntegerField(default=0)
+
+
+def bulk_update(model, rows, fields, touch=False):
+    """
+    Update rows, {pk: {field: value}}, with one UPDATE ... SET field = CASE pk WHEN ... per BATCH_SIZE rows.
+
+    This Django version has no QuerySet.bulk_update. A field missing from a row keeps its value. QuerySet.update
+    skips auto_now, so updated_at is only set when touch is true.
+    """
+    pks = list(rows)
+    for i in range(0, len(pks), BATCH_SIZE):
+        batch = pks[i:i + BATCH_SIZE]
+        cases = {}
+        for name in fields:
+            field = model._meta.get_field(name)
+            whens = [When(pk=pk, then=Value(rows[pk][name], output_field=field))
+                     for pk in batch if name in rows[pk]]
+            if whens:
+                cases[field.attname] = Case(*whens, default=F(field.attname), output_field=field)
+        if touch and any(f.name == 'updated_at' for f in model._meta.fields):
+            cases['updated_at'] = timezone.now()
+        model.objects.filter(pk__in=batch).update(**cases)
+
+
+def get_search_documents(book_ids, book_model=Book):
+    """ {book id: search document} for book_ids, from one query per table. book_model may be a historical model."""
+    parts = {}
+    for id, title, alternative in book_model.objects.filter(id__in=book_ids).values_list('id', 'title', 'alternative'):
+        parts[id] = [title, alternative]
+    authors = book_model.authors.through.objects.filter(book_id__in=book_ids)
+    for id, name, aliases in authors.values_list('book_id', 'author__name', 'author__aliases'):
+        parts[id].append(name)
+        parts[id].extend(aliases or [])
+    subjects = book_model.subjects.through.objects.filter(book_id__in=book_ids)
+    for id, name in subjects.values_list('book_id', 'subject__name'):
+        parts[id].append(name)
+    return {id: '\n'.join(x for x in items if x) for id, items in parts.items()}
+
+
+def get_author_book_ids(author_ids):
+    """ Ids of the books of author_ids, as a set."""
+    if not author_ids:
+        return set()
+    return set(Book.authors.through.objects.filter(author_id__in=list(author_ids)).values_list('book_id', flat=True))
+
+
+def update_search_index(book_ids=None, book_model=Book):
+    """
+    Rebuild Book.search_document and Book.search_vector of book_ids, or of all books if None.
+
+    The vector weights the title above the rest of the document, for ranking. search_document also has a trigram
+    index, for substring matches. book_model is the Book model of a migration when run from one.
+    """
+    if book_ids is None:
+        book_ids = book_model.objects.order_by('id').values_list('id', flat=True)
+    book_ids = list(book_ids)
+    vector = SearchVector('title', weight='A', config=SEARCH_CONFIG) + \
+        SearchVector('search_document', weight='B', config=SEARCH_CONFIG)
+    for i in range(0, len(book_ids), BATCH_SIZE):
+        batch = book_ids[i:i + BATCH_SIZE]
+        documents = get_search_documents(batch, book_model)
+        bulk_update(book_model, {id: {'search_document': doc} for id, doc in documents.items()}, ['search_document'])
+        book_model.objects.filter(id__in=batch).update(search_vector=vector)
+
+
+def update_item_counts(touched=None):
+    """
+    Recompute the count of all Category, Language, Subject and Bookshelf rows, or only of touched, {model: ids}.
+
+    Returns {model: number of rows changed}.
+    """
+    models_ = [Category, Language, Subject, Bookshelf]
+    if touched is None:
+        return {model: model.update_counts() for model in models_}
+    return {model: model.update_counts(touched[model]) for model in models_ if touched.get(model)}
+
+
+def get_book_count(objs):
+    """
+    Count of a Book queryset, cached for COUNT_TIMEOUT.
+
+    The cache key has the SQL of the query and the catalog version, which invalidate_book_counts bumps after an
+    import, so until then a listing is counted once instead of on every page. The version is read from the db, so
+    an import run from another process also invalidates the counts cached by each web server process.
+    """
+    version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    sql = str(objs.order_by().query)
+    key = 'gutenberg:count:{}:{}'.format(version, hashlib.sha1(sql.encode('utf-8')).hexdigest())
+    count = cache.get(key)
+    if count is None:
+        count = objs.count()
+        cache.set(key, count, COUNT_TIMEOUT)
+    return count
+
+
+def invalidate_book_counts():
+    """ Drop all cached book counts, after books were added or changed."""
+    if not CatalogVersion.objects.filter(pk=1).update(version=models.F('version') + 1):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
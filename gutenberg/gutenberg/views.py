@@ -1,5 +1,7 @@
+from django.core.exceptions import ValidationError
 from django.shortcuts import render
-from django.db.models import Q
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
 from django.shortcuts import get_object_or_404
 
 from annoying.decorators import render_to
@@ -13,12 +15,78 @@ def T(template_name):
     return 'gutenberg/{}'.format(template_name)
 
 
-def _book_list(request, objs):
-    ctx = paging(request, objs)
+PAGE_SIZE = 20
+KEYSET_FIELDS = ['downloads', 'id', 'issued']  # orderings paged by cursor, with an index on (field, id)
+
+
+def _keyset_filter(field, value, id, less):
+    """
+    Q for the rows before (less) or after (value, id) in ORDER BY field, id.
+
+    NULL sorts as the largest value, as in Postgres.
+    """
+    if value is None:
+        if less:
+            return Q(**{field + '__isnull': False}) | Q(**{field + '__isnull': True, 'id__lt': id})
+        return Q(**{field + '__isnull': True, 'id__gt': id})
+    op = 'lt' if less else 'gt'
+    q = Q(**{field + '__' + op: value}) | Q(**{field: value, 'id__' + op: id})
+    return q if less else q | Q(**{field + '__isnull': True})
+
+
+def _cursor(obj, field):
+    value = getattr(obj, field)
+    return '{}:{}'.format('' if value is None else value, obj.id)
+
+
+def _parse_cursor(cursor, field):
+    value, id = cursor.rsplit(':', 1)
+    return m.Book._meta.get_field(field).to_python(value) if value else None, int(id)
+
+
+def keyset_paging(request, objs, field, desc=True):
+    """
+    Page objs ordered by (field, id) from the cursor in ?after= or ?before=, instead of by offset.
+
+    Each page is one indexed range query whatever its depth. The count is cached, see m.get_book_count.
+    """
+    count = m.get_book_count(objs)
+    order = '-' if desc else ''
+    after, before = request.GET.get('after'), request.GET.get('before')
+    try:
+        cursor = _parse_cursor(after or before, field) if after or before else None
+    except (ValueError, ValidationError):
+        cursor = None
+    if cursor and before:
+        reverse = '' if desc else '-'
+        objs = objs.filter(_keyset_filter(field, *cursor, less=not desc))
+        rows = list(objs.order_by(reverse + field, reverse + 'id')[:PAGE_SIZE + 1])
+        has_previous, has_next = len(rows) > PAGE_SIZE, True
+        rows = rows[:PAGE_SIZE][::-1]
+    else:
+        if cursor:
+            objs = objs.filter(_keyset_filter(field, *cursor, less=desc))
+        rows = list(objs.order_by(order + field, order + 'id')[:PAGE_SIZE + 1])
+        has_previous, has_next = bool(cursor), len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+    return {
+        'page': {'object_list': rows},
+        'keyset': {
+            'count': count,
+            'previous': _cursor(rows[0], field) if rows and has_previous else '',
+            'next': _cursor(rows[-1], field) if rows and has_next else '',
+        },
+    }
+
+
+def _book_list(request, objs, ordering=None):
+    """ ordering is (field, desc) to page by cursor, or None to page by offset in the order of objs."""
+    ctx = keyset_paging(request, objs, *ordering) if ordering else paging(request, objs)
     data = request.GET.dict()
     ctx['filter_form'] = f.BookFilterForm(initial=data)
     get_copy = request.GET.copy()
-    get_copy.pop('page', '')
+    for key in ['page', 'after', 'before']:
+        get_copy.pop(key, '')
     ctx['querystring'] = get_copy.urlencode()
     ctx['gutenberg_active'] = 'active'
     return render(request, T('index.html'), context=ctx)
@@ -36,29 +104,33 @@ def index(request):
     if category:
         objs = objs.filter(category__id=category)
 
-    q = data.get('q', '')
+    # search_document has the title, authors (names and aliases) and subjects of the book,
+    # so no join is needed: words match the full-text index, substrings the trigram index
+    q = data.get('q', '').strip()
     if q:
-        q0 = Q(title__icontains=q)
-        q1 = Q(authors__name__icontains=q)
-        q2 = Q(authors__aliases__icontains=q)
-        q3 = Q(subjects__name__icontains=q)
-        objs = objs.filter(q0 | q1 | q2 | q3)
+        query = SearchQuery(q, config=m.SEARCH_CONFIG)
+        objs = objs.filter(Q(search_vector=query) | Q(search_document__icontains=q))
+        objs = objs.annotate(rank=SearchRank(F('search_vector'), query))
 
-    order_by = data.get('order_by', 'downloads')
-    order = '' if data.get('order') == 'asc' else '-'
-    ordering = order + order_by
-    objs = objs.order_by(ordering).distinct()
-    return _book_list(request, objs)
+    order_by = data.get('order_by') or ('rank' if q else 'downloads')
+    if order_by == 'rank' and not q:
+        order_by = 'downloads'
+    desc = data.get('order') != 'asc'
+    if order_by == 'rank':
+        return _book_list(request, objs.order_by('-rank', '-downloads'))
+    if order_by in KEYSET_FIELDS:
+        return _book_list(request, objs, ordering=(order_by, desc))
+    return _book_list(request, objs.order_by(('-' if desc else '') + order_by))
 
 
 def subject(request, pk):
     objs = m.Book.objects.filter(subjects=pk)
-    return _book_list(request, objs)
+    return _book_list(request, objs, ordering=('downloads', True))
 
 
 def bookshelf(request, pk):
     objs = m.Book.objects.filter(bookshelves=pk)
-    return _book_list(request, objs)
+    return _book_list(request, objs, ordering=('downloads', True))
 
 
 def book_detail(request, pk):
@@ -3,15 +3,35 @@ gutenberg/run_all.py
 
 Runs all the scripts to get the gutenberg catalog, and save it to a pickled file.
 
-You will need to download, unzip, and untar the file from
-https://www.gutenberg.org/cache/epub/feeds/rdf-files.tar.zip
+With --tar, the RDF files are read straight from rdf-files.tar (or rdf-files.tar.zip) in one sequential pass,
+without unpacking it; members not in --ids are skipped without being read.
+
+The RDF files are parsed in shards of SHARD_SIZE files, in a pool of --workers processes (all cores by default with
+--full). Each parsed shard is saved under SHARD_DIR, so --use-pickled resumes from the finished shards. Without
+shards (e.g. from before they were introduced), --use-pickled starts from CATALOG_RAW_NAME instead and only parses
+the books missing from it. Shards are merged into the catalog in the order of the RDF list (or archive), so the
+catalog is the same as when parsing one by one. At the end of a run, shards it did not produce are deleted.
+
+With --incremental, the (mtime, size), sha1 and catalog record of each RDF file are kept in a sidecar index
+(INDEX_NAME). Only new files, or files whose content changed, are parsed again, and only the titles whose entries
+changed (with the titles manual_fix links them to) are cleaned again.
+
+You will need to download the file from https://www.gutenberg.org/cache/epub/feeds/rdf-files.tar.zip, and either
+pass it (or the unzipped rdf-files.tar) with --tar, or unzip and untar it.
 """
 
 import argparse
 import glob
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
+import re
 import sys
+import tarfile
+import zipfile
+from collections import defaultdict, deque
 from copy import deepcopy
 
 import dill as pickle
@@ -23,15 +43,37 @@ sys.path.append('./scraping')
 from scrape_vars import ALT_ORIG_MAP, TO_DELETE, EXCLUDED_IDS, ID_FILE, CATALOG_RAW_NAME, CATALOG_NAME
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--use-pickled', action='store_true', help='use existing (partial) pickle')
+parser.add_argument('--use-pickled', action='store_true',
+                    help='reuse the parsed shards of a previous (partial) run, or its catalog if it left no shards')
 parser.add_argument('--full', action='store_true', help='get full Gutenberg catalog (default: False)')
 parser.add_argument('--ids', default=ID_FILE, help='path to files with Gutenberg IDs to collect')
+parser.add_argument('--tar', help='read RDF files from this rdf-files.tar or rdf-files.tar.zip, instead of cache/epub')
+parser.add_argument('--incremental', action='store_true',
+                    help='only parse new or changed RDF files, and only clean the titles that changed')
+parser.add_argument('--workers', type=int, help='number of processes parsing RDF files (default: all cores with '
+                                                 '--full, else 1)')
 
 TOP_LEVEL = 'cache/epub'
 RDF_LIST = 'cache/rdf_list.txt'
+SHARD_DIR = 'cache/catalog_shards'
+SHARD_SIZE = 500
+INDEX_NAME = 'cache/catalog_index.pk'
+RE_RDF_NAME = re.compile(r'(^|/)pg\d+\.rdf$')
 OVERWRITE_RDF = False
 BASE_URL_EBOOKS = 'https://www.gutenberg.org/ebooks/'
 
+# (alias, title): manual_fix adds alias as another key of the entry of title
+TITLE_ALIASES = [
+    ('Typee', 'Typee: A Romance of the South Seas'),
+    ('The Adventures of Huckleberry Finn', 'Huckleberry Finn'),
+    ('Dr Jekyll and Mr Hyde', 'Dr. Jekyll and Mr. Hyde'),
+    ("Tess of the D'Urbervilles", "Tess of the d'Urbervilles"),
+    ("The DeerSlayer", "The Deerslayer"),
+    ("My Antonia", "My Ántonia"),
+    ("Alice's Adventures In Wonderland", "Alice's Adventures in Wonderland"),
+]
+AUTHOR_FIXES = {'The Metamorphosis': ['Kafka, Franz']}
+
 
 def load_rdf_list(fname, top_level, overwrite=False):
     if os.path.exists(fname) and not overwrite:
@@ -58,6 +100,249 @@ def get_book_url(files):
     return '', ''
 
 
+def get_rdf_id(rdf): return rdf.split('/')[-1].split('.')[0][2:]
+
+
+def _iter_tar(fileobj, idset, skip):
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile() or not RE_RDF_NAME.search(member.name):
+                continue
+            if idset and get_rdf_id(member.name) not in idset:
+                continue
+            stat = (int(member.mtime), member.size)
+            if skip and skip(member.name, stat):
+                continue
+            yield member.name, tar.extractfile(member).read(), stat
+
+
+def iter_tar_rdfs(tar_name, idset=None, skip=None):
+    """ Yields (name, content, (mtime, size)) of each RDF file in the tar archive tar_name, or in the tar inside the
+        zip archive tar_name, in archive order, in one sequential read. Files whose ID is not in idset (if given), or
+        for which skip(name, (mtime, size)) is true, are not read.
+    """
+    if tar_name.endswith('.zip'):
+        with zipfile.ZipFile(tar_name) as zip_file:
+            tar_members = [x for x in zip_file.namelist() if x.endswith('.tar')]
+            if not tar_members:
+                raise ValueError('no tar archive in {}'.format(tar_name))
+            with zip_file.open(tar_members[0]) as f:
+                yield from _iter_tar(f, idset, skip)
+    else:
+        with open(tar_name, 'rb') as f:
+            yield from _iter_tar(f, idset, skip)
+
+
+def iter_rdf_files(rdf_names, skip=None):
+    """ Yields (name, None, (mtime, size)) of each RDF file of rdf_names (content is read later), except those for
+        which skip(name, (mtime, size)) is true. Without skip, files are not stat'ed.
+    """
+    for name in rdf_names:
+        stat = None
+        if skip:
+            st = os.stat(name)
+            stat = (int(st.st_mtime), st.st_size)
+            if skip(name, stat):
+                continue
+        yield name, None, stat
+
+
+def parse_rdf(rdf, xml=None):
+    """ Returns the catalog record (id, title, author, url, book_format) of an RDF file (or of its content xml), or
+        None for books that are not English texts with a title and author.
+    """
+    id_ = get_rdf_id(rdf)
+    json_d = rdf2json(rdf, xml)
+
+    title = json_d.get('title')
+    author = json_d.get('author')
+    if not title or not author:
+        return None
+    lang = json_d['language']
+    if lang != ["en"]:
+        return None
+    type_ = json_d['type']
+    if type_ != 'Text':
+        return None
+
+    book_url, book_format = get_book_url(json_d['files'])
+    if not book_url or not book_format:
+        print('\nno HTML-formatted text found for', id_)
+    return id_, title, author, book_url, book_format
+
+
+def shard_name(rdf_names):
+    key = hashlib.sha1('\n'.join(rdf_names).encode('utf-8')).hexdigest()
+    return os.path.join(SHARD_DIR, key + '.pk')
+
+
+def parse_shard(job):
+    """ Parses the RDF files of a shard, given as (name, content or None), and saves their records to its
+        checkpoint. Returns the names and the records, in order.
+    """
+    rdfs, use_pickled = job
+    names = [name for name, _ in rdfs]
+    out_name = shard_name(names)
+    if use_pickled and os.path.exists(out_name):
+        with open(out_name, 'rb') as f:
+            return names, pickle.load(f)
+    records = [x for x in itertools.starmap(parse_rdf, rdfs) if x]
+    tmp_name = '{}.{}.tmp'.format(out_name, os.getpid())
+    with open(tmp_name, 'wb') as f:
+        pickle.dump(records, f)
+    os.replace(tmp_name, out_name)
+    return names, records
+
+
+def add_record(catalog, record):
+    id_, title, author, book_url, book_format = record
+    if title not in catalog:
+        catalog[title] = {'author': [], 'url': [], 'book_format': [], 'id': []}
+    catalog[title]['author'].extend(author)
+    catalog[title]['url'].append(book_url)
+    catalog[title]['book_format'].append(book_format)
+    catalog[title]['id'].append(id_)
+
+
+def imap_bounded(pool, func, jobs, max_pending):
+    """ Like pool.imap, but takes at most max_pending jobs from the iterable jobs ahead of the results consumed."""
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.apply_async(func, (job,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_rdfs(rdfs, workers=1, use_pickled=False):
+    """ Parses rdfs, (name, content or None) of RDF files, in shards of SHARD_SIZE, with workers processes. Yields
+        (names, records) of each shard, in order.
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    rdfs = iter(rdfs)
+    jobs = iter(lambda: (list(itertools.islice(rdfs, SHARD_SIZE)), use_pickled), ([], use_pickled))
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        yield from imap_bounded(pool, parse_shard, jobs, 2 * workers)
+        pool.close()
+        pool.join()
+    else:
+        yield from map(parse_shard, jobs)
+
+
+def get_catalog(rdfs, workers=1, use_pickled=False, catalog=None, shards=None):
+    """ Parses rdfs (see parse_rdfs) and merges them into catalog (a new one if None). Adds the name of each shard
+        to shards, if given.
+    """
+    catalog = {} if catalog is None else catalog
+    for shard_num, (names, records) in enumerate(parse_rdfs(rdfs, workers, use_pickled), 1):
+        for record in records:
+            add_record(catalog, record)
+        if shards is not None:
+            shards.add(shard_name(names))
+        print('\rparsed {} shards, {} books for catalog'.format(shard_num, len(catalog)), end='')
+    print()
+    return catalog
+
+
+def load_raw_catalog():
+    """ The catalog of CATALOG_RAW_NAME and the IDs of its books, to resume a run that left no shards."""
+    with open(CATALOG_RAW_NAME, 'rb') as f:
+        catalog = pickle.load(f)
+    done = set(id_ for entry in catalog.values() for id_ in entry['id'])
+    print('loaded {} books from {}'.format(len(catalog), CATALOG_RAW_NAME))
+    return catalog, done
+
+
+def prune_shards(keep):
+    """ Deletes the shards under SHARD_DIR not in keep: those of RDF files no longer listed, and those of the changed
+        files of --incremental runs, which are never reused since shards are keyed by file names only.
+    """
+    stale = [x for x in glob.glob(os.path.join(SHARD_DIR, '*.pk*')) if x not in keep]
+    for name in stale:
+        os.remove(name)
+    if stale:
+        print('deleted {} stale shards from {}'.format(len(stale), SHARD_DIR))
+
+
+class CatalogIndex(object):
+    """ Sidecar index of --incremental: for each RDF ID, the (mtime, size) and sha1 of its file when last seen, and
+        its catalog record (None if the book is not in the catalog).
+    """
+
+    def __init__(self, path=INDEX_NAME):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+        self.order = []  # IDs of this run, in the order of the RDF list (or archive)
+        self.pending = {}  # ID -> ((mtime, size), sha1) of files being parsed
+        self.num_parsed = 0
+
+    def unchanged_stat(self, name, stat):
+        """ Notes the RDF file name in order, returns whether its (mtime, size) is the same as in the index."""
+        id_ = get_rdf_id(name)
+        self.order.append(id_)
+        entry = self.entries.get(id_)
+        return entry is not None and entry['stat'] == stat
+
+    def changed(self, rdfs):
+        """ Yields (name, content) of the files of rdfs, (name, content or None, (mtime, size)), whose content
+            changed. Files with the same content only get their (mtime, size) updated.
+        """
+        for name, xml, stat in rdfs:
+            if xml is None:
+                with open(name, 'rb') as f:
+                    xml = f.read()
+            id_ = get_rdf_id(name)
+            sha1 = hashlib.sha1(xml).hexdigest()
+            entry = self.entries.get(id_)
+            if entry is not None and entry['sha1'] == sha1:
+                entry['stat'] = stat
+                continue
+            self.pending[id_] = (stat, sha1)
+            yield name, xml
+
+    def add_records(self, names, records):
+        records = {x[0]: x for x in records}
+        for name in names:
+            id_ = get_rdf_id(name)
+            stat, sha1 = self.pending.pop(id_)
+            self.entries[id_] = {'stat': stat, 'sha1': sha1, 'record': records.get(id_)}
+            self.num_parsed += 1
+
+    def get_catalog(self):
+        catalog = {}
+        for id_ in self.order:
+            record = self.entries[id_]['record']
+            if record:
+                add_record(catalog, record)
+        return catalog
+
+    def save(self):
+        """ Saves the entries of this run's IDs (others were deleted from the feed, or filtered out by --ids)."""
+        ids = set(self.order)
+        entries = {k: v for k, v in self.entries.items() if k in ids}
+        tmp_name = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_name, 'wb') as f:
+            pickle.dump(entries, f)
+        os.replace(tmp_name, self.path)
+
+
+def get_catalog_incremental(rdfs, index, workers=1):
+    """ Parses the new or changed files of rdfs, (name, content or None, (mtime, size)) of RDF files whose (mtime,
+        size) changed, and returns the catalog of all files noted in index (see CatalogIndex.unchanged_stat).
+    """
+    for shard_num, (names, records) in enumerate(parse_rdfs(index.changed(rdfs), workers), 1):
+        index.add_records(names, records)
+        print('\rparsed {} shards, {} RDF files'.format(shard_num, index.num_parsed), end='')
+    print()
+    print('parsed {} new or changed of {} RDF files'.format(index.num_parsed, len(index.order)))
+    return index.get_catalog()
+
+
 def clean_catalog(catalog):
     if isinstance(catalog, str):
         catalog_str = catalog
@@ -84,14 +369,12 @@ def manual_fix(catalog):
             orig_item['author'].extend(old_authors)
             orig_item['url'].extend(old_urls)
         catalog[k] = orig_item
-    catalog['The Metamorphosis']['author'] = ['Kafka, Franz']
-    catalog['Typee'] = catalog['Typee: A Romance of the South Seas']
-    catalog['The Adventures of Huckleberry Finn'] = catalog['Huckleberry Finn']
-    catalog['Dr Jekyll and Mr Hyde'] = catalog['Dr. Jekyll and Mr. Hyde']
-    catalog["Tess of the D'Urbervilles"] = catalog["Tess of the d'Urbervilles"]
-    catalog["The DeerSlayer"] = catalog["The Deerslayer"]
-    catalog["My Antonia"] = catalog["My Ántonia"]
-    catalog["Alice's Adventures In Wonderland"] = catalog["Alice's Adventures in Wonderland"]
+    for title, author in AUTHOR_FIXES.items():
+        if title in catalog:
+            catalog[title]['author'] = author
+    for alias, title in TITLE_ALIASES:
+        if title in catalog:
+            catalog[alias] = catalog[title]
 
     for k in TO_DELETE:
         if k in catalog:
@@ -108,74 +391,82 @@ def manual_fix(catalog):
     return catalog
 
 
+def get_linked_titles(titles):
+    """ Returns titles and all titles linked to them by manual_fix (ALT_ORIG_MAP, TITLE_ALIASES), transitively."""
+    links = defaultdict(set)
+    for k, v in list(ALT_ORIG_MAP.items()) + TITLE_ALIASES:
+        links[k].add(v)
+        links[v].add(k)
+    linked = set(titles)
+    todo = list(titles)
+    while todo:
+        for title in links[todo.pop()] - linked:
+            linked.add(title)
+            todo.append(title)
+    return linked
+
+
+def clean_catalog_titles(catalog, catalog_cleaned, titles):
+    """ Returns clean_catalog(catalog), given catalog_cleaned, the cleaned catalog of a previous catalog that only
+        differs from catalog in the entries of titles. Only those titles, and the titles linked to them, are cleaned.
+    """
+    linked = get_linked_titles(titles)
+    cleaned = {k: v for k, v in catalog_cleaned.items() if k not in linked}
+    cleaned.update(manual_fix({k: v for k, v in catalog.items() if k in linked}))
+    # same order as manual_fix: titles of catalog, then titles that manual_fix adds
+    added = dict.fromkeys(list(ALT_ORIG_MAP) + [alias for alias, _ in TITLE_ALIASES])
+    order = [k for k in catalog if k in cleaned] + [k for k in added if k in cleaned and k not in catalog]
+    return {k: cleaned[k] for k in order}
+
+
 if __name__ == "__main__":
     args = parser.parse_args()
-    rdf_names = load_rdf_list(RDF_LIST, TOP_LEVEL, OVERWRITE_RDF)
-    if args.full:
-        idset = set()
-        num_total = len(rdf_names)
-    elif args.ids:
+    idset = None
+    if not args.full and args.ids:
         with open(args.ids, 'r') as f:
             idset = set(json.load(f))
-        num_total = len(idset)
+    workers = args.workers or (os.cpu_count() if args.full else 1)
+    index = CatalogIndex() if args.incremental else None
+    skip = index.unchanged_stat if index else None
+    if args.tar:
+        print('parsing RDF files from {} with {} processes'.format(args.tar, workers))
+        rdfs = iter_tar_rdfs(args.tar, idset, skip)
     else:
-        idset = set()
-        num_total = len(rdf_names)
-
-    if args.use_pickled and os.path.exists(CATALOG_RAW_NAME):
-        with open(CATALOG_RAW_NAME, 'rb') as f:
-            catalog = pickle.load(f)
-        print('loaded {} books from {}'.format(len(catalog), CATALOG_RAW_NAME))
-        done = [x['id'] for x in catalog.values()]
-        done = set([item for subl in done for item in subl])
-    else:
-        catalog = {}
-        done = set()
-    for i, rdf in enumerate(rdf_names):
-        id_ = rdf.split('/')[-1].split('.')[0][2:]
-        if idset and id_ not in idset:
-            continue
-        if id_ in done:
-            continue
-
-        json_d = rdf2json(rdf)
-        done.add(id_)
-
-        title = json_d.get('title')
-        author = json_d.get('author')
-        if not title or not author:
-            continue
-        lang = json_d['language']
-        if lang != ["en"]:
-            continue
-        type_ = json_d['type']
-        if type_ != 'Text':
-            continue
-        description = json_d['description']
-
-        if title not in catalog:
-            catalog[title] = {'author': [], 'url': [], 'book_format': [], 'id': []}
-        catalog[title]['author'].extend(author)
-        book_url, book_format = get_book_url(json_d['files'])
-        if not book_url or not book_format:
-            print('\nno HTML-formatted text found for', id_)
-        catalog[title]['url'].append(book_url)
-        catalog[title]['book_format'].append(book_format)
-        catalog[title]['id'].append(id_)
-
-        num_books = len(catalog)
-        print('\rprocessed {}/{} books for catalog'.format(num_books, num_total), end='')
-        if num_books and num_books % 100 == 0:
-            with open(CATALOG_RAW_NAME, 'wb') as f:
-                pickle.dump(catalog, f)
+        rdf_names = load_rdf_list(RDF_LIST, TOP_LEVEL, OVERWRITE_RDF or args.incremental)
+        if idset:
+            rdf_names = [x for x in rdf_names if get_rdf_id(x) in idset]
+        print('parsing {} RDF files with {} processes'.format(len(rdf_names), workers))
+        rdfs = iter_rdf_files(rdf_names, skip)
 
+    old_catalog = None
+    if index:
+        if os.path.exists(CATALOG_RAW_NAME):
+            with open(CATALOG_RAW_NAME, 'rb') as f:
+                old_catalog = pickle.load(f)
+        catalog = get_catalog_incremental(rdfs, index, workers)
+        index.save()
+        prune_shards(set())
+    else:
+        catalog, done = None, set()
+        if args.use_pickled and not glob.glob(os.path.join(SHARD_DIR, '*.pk')) and os.path.exists(CATALOG_RAW_NAME):
+            catalog, done = load_raw_catalog()
+        shards = set()
+        rdfs = ((name, xml) for name, xml, _ in rdfs if get_rdf_id(name) not in done)
+        catalog = get_catalog(rdfs, workers, args.use_pickled, catalog, shards)
+        prune_shards(shards)
     num_books = len(catalog)
     with open(CATALOG_RAW_NAME, 'wb') as f:
         pickle.dump(catalog, f)
     print('collected {} total books for catalog'.format(num_books))
     print('wrote to', CATALOG_RAW_NAME)
 
-    catalog_cleaned = clean_catalog(CATALOG_RAW_NAME)
+    if old_catalog is not None and os.path.exists(CATALOG_NAME):
+        changed = [k for k in set(catalog) | set(old_catalog) if catalog.get(k) != old_catalog.get(k)]
+        print('{} titles changed'.format(len(changed)))
+        with open(CATALOG_NAME, 'rb') as f:
+            catalog_cleaned = clean_catalog_titles(catalog, pickle.load(f), changed)
+    else:
+        catalog_cleaned = clean_catalog(CATALOG_RAW_NAME)
     with open(CATALOG_NAME, 'wb') as f:
         pickle.dump(catalog_cleaned, f)
     print('cleaned and wrote to', CATALOG_NAME)
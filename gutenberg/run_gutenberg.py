@@ -4,18 +4,27 @@ Parse a RDF file from Gutenburg.
 Convert all RDF value to python string and dict.
 Keep value as it is.
 e.g.: do not convert datetime, int, or file format.
+
+rdf2json reads the file once, with ElementTree.iterparse. rdf2json_rdflib is the previous parser (xml2json for the
+ebook, then rdflib for the file URIs), kept as the reference for bench_rdf2json.py.
 """
+import io
 import json
 import sys
+import xml.etree.ElementTree as ET
 from collections import OrderedDict, defaultdict
 from datetime import datetime
+from urllib.parse import urljoin
 
-import rdflib
 from dateutil.parser import parser
 from path import Path
-from rdflib.term import *
 
-from xml2json import xml2json
+from xml2json import xml2json, elem_to_internal, strip_tag
+
+RDF_ABOUT = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about'
+XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+# children of the ebook element that rdf2json reads
+EBOOK_FIELDS = set(['title', 'issued', 'type', 'language', 'downloads', 'subject', 'creator', 'hasFormat'])
 
 
 def print_json(obj):
@@ -44,6 +53,9 @@ def get_uri_to_attrs(rdf_path):
     ...
     }
     """
+    import rdflib
+    from rdflib.term import URIRef
+
     g = rdflib.Graph()
     g.load(rdf_path)
     has_format = URIRef('http://purl.org/dc/terms/hasFormat')
@@ -92,7 +104,7 @@ def get_values(obj):
         return [get_value(obj)]
 
 
-def normalize_file_json(obj, attrs_to_uri):
+def normalize_file_json(obj, uri):
     """
     {
         "modified": "2016-11-04T02:52:05.842547",
@@ -134,19 +146,60 @@ def normalize_file_json(obj, attrs_to_uri):
         'modified_at': obj['modified'],
         'size': obj['extent'],
         'formats': get_values(obj['format']),
-        'uri': attrs_to_uri['{}-{}'.format(obj['modified'], obj['extent'])]
+        'uri': uri
     }
 
 
-def rdf2json(rdf_path):
+def file_key(obj): return '{}-{}'.format(obj['modified'], obj['extent'])
 
-    rdf_path = Path(rdf_path)
-    rdf_json = xml2json(rdf_path.text())
 
+def parse_ebook(rdf_path, xml=None):
+    """
+    Parse a RDF file in one pass. Return the ebook element as xml2json converts it, with only the EBOOK_FIELDS, and
+    the URI (rdf:about) of the file of each hasFormat, in order. If the content xml (bytes) is given, the file is not
+    read.
+    """
+    if xml is None:
+        with open(rdf_path, 'rb') as f:
+            xml = f.read()
+    xml = xml.replace(b'\n', b'').replace(b'\r', b'')  # as xml2json(strip_nl=1)
+
+    ebook_json = OrderedDict()
+    file_uris = []
+    base = ''
+    path = []  # tags from the root to the current element
+    for event, elem in ET.iterparse(io.BytesIO(xml), events=('start', 'end')):
+        if event == 'start':
+            if not path:
+                base = elem.get(XML_BASE, '')
+            path.append(strip_tag(elem.tag))
+            continue
+        tag = path.pop()
+        if len(path) != 2 or path[1] != 'ebook':
+            continue
+        if tag in EBOOK_FIELDS:
+            if tag == 'hasFormat':
+                file_uris.extend(urljoin(base, x.get(RDF_ABOUT, '')) for x in elem)
+            value = elem_to_internal(elem)[tag]
+            # merge repeated tags into a list, as xml2json does
+            if tag not in ebook_json:
+                ebook_json[tag] = value
+            elif isinstance(ebook_json[tag], list):
+                ebook_json[tag].append(value)
+            else:
+                ebook_json[tag] = [ebook_json[tag], value]
+        elem.clear()
+    return ebook_json, file_uris
+
+
+def get_data(rdf_path, ebook_json, get_file_uris):
+    """
+    Extract the fields of an ebook from ebook_json (as converted by xml2json). get_file_uris(file_objs) returns the
+    URI of each file.
+    """
     data = OrderedDict()
-    ebook_json = rdf_json['RDF']['ebook']
 
-    data['id'] = rdf_path.split('/')[-1].split('.')[0][2:]
+    data['id'] = str(rdf_path).split('/')[-1].split('.')[0][2:]
     data['title'] = ebook_json.get('title')
     if not data['title']:
         return data
@@ -170,15 +223,32 @@ def rdf2json(rdf_path):
         data['author'] = [author_name] if author_name else []
     data['description'] = data.get('description', [])
 
-    # map from attrs to uri
-    attrs_to_uri = get_attrs_to_uri(get_uri_to_attrs(rdf_path))
     if isinstance(ebook_json['hasFormat'], list):
-        data['files'] = [normalize_file_json(obj['file'], attrs_to_uri) for obj in ebook_json['hasFormat']]
+        file_objs = [obj['file'] for obj in ebook_json['hasFormat']]
     else:
-        data['files'] = [normalize_file_json(ebook_json['hasFormat']['file'], attrs_to_uri)]
+        file_objs = [ebook_json['hasFormat']['file']]
+    data['files'] = [normalize_file_json(obj, uri) for obj, uri in zip(file_objs, get_file_uris(file_objs))]
     return data
 
 
+def rdf2json(rdf_path, xml=None):
+    ebook_json, file_uris = parse_ebook(rdf_path, xml)
+    return get_data(rdf_path, ebook_json, lambda file_objs: file_uris)
+
+
+def rdf2json_rdflib(rdf_path):
+    """ rdf2json parsing the file twice: with xml2json, then with rdflib for the file URIs (by modified and extent)."""
+    rdf_path = Path(rdf_path)
+    rdf_json = xml2json(rdf_path.text())
+    ebook_json = rdf_json['RDF']['ebook']
+
+    def get_file_uris(file_objs):
+        # map from attrs to uri
+        attrs_to_uri = get_attrs_to_uri(get_uri_to_attrs(rdf_path))
+        return [attrs_to_uri[file_key(obj)] for obj in file_objs]
+    return get_data(rdf_path, ebook_json, get_file_uris)
+
+
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='Parse Gutenberg RDF file')
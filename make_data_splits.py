@@ -1,16 +1,17 @@
 """
 make_data_splits.py
 
-Makes train/val/test splits for data, saves them as .pk files.
+Makes train/val/test splits for data, saves them as .pk files (and optionally as Arrow / Parquet files, see --formats).
 """
 
 import argparse
+import hashlib
 import json
 import os
 import re
 import sys
 from collections import defaultdict
-from copy import deepcopy
+from collections.abc import Mapping
 
 import dill as pickle
 
@@ -22,6 +23,12 @@ from scrape_vars import RE_CHAPTER
 SPLITS_NAME = './splits.json'
 PAIR_IDS_NAME = './pair_ids_expected.json'
 OUT_DIR = 'raw_splits'
+FORMATS = ['pk', 'arrow', 'parquet']
+BATCH_ROWS = 256  # rows per Arrow record batch / Parquet row group
+CACHE_DIR = 'cache/splits'
+SHARD_ROWS = 1000  # chapters per JSONL shard of --stream
+ZSTD_LEVEL = 10
+FRAGMENT_VERSION = 2  # bump when the processing of a book changes, to invalidate cached fragments
 
 parser = argparse.ArgumentParser(description='make train/val/test .pk files')
 parser.add_argument('--summaries', '-su', nargs='*', default=SUMMARY_PATHS, help='paths to summaries')
@@ -29,6 +36,14 @@ parser.add_argument('--splits', '-sp', default=SPLITS_NAME, help='path to split
 parser.add_argument('--raw_texts', '-rt', default=PICKLE_NAME, help='path to raw texts')
 parser.add_argument('--out_dir', '-o', default=OUT_DIR, help='directory to write split .pks to')
 parser.add_argument('--pair_ids_expected', '-pi', default=PAIR_IDS_NAME, help='path to expected pair ids JSON')
+parser.add_argument('--formats', '-f', nargs='+', default=['pk'], choices=FORMATS,
+                    help='formats to write splits in (arrow and parquet need pyarrow)')
+parser.add_argument('--incremental', '-i', action='store_true',
+                    help='only rebuild books whose raw text or summaries changed since the last incremental run')
+parser.add_argument('--stream', action='store_true',
+                    help='build one book at a time and write JSONL shards (zstd-compressed with zstandard) instead')
+parser.add_argument('--cache_dir', default=CACHE_DIR,
+                    help='directory for the per-book cache of --incremental and --stream')
 
 # could integrate into *_scrape.py scripts, but quick fix to avoid rescraping
 expected_errors = set([
@@ -105,59 +120,108 @@ def validate_pair_ids(pair_ids, expected_name):
         print('to fix, try deleting and rescraping the books with issues (see FAQ.md)')
 
 
-def get_section_titles(all_sections, sect, title=None):
-    """ all_sections (list): list of section titles
-        sect (str): section name
-    """
+# (title, section) -> parts of the section, where a part like 'Chapter 80-86' is a range of chapters to expand
+SPECIAL_SECTIONS = {
+    ('Siddhartha', 'Part 1'): ['Part 1:  {}'.format(x) for x in [
+        "The Brahmin's Son", 'With the Samanas', 'Gotama', 'Awakening']],
+    ('Siddhartha', 'Part 2'): ['Part 2:  {}'.format(x) for x in [
+        'Kamala', 'Amongst the People', 'Samsara', 'By the River', 'The Ferryman', 'The Son', 'Om', 'Govinda']],
+    ('Middlemarch', 'Chapter 80-Finale'): ['Chapter 80-86', 'Finale'],
+    ("A Connecticut Yankee in King Arthur's Court", 'Chapter 31-Postscript'): ['Chapter 31-45'],
+    ("A Connecticut Yankee in King Arthur's Court", 'Chapter 44-Postscript'): ['Chapter 31-45'],
+    ("The Prince and the Pauper", 'Chapter 33-Conclusion'): ['Chapter 33', 'Conclusion'],
+    ("The Three Musketeers", 'Chapter 64-Epilogue'): ['Chapter 64-67', 'Epilogue'],
+    ("The Three Musketeers", 'Conclusion-Epilogue'): ['Chapter 67', 'Epilogue'],
+    ("Winesburg, Ohio", 'Godliness'): ['Godliness Part 1-4'],
+    ("The Picture of Dorian Gray", 'Preface-Chapter 2'): ['Preface', 'Chapter 1-2'],
+    ("Typee", 'Preface-Chapter 5'): ['Preface', 'Chapter 1-5'],
+}
+
+_section_titles_cache = {}  # (title, sect) -> tuple of section titles not depending on the book's sections
+_book_subsections = {}  # title -> (frozenset of the book's sections, {lowercased prefix: sorted subsections})
+
+
+def expand_range(sect):
+    """ Returns the tuple of chapters of sect if it has a chapter range, e.g. 'Chapter 3-5', else None."""
     chapter_range = re.search(RE_MULTI_CHAPTER, sect)
-    if chapter_range and 'Letters' in sect:
+    if not chapter_range:
+        return None
+    if 'Letters' in sect:
         sect = sect.replace('Letters', 'Letter')
+    base = re.sub(RE_MULTI_CHAPTER, '', sect)
+    start, end = chapter_range[0].split('-', 1)
+    return tuple('{}{}'.format(base, i) for i in range(int(start), int(end) + 1))
+
+
+def _compile_special_sections(special_sections):
+    return {key: tuple(x for part in parts for x in (expand_range(part) or (part,)))
+            for key, parts in special_sections.items()}
 
-    if title == 'Siddhartha' and sect == 'Part 1':
-        titles = ["The Brahmin's Son", 'With the Samanas', 'Gotama', 'Awakening']
-        return ['Part 1:  {}'.format(title) for title in titles]
-    elif title == 'Siddhartha' and sect == 'Part 2':
-        titles = ['Kamala', 'Amongst the People', 'Samsara', 'By the River', 'The Ferryman', 'The Son', 'Om', 'Govinda']
-        return ['Part 2:  {}'.format(title) for title in titles]
-    elif title == 'Middlemarch' and sect == 'Chapter 80-Finale':
-        return get_section_titles(all_sections, 'Chapter 80-86', title) + ['Finale']
-    elif title == "A Connecticut Yankee in King Arthur's Court" and sect == 'Chapter 31-Postscript':
-        return get_section_titles(all_sections, 'Chapter 31-45', title)
-    elif title == "A Connecticut Yankee in King Arthur's Court" and sect == 'Chapter 44-Postscript':
-        return get_section_titles(all_sections, 'Chapter 31-45', title)
-    elif title == "The Prince and the Pauper" and sect == 'Chapter 33-Conclusion':
-        return ['Chapter 33', 'Conclusion']
-    elif title == "The Three Musketeers" and sect == 'Chapter 64-Epilogue':
-        return get_section_titles(all_sections, 'Chapter 64-67', title) + ['Epilogue']
-    elif title == "The Three Musketeers" and sect == 'Conclusion-Epilogue':
-        return ['Chapter 67', 'Epilogue']
-    elif title == "Winesburg, Ohio" and sect == 'Godliness':
-        return get_section_titles(all_sections, 'Godliness Part 1-4', title)
-    elif title == "The Picture of Dorian Gray" and sect == 'Preface-Chapter 2':
-        return ['Preface'] + get_section_titles(all_sections, 'Chapter 1-2', title)
-    elif title == "Typee" and sect == 'Preface-Chapter 5':
-        return ['Preface'] + get_section_titles(all_sections, 'Chapter 1-5', title)
-
-    if chapter_range:
-        chapters = []
-        base = re.sub(RE_MULTI_CHAPTER, '', sect)
-        start, end = chapter_range[0].split('-', 1)
-        for i in range(int(start), int(end) + 1):
-            chapter = '{}{}'.format(base, i)
-            chapters.append(chapter)
-    elif ',' in sect:
-        chapters = [x.strip() for x in sect.split(',')]
-    elif not re.match(RE_CHAPTER, sect):
-        keys = [x for x in all_sections if x.lower().startswith(sect.lower() + ':')]
+
+SPECIAL_SECTION_TITLES = _compile_special_sections(SPECIAL_SECTIONS)
+
+
+def get_subsection_index(all_sections):
+    """ Indexes sections of the form '<prefix>: ... <num>' by lowercased prefix (at each ':'), each sorted by num.
+        A prefix whose sections do not all end in a number maps to the ValueError instead.
+    """
+    groups = defaultdict(list)
+    for x in all_sections:
+        x_lower = x.lower()
+        k = x_lower.find(':')
+        while k != -1:
+            groups[x_lower[:k]].append(x)
+            k = x_lower.find(':', k + 1)
+    index = {}
+    for prefix, keys in groups.items():
         try:
-            chapters = sorted(keys, key=lambda x: int(x.rsplit(' ', 1)[-1]))
-            if not chapters:
-                chapters = [sect]
+            index[prefix] = tuple(sorted(keys, key=lambda x: int(x.rsplit(' ', 1)[-1])))
         except ValueError as e:
-            print(e, title)
-            chapters = [sect]
+            index[prefix] = e
+    return index
+
+
+def get_subsections(all_sections, sect, title=None):
+    """ Returns the sections of all_sections that are subsections of sect, e.g. 'Part 1' -> 'Part 1: ... 1', ...
+        The index of all_sections is cached per title, and rebuilt if the sections of the book change.
+    """
+    cached = _book_subsections.get(title) if title is not None else None
+    if cached is not None and cached[0] == all_sections:
+        index = cached[1]
     else:
-        chapters = [sect]
+        index = get_subsection_index(all_sections)
+        if title is not None:
+            _book_subsections[title] = (frozenset(all_sections), index)
+    chapters = index.get(sect.lower(), ())
+    if isinstance(chapters, ValueError):
+        print(chapters, title)
+        return (sect,)
+    return chapters or (sect,)
+
+
+def get_section_titles(all_sections, sect, title=None):
+    """ all_sections (iterable): section titles of the book
+        sect (str): section name
+        title (str): book title, for special cases and caching
+
+        Returns the tuple of section titles that sect spans. Results are memoized, so treat them as read-only.
+    """
+    key = (title, sect)
+    if key in _section_titles_cache:
+        return _section_titles_cache[key]
+    if key in SPECIAL_SECTION_TITLES:
+        chapters = SPECIAL_SECTION_TITLES[key]
+    else:
+        chapters = expand_range(sect)
+        if chapters is None:
+            if ',' in sect:
+                chapters = tuple(x.strip() for x in sect.split(','))
+            elif not re.match(RE_CHAPTER, sect):
+                # depends on all_sections, so cached per book in get_subsections instead
+                return get_subsections(all_sections, sect, title)
+            else:
+                chapters = (sect,)
+    _section_titles_cache[key] = chapters
     return chapters
 
 
@@ -218,26 +282,31 @@ def get_title_sect_map(raw_texts):
     return title_sect_map
 
 
+def get_split_name(title):
+    if title in splits['train']:
+        return 'train'
+    elif title in splits['val']:
+        return 'val'
+    elif title in splits['test']:
+        return 'test'
+
+
 def get_split_ds(base_d):
     split_ds = {'train': [], 'val': [], 'test': []}
     for sect_id, sect_obj in base_d.items():
         title, sect = split_title_sect(sect_id)
-        if title in splits['train']:
-            split_d = split_ds['train']
-        elif title in splits['val']:
-            split_d = split_ds['val']
-        elif title in splits['test']:
-            split_d = split_ds['test']
-        split_d.append(sect_obj)
+        split_ds[get_split_name(title)].append(sect_obj)
     return split_ds
 
 
-def get_base_ds_source(base_d):
+def get_base_ds_source(base_d, sect_titles_expanded=None):
     """ Returns dict base_ds, which has entries
         str source_name: summary_d
+        and the section titles of each sect_id. Those already in sect_titles_expanded (e.g. cached) are not expanded
+        again.
     """
     base_ds = defaultdict(lambda: defaultdict(dict))
-    sect_titles_expanded = {}
+    sect_titles_expanded = dict(sect_titles_expanded or {})
 
     for sect_id, item in base_d.items():
         for summary_d in item['summaries']:
@@ -250,13 +319,68 @@ def get_base_ds_source(base_d):
                 continue
             if text:
                 base_ds[source][title][sect] = (text, link)
-            book_chapters = raw_texts[title].keys()
-            sect_titles_expanded[sect_id] = get_section_titles(book_chapters, sect, title)
+            if sect_id not in sect_titles_expanded:
+                book_chapters = raw_texts[title].keys()
+                sect_titles_expanded[sect_id] = get_section_titles(book_chapters, sect, title)
     return base_ds, sect_titles_expanded
 
 
+class SummaryOverlay(Mapping):
+    """ Read-only view of base_d with extra summaries for some sect_ids. The chapter records of base_d are not
+        copied; a record with extra summaries is merged (shallowly, sharing its raw_text) only when accessed.
+    """
+    def __init__(self, base_d, added_summaries):
+        self.base_d = base_d
+        self.added_summaries = added_summaries
+
+    def __getitem__(self, sect_id):
+        item = self.base_d[sect_id]
+        added = self.added_summaries.get(sect_id)
+        if not added:
+            return item
+        return dict(item, summaries=item['summaries'] + added)
+
+    def __iter__(self):
+        return iter(self.base_d)
+
+    def __len__(self):
+        return len(self.base_d)
+
+
+def get_range_index(source_title_d):
+    """ Indexes the multi-chapter sections of one source for a book by first chapter and last chapter number,
+        e.g. 'Chapter 3-5' -> range_index['Chapter 3']['5']. A section is indexed at each of its '-'s.
+    """
+    range_index = defaultdict(dict)
+    for sect in source_title_d:
+        k = sect.find('-')
+        while k != -1:
+            range_index[sect[:k]][sect[k + 1:]] = sect
+            k = sect.find('-', k + 1)
+    return range_index
+
+
+def find_longest_range(ranges, last_positions, i):
+    """ Of the ranges starting at chapter i (ranges: {last chapter number: section}), returns the one ending at the
+        furthest chapter of the section, and the index of that chapter, or (None, i) if there are none.
+    """
+    cand, cand_j = None, i
+    for last, sect_range in ranges.items():
+        j = last_positions.get(last, -1)
+        if j > cand_j:
+            cand, cand_j = sect_range, j
+    return cand, cand_j
+
+
 def compose_multi_sect(base_d, base_ds_source, sect_titles_expanded):
-    base_d_expanded = deepcopy(base_d)
+    """ Composes summaries of multi-chapter sections from the summaries of their parts, for each source that does
+        not have the section itself. Returns base_d with the composed summaries added, as a SummaryOverlay.
+
+        The parts are chosen greedily from the first chapter: the longest range summary starting there, else the
+        single chapter summary. Ranges are looked up in an index per (source, title) (see get_range_index).
+    """
+    added_summaries = defaultdict(list)
+    range_indexes = {}
     for sect_id, item in base_d.items():
         title, sect = split_title_sect(sect_id)
         if title not in raw_texts:
@@ -264,12 +388,18 @@ def compose_multi_sect(base_d, base_ds_source, sect_titles_expanded):
         sect_titles = sect_titles_expanded[sect_id]
         if len(sect_titles) < 2: # not multi-part
             continue
+        last_positions = None
         for source, base_d_source in base_ds_source.items():
             source_title_d = base_d_source[title]
             if not source_title_d: continue
             if sect in source_title_d:
     #             print('already exists', sect_id, source)
                 continue
+            if (source, title) not in range_indexes:
+                range_indexes[(source, title)] = get_range_index(source_title_d)
+            range_index = range_indexes[(source, title)]
+            if last_positions is None: # chapter number -> index of its last occurrence in sect_titles
+                last_positions = {x.rsplit(' ', 1)[-1]: j for j, x in enumerate(sect_titles)}
 
             new_sect = []
             links = []
@@ -278,24 +408,20 @@ def compose_multi_sect(base_d, base_ds_source, sect_titles_expanded):
             sect_title_len = len(sect_titles)
             while i < sect_title_len:
                 chap = sect_titles[i]
-                match = False
-                for j in range(sect_title_len - 1, i, -1):
-                    cand = '{}-{}'.format(chap, sect_titles[j].rsplit(' ', 1)[-1])
-                    if cand in source_title_d:
-                        curr_text, link = source_title_d[cand]
-                        if isinstance(curr_text, list):
-                            new_sect.extend(curr_text)
-                        elif isinstance(curr_text, str):
-                            new_sect.append(curr_text)
-                        links.append(link)
-                        cand_id = '{}.{}'.format(title, cand)
-                        added_sects = sect_titles_expanded[cand_id]
-                        assert not added_sects_all.intersection(added_sects)
-                        added_sects_all.update(added_sects)
-                        i = j + 1
-                        match = True
-                        break
-                if not match: # try finding just the chapter
+                cand, j = find_longest_range(range_index.get(chap, {}), last_positions, i)
+                if cand is not None:
+                    curr_text, link = source_title_d[cand]
+                    if isinstance(curr_text, list):
+                        new_sect.extend(curr_text)
+                    elif isinstance(curr_text, str):
+                        new_sect.append(curr_text)
+                    links.append(link)
+                    cand_id = '{}.{}'.format(title, cand)
+                    added_sects = sect_titles_expanded[cand_id]
+                    assert not added_sects_all.intersection(added_sects)
+                    added_sects_all.update(added_sects)
+                    i = j + 1
+                else: # try finding just the chapter
                     chap_lower = chap.lower() # for War and Peace
                     if chap_lower in source_title_d:
                         chap = chap_lower
@@ -321,9 +447,9 @@ def compose_multi_sect(base_d, base_ds_source, sect_titles_expanded):
             if sect_titles[-1] in added_sects_all:
                 assert(added_sects_all == set(sect_titles))
                 summ_d = {'summary': new_sect, 'source': source, 'link': links}
-                base_d_expanded[sect_id]['summaries'].append(summ_d)
+                added_summaries[sect_id].append(summ_d)
 
-    return base_d_expanded
+    return SummaryOverlay(base_d, added_summaries)
 
 
 def count_summaries(split_d): return sum([len(x['summaries']) for x in split_d])
@@ -346,33 +472,84 @@ def print_split_ds(base_d):
     return split_ds
 
 
-def get_pair_ids(base_d):
-    pair_ids = []
-    for sect_id, book_summ in base_d.items():
-        for summ_d in book_summ['summaries']:
-            summ_name = summ_d['source']
-            pair_id = '{}.{}'.format(sect_id, summ_name)
-            pair_ids.append(pair_id)
-    return pair_ids
+def count_tokens(paragraphs): return sum(len(x.split()) for x in paragraphs)
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    with open(args.splits, 'r') as f:
-        splits = json.load(f)
-        splits = {k: set(v) for k, v in splits.items()}
-    with open(args.raw_texts, 'rb') as f:
-        raw_texts = pickle.load(f)
-    all_titles_raw = set(raw_texts.keys())
-    all_titles_splits = splits['test'] | splits['train'] | splits['val']
-    validate_titles(all_titles_raw, all_titles_splits)
-    print('{} books total, train: {}, val: {}, test: {}'.format(
-        len(all_titles_splits), len(splits['train']), len(splits['val']), len(splits['test'])))
+def to_list(x): return x if isinstance(x, list) else [x]
+
+
+def get_split_table(split_d):
+    """ Returns a pyarrow Table with one row per (chapter, summary) pair of split_d. The raw text of a chapter is
+        stored once, as a dictionary entry referenced by each of its rows.
+    """
+    import pyarrow as pa
+
+    columns = defaultdict(list)
+    raw_texts_split = []
+    for chap_idx, sect_obj in enumerate(split_d):
+        raw_text = sect_obj['raw_text']
+        raw_texts_split.append('\n'.join(raw_text))
+        raw_text_chars = sum(len(x) for x in raw_text)
+        raw_text_tokens = count_tokens(raw_text)
+        for summ_d in sect_obj['summaries']:
+            summary = to_list(summ_d['summary'])
+            columns['id'].append(sect_obj['id'])
+            columns['source'].append(summ_d['source'])
+            columns['link'].append(to_list(summ_d['link']))
+            columns['summary'].append(summary)
+            columns['raw_text'].append(chap_idx)
+            columns['summary_chars'].append(sum(len(x) for x in summary))
+            columns['summary_tokens'].append(count_tokens(summary))
+            columns['raw_text_chars'].append(raw_text_chars)
+            columns['raw_text_tokens'].append(raw_text_tokens)
+
+    raw_text_col = pa.DictionaryArray.from_arrays(pa.array(columns.pop('raw_text'), pa.int32()),
+                                                  pa.array(raw_texts_split, pa.large_string()))
+    return pa.table({
+        'id': pa.array(columns['id'], pa.string()),
+        'source': pa.array(columns['source'], pa.string()).dictionary_encode(),
+        'link': pa.array(columns['link'], pa.list_(pa.string())),
+        'summary': pa.array(columns['summary'], pa.list_(pa.large_string())),
+        'raw_text': raw_text_col,
+        'summary_chars': pa.array(columns['summary_chars'], pa.int64()),
+        'summary_tokens': pa.array(columns['summary_tokens'], pa.int64()),
+        'raw_text_chars': pa.array(columns['raw_text_chars'], pa.int64()),
+        'raw_text_tokens': pa.array(columns['raw_text_tokens'], pa.int64()),
+    })
+
+
+def write_split(split_d, out_dir, split_name, fmt):
+    """ Writes split_d in format fmt (one of FORMATS), returns the path written to.
+        pk: dill pickle of the list of chapter dicts.
+        arrow: Arrow IPC file, which loaders can memory-map (pyarrow.memory_map + pyarrow.ipc.open_file).
+        parquet: Parquet file, with raw_text dictionary-encoded.
+    """
+    out_name = os.path.join(out_dir, '{}.{}'.format(split_name, fmt))
+    if fmt == 'pk':
+        with open(out_name, 'wb') as f:
+            pickle.dump(split_d, f)
+        return out_name
 
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = get_split_table(split_d)
+    if fmt == 'arrow':
+        with pa.OSFile(out_name, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=BATCH_ROWS)
+    elif fmt == 'parquet':
+        pq.write_table(table, out_name, row_group_size=BATCH_ROWS, use_dictionary=['source', 'raw_text'],
+                       dictionary_pagesize_limit=1 << 30)
+    return out_name
+
+
+def get_base_d(summary_paths, all_titles_raw):
+    """ Returns base_d with the summaries of all books of summary_paths that have raw texts."""
     title_sect_map = get_title_sect_map(raw_texts)
 
     base_d = {}
-    for i, source_summ_name in enumerate(args.summaries):
+    for i, source_summ_name in enumerate(summary_paths):
         with open(source_summ_name, 'rb') as f:
             source_obj = pickle.load(f)
         errors = False
@@ -391,19 +568,333 @@ if __name__ == "__main__":
                 bs = book_summary.section_summaries
             # if title == 'Madame Bovary' and source == 'barrons':
             #     import pdb; pdb.set_trace()
+    return base_d
+
+
+###
+# Incremental build (--incremental)
+###
+def fingerprint(obj): return hashlib.sha1(pickle.dumps(obj)).hexdigest()
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def load_pk(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def dump_pk(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def shard_path(cache_dir, kind, key): return os.path.join(cache_dir, kind, key + '.pk')
+
+
+class RawTextShards(Mapping):
+    """ raw_texts read from per-book shards in the cache, each loaded only when a book is rebuilt. Only the last
+        loaded book is kept in memory.
+    """
+
+    def __init__(self, cache_dir, book_fps):
+        self.cache_dir = cache_dir
+        self.book_fps = book_fps  # title -> fingerprint of its raw text
+        self.loaded = (None, None)
+
+    def __getitem__(self, title):
+        if self.loaded[0] != title:
+            self.loaded = (title, load_pk(shard_path(self.cache_dir, 'raw', self.book_fps[title])))
+        return self.loaded[1]
+
+    def __contains__(self, title):
+        return title in self.book_fps
+
+    def __iter__(self):
+        return iter(self.book_fps)
+
+    def __len__(self):
+        return len(self.book_fps)
+
+
+def update_shards(path, entry, cache_dir, kind, get_books):
+    """ Returns the manifest entry for the pickle at path: its stat and the (title, fingerprint) of each book, in
+        order. The pickle is only loaded if its stat changed since entry; then each book is saved as a shard.
+    """
+    stat = file_stat(path)
+    if entry and entry['stat'] == stat:
+        return entry
+    print('{} changed, updating shards'.format(path))
+    books = []
+    for title, obj in get_books(load_pk(path)):
+        fp = fingerprint(obj)
+        if not os.path.exists(shard_path(cache_dir, kind, fp)):
+            dump_pk(obj, shard_path(cache_dir, kind, fp))
+        books.append((title, fp))
+    return {'stat': stat, 'books': books}
+
+
+def build_book(title, book_summaries):
+    """ Processes all summaries of one book, like the full build. Returns its fragment: the base_d entries (in
+        insertion order), for each the index of the book summary that added it, the errors, the expansions, and the
+        source of each book summary.
+    """
+    title_sect_map = {title: set(raw_texts[title].keys())}
+    base_d_book, added_by, errors = {}, [], []
+    for k, book_summary in enumerate(book_summaries):
+        error_sects = frozenset(process_book_summary(book_summary, title_sect_map, base_d_book))
+        added_by.extend([k] * (len(base_d_book) - len(added_by)))
+        if error_sects:
+            errors.append((k, book_summary.source, error_sects, sorted(title_sect_map[title]),
+                           sorted(x[0] for x in book_summary.section_summaries)))
+    _, sect_titles_expanded = get_base_ds_source(base_d_book)
+    return {'base_d': base_d_book, 'added_by': added_by, 'errors': errors, 'expanded': sect_titles_expanded,
+            'sources': [x.source for x in book_summaries]}
+
+
+def get_book_occurrences(summary_paths, manifest, cache_dir):
+    """ Updates the summary shards of manifest. Returns {title: [(path index, position in path, fingerprint), ...]}
+        for the book summaries of each book with a raw text, in the order of the full build.
+    """
+    manifest_summaries = manifest.setdefault('summaries', {})
+    occurrences = defaultdict(list)
+    for path_idx, path in enumerate(summary_paths):
+        entry = update_shards(path, manifest_summaries.get(path), cache_dir, 'summaries',
+                              lambda books: [(x.title, x) for x in books])
+        manifest_summaries[path] = entry
+        for pos, (title, fp) in enumerate(entry['books']):
+            if title in raw_texts:
+                occurrences[title].append((path_idx, pos, fp))
+    return occurrences
+
+
+def get_book_fragment(title, occ, cache_dir):
+    """ Returns (book key, fragment, whether it was rebuilt) for the book with book summaries occ. Prints the
+        unexpected errors of the book.
+    """
+    summary_fps = [fp for _, _, fp in occ]
+    book_key = fingerprint((FRAGMENT_VERSION, raw_texts.book_fps[title], summary_fps))
+    fragment_path = shard_path(cache_dir, 'books', book_key)
+    rebuilt = not os.path.exists(fragment_path)
+    if rebuilt:
+        book_summaries = [load_pk(shard_path(cache_dir, 'summaries', fp)) for fp in summary_fps]
+        fragment = build_book(title, book_summaries)
+        dump_pk(fragment, fragment_path)
+    else:
+        fragment = load_pk(fragment_path)
+    for k, source, error_sects, sects_gutenberg, sects_source in fragment['errors']:
+        if (title, source, error_sects) not in expected_errors:
+            print('DEBUG: error for book {} from source {}'.format(title, source))
+            print('sections in gutenberg', sects_gutenberg)
+            print('sections in source   ', sects_source)
+            print('sections not found   ', sorted(error_sects))
+    return book_key, fragment, rebuilt
+
+
+def get_base_d_incremental(summary_paths, manifest, cache_dir):
+    """ Returns (base_d, sect_titles_expanded, book_keys) as the full build would, rebuilding only the books whose
+        raw text or summaries changed since the last run, and reading the others from their cached fragments.
+    """
+    occurrences = get_book_occurrences(summary_paths, manifest, cache_dir)
+    base_d, sect_titles_expanded, book_keys = {}, {}, {}
+    sort_keys = {}
+    num_rebuilt = 0
+    for title, occ in occurrences.items():
+        book_keys[title], fragment, rebuilt = get_book_fragment(title, occ, cache_dir)
+        num_rebuilt += rebuilt
+        for i, (sect_id, k) in enumerate(zip(fragment['base_d'], fragment['added_by'])):
+            sort_keys[sect_id] = occ[k][:2] + (i,)
+        base_d.update(fragment['base_d'])
+        sect_titles_expanded.update(fragment['expanded'])
+    print('rebuilt {} of {} books'.format(num_rebuilt, len(occurrences)))
+
+    # same order as the full build: by summaries path, then book, then as added
+    base_d = {sect_id: base_d[sect_id] for sect_id in sorted(base_d, key=sort_keys.__getitem__)}
+    return base_d, sect_titles_expanded, book_keys
+
+
+def get_split_fp(split_d, base_ds_source, book_keys, fmt):
+    """ Fingerprint of what write_split writes for split_d: its sections in order, the fragments of its books, and
+        the order of sources (the order of composed summaries).
+    """
+    sect_ids = [x['id'] for x in split_d]
+    titles = sorted(set(split_title_sect(x)[0] for x in sect_ids))
+    return fingerprint((fmt, list(base_ds_source), sect_ids, [book_keys[x] for x in titles]))
+
+
+def prune_cache(manifest, cache_dir, book_keys):
+    """ Removes shards and fragments that the manifest no longer refers to."""
+    used = {'raw': set(fp for _, fp in manifest['raw_texts']['books']), 'books': set(book_keys.values()),
+            'summaries': set(fp for entry in manifest['summaries'].values() for _, fp in entry['books'])}
+    for kind, keys in used.items():
+        kind_dir = os.path.join(cache_dir, kind)
+        for fname in os.listdir(kind_dir) if os.path.isdir(kind_dir) else []:
+            if fname[:-len('.pk')] not in keys:
+                os.remove(os.path.join(kind_dir, fname))
+
+
+###
+# Streaming build (--stream)
+###
+class ShardWriter(object):
+    """ Writes the chapters of one split as JSON lines, zstd-compressed if zstandard is installed, into shards of
+        about SHARD_ROWS chapters (a book is never split across shards), and an index of the shards and books.
+    """
+
+    def __init__(self, out_dir, split_name):
+        self.out_dir = out_dir
+        self.split_name = split_name
+        try:
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            self.ext = 'jsonl.zst'
+        except ImportError:
+            self.compressor = None
+            self.ext = 'jsonl'
+        self.f = None
+        self.shards = []  # [{'name': ..., 'rows': ...}]
+        self.books = {}  # title -> {'shard': index into shards, 'start': first row, 'rows': ...}
+        for fname in os.listdir(out_dir):  # shards of a previous run
+            if fname.startswith(split_name + '-') and '.jsonl' in fname:
+                os.remove(os.path.join(out_dir, fname))
+
+    def _next_shard(self):
+        self.close_shard()
+        name = '{}-{:05d}.{}'.format(self.split_name, len(self.shards), self.ext)
+        f = open(os.path.join(self.out_dir, name), 'wb')
+        self.f = self.compressor.stream_writer(f) if self.compressor else f
+        self.shards.append({'name': name, 'rows': 0})
+
+    def write_book(self, title, chapters):
+        if self.f is None or self.shards[-1]['rows'] >= SHARD_ROWS:
+            self._next_shard()
+        shard = self.shards[-1]
+        self.books[title] = {'shard': len(self.shards) - 1, 'start': shard['rows'], 'rows': len(chapters)}
+        for sect_obj in chapters:
+            self.f.write(json.dumps(sect_obj).encode('utf-8') + b'\n')
+        shard['rows'] += len(chapters)
+
+    def close_shard(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def close(self):
+        """ Closes the last shard and writes the index, returns its path."""
+        self.close_shard()
+        index_name = os.path.join(self.out_dir, '{}.index.json'.format(self.split_name))
+        with open(index_name, 'w') as f:
+            json.dump({'shards': self.shards, 'books': self.books}, f, indent=1)
+        return index_name
+
+
+def write_splits_streaming(summary_paths, manifest, cache_dir, out_dir):
+    """ Builds and writes the splits one book at a time, so that only one book is in memory (besides the shards of
+        the summary pickles being updated, see update_shards). Returns (pair_ids, book_keys).
+
+        Chapters are grouped by book, in the order books first appear in summary_paths, and composed summaries are
+        ordered by summary path. Otherwise the chapters are the same as in the .pk splits.
+    """
+    occurrences = get_book_occurrences(summary_paths, manifest, cache_dir)
+    writers = {x: ShardWriter(out_dir, x) for x in ['train', 'val', 'test']}
+    counts = defaultdict(lambda: [0, 0])  # split -> [chapters, pairs]
+    pair_ids, book_keys = [], {}
+    num_rebuilt = 0
+    for title, occ in occurrences.items():
+        book_keys[title], fragment, rebuilt = get_book_fragment(title, occ, cache_dir)
+        num_rebuilt += rebuilt
+        base_d_book = fragment['base_d']
+        base_ds_book, sect_titles_expanded = get_base_ds_source(base_d_book, fragment['expanded'])
+        base_ds_book = {x: base_ds_book[x] for x in dict.fromkeys(fragment['sources']) if x in base_ds_book}
+        base_d_expanded = compose_multi_sect(base_d_book, base_ds_book, sect_titles_expanded)
+
+        split_name = get_split_name(title)
+        writers[split_name].write_book(title, list(base_d_expanded.values()))
+        book_pair_ids = get_pair_ids(base_d_expanded)
+        pair_ids.extend(book_pair_ids)
+        counts[split_name][0] += len(base_d_expanded)
+        counts[split_name][1] += len(book_pair_ids)
+    print('rebuilt {} of {} books'.format(num_rebuilt, len(occurrences)))
+
+    for split_name, writer in writers.items():
+        print('wrote {} chapters, {} summary-chapter pairs to {}'.format(
+            counts[split_name][0], counts[split_name][1], writer.close()))
+    return pair_ids, book_keys
+
+
+def get_pair_ids(base_d):
+    pair_ids = []
+    for sect_id, book_summ in base_d.items():
+        for summ_d in book_summ['summaries']:
+            summ_name = summ_d['source']
+            pair_id = '{}.{}'.format(sect_id, summ_name)
+            pair_ids.append(pair_id)
+    return pair_ids
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.splits, 'r') as f:
+        splits = json.load(f)
+        splits = {k: set(v) for k, v in splits.items()}
+    if args.incremental or args.stream:
+        manifest_name = os.path.join(args.cache_dir, 'manifest.pk')
+        manifest = load_pk(manifest_name) if os.path.exists(manifest_name) else {}
+        manifest['raw_texts'] = update_shards(args.raw_texts, manifest.get('raw_texts'), args.cache_dir, 'raw',
+                                              lambda raw_texts: raw_texts.items())
+        raw_texts = RawTextShards(args.cache_dir, dict(manifest['raw_texts']['books']))
+    else:
+        with open(args.raw_texts, 'rb') as f:
+            raw_texts = pickle.load(f)
+    all_titles_raw = set(raw_texts.keys())
+    all_titles_splits = splits['test'] | splits['train'] | splits['val']
+    validate_titles(all_titles_raw, all_titles_splits)
+    print('{} books total, train: {}, val: {}, test: {}'.format(
+        len(all_titles_splits), len(splits['train']), len(splits['val']), len(splits['test'])))
+
+    if args.stream:
+        os.makedirs(args.out_dir, exist_ok=True)
+        pair_ids, book_keys = write_splits_streaming(args.summaries, manifest, args.cache_dir, args.out_dir)
+        out_name = os.path.join(args.out_dir, 'pair_ids.json')
+        with open(out_name, 'w') as f:
+            json.dump(pair_ids, f, indent=4)
+        print('wrote to', out_name)
+        dump_pk(manifest, manifest_name)
+        prune_cache(manifest, args.cache_dir, book_keys)
+        validate_pair_ids(pair_ids, args.pair_ids_expected)
+        sys.exit()
+
+    if args.incremental:
+        base_d, sect_titles_expanded, book_keys = get_base_d_incremental(args.summaries, manifest, args.cache_dir)
+    else:
+        base_d, sect_titles_expanded = get_base_d(args.summaries, all_titles_raw), None
     print_split_ds(base_d)
 
     print('\ncomposing multi-chapter summaries from single-chapter summaries...')
-    base_ds_source, sect_titles_expanded = get_base_ds_source(base_d)
+    base_ds_source, sect_titles_expanded = get_base_ds_source(base_d, sect_titles_expanded)
     base_d_expanded = compose_multi_sect(base_d, base_ds_source, sect_titles_expanded)
     split_ds = print_split_ds(base_d_expanded)
 
     os.makedirs(args.out_dir, exist_ok=True)
+    split_fps = manifest.setdefault('split_fps', {}) if args.incremental else {}
     for split_name, split_d in split_ds.items():
-        out_name = os.path.join(args.out_dir, '{}.pk'.format(split_name))
-        with open(out_name, 'wb') as f:
-            pickle.dump(split_d, f)
-        print('wrote to', out_name)
+        for fmt in args.formats:
+            out_name = os.path.join(args.out_dir, '{}.{}'.format(split_name, fmt))
+            if args.incremental:
+                split_fp = get_split_fp(split_d, base_ds_source, book_keys, fmt)
+                if split_fps.get(out_name) == split_fp and os.path.exists(out_name):
+                    print('unchanged', out_name)
+                    continue
+            out_name = write_split(split_d, args.out_dir, split_name, fmt)
+            print('wrote to', out_name)
+            if args.incremental:
+                split_fps[out_name] = split_fp
 
     pair_ids = get_pair_ids(base_d_expanded)
     out_name = os.path.join(args.out_dir, 'pair_ids.json')
@@ -411,4 +902,8 @@ if __name__ == "__main__":
         json.dump(pair_ids, f, indent=4)
     print('wrote to', out_name)
 
+    if args.incremental:
+        dump_pk(manifest, manifest_name)
+        prune_cache(manifest, args.cache_dir, book_keys)
+
     validate_pair_ids(pair_ids, args.pair_ids_expected)
@@ -13,14 +13,15 @@ pip install -r requirements.txt
 
 ## YOU CAN SKIP STEPS 2 AND 3 AND GO DIRECTLY TO 4, SINCE THIS REPO INCLUDES THE CATALOG.
 
-## 2) Download and unpack the Gutenberg mirror (this takes a while).
+## 2) Download the Gutenberg RDF feed (this takes a while). It does not need to be unpacked.
 # wget -c https://www.gutenberg.org/cache/epub/feeds/rdf-files.tar.zip
-# unzip rdf-files.tar.zip
-# tar xvf rdf-files.tar
 
 ## 3) Collect catalog from Project Gutenberg. Gutenberg catalog object has links to
-## HTML pages of each book.
-# python gutenberg/run_all.py --use-pickled ${TAG}
+## HTML pages of each book. The RDF files are read straight from the archive; to use an unpacked
+## copy in cache/epub instead (unzip rdf-files.tar.zip && tar xvf rdf-files.tar), drop --tar.
+# python gutenberg/run_all.py --use-pickled --tar rdf-files.tar.zip ${TAG}
+## To refresh the catalog later from a newer feed, only parsing the RDF files that changed:
+# python gutenberg/run_all.py --incremental --tar rdf-files.tar.zip ${TAG}
 
 ## RECOMMENDED TO START FROM 4, AND SKIP 2 and 3
 
@@ -1,9 +1,19 @@
+import argparse
+import os
 import re
+import sqlite3
+import threading
+import time
+import urllib.parse
 from time import sleep
 from datetime import datetime
 
 import waybackpy
 
+from cache_lib import OfflineCacheMiss
+from http_lib import fetch, is_offline
+from stats_lib import count, timed
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 5.1; rv:40.0) Gecko/20100101 Firefox/40.0"
 
 # get the nearest archived version to following date parameters
@@ -12,7 +22,93 @@ MONTH = 1
 DAY = 1
 OLD_DATE = datetime(2018, 6, 1) # if archived version older than this, update
 
+# resolved snapshots (original url + target date -> snapshot url) are kept in SQLite, so reruns skip the Wayback API
+WAYBACK_DB = 'cache/wayback.sqlite'
+CDX_API = 'http://web.archive.org/cdx/search/cdx'
+CDX_YEARS = 2  # a CDX prefix query only returns captures this many years around the target year
+CDX_PAGE_SIZE = 5000  # captures per CDX request, the next page is fetched with its resume key
+MIN_PREFIX_DEPTH = 3  # slashes in a CDX prefix, host included: sparknotes.com/lit/gatsby/ but not sparknotes.com/lit/
+NEGATIVE_TTL = 7 * 24 * 3600  # seconds before retrying a url that had no archived version
+TS_FORMAT = '%Y%m%d%H%M%S'
+RE_SCHEME = re.compile(r'^https?://')
+
+_db = None
+_db_pid = None
+_db_lock = threading.Lock()
+
+
+def get_db(db_path=WAYBACK_DB):
+    global _db, _db_pid
+    if _db is None or _db_pid != os.getpid():
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        _db = sqlite3.connect(db_path, check_same_thread=False)
+        _db.execute('CREATE TABLE IF NOT EXISTS resolved (url TEXT, target TEXT, snapshot TEXT, timestamp TEXT, '
+                    'resolved_at INTEGER, PRIMARY KEY (url, target))')
+        # local CDX dump, see import_cdx()
+        _db.execute('CREATE TABLE IF NOT EXISTS cdx (urlkey TEXT, timestamp TEXT, original TEXT, '
+                    'PRIMARY KEY (urlkey, timestamp))')
+        _db.commit()
+        _db_pid = os.getpid()
+    return _db
+
+
+def url_key(url):
+    """ Normalizes url the way the Wayback Machine matches captures: no scheme, www., :80 or trailing slash."""
+    key = RE_SCHEME.sub('', url.strip())
+    host, _, path = key.partition('/')
+    host = host.lower().replace(':80', '', 1)
+    if host.startswith('www.'):
+        host = host[4:]
+    return (host + '/' + path).rstrip('/')
+
+
+def get_target(year=YEAR):
+    return datetime(year, MONTH, DAY).strftime('%Y%m%d')
+
+
+def to_snapshot_url(timestamp, original):
+    return 'https://web.archive.org/web/{}/{}'.format(timestamp, original).replace(':80', '', 1)
+
+
+def lookup_resolved(page_url, target):
+    """ Returns (snapshot_url, timestamp) from the resolution cache, (page_url, None) for a recent failed lookup,
+        or None if page_url has not been resolved for target.
+    """
+    with _db_lock:
+        row = get_db().execute('SELECT snapshot, timestamp, resolved_at FROM resolved WHERE url = ? AND target = ?',
+                               (page_url, target)).fetchone()
+    if row is None:
+        return None
+    snapshot, timestamp, resolved_at = row
+    if snapshot is None:
+        if time.time() - resolved_at > NEGATIVE_TTL and not is_offline():
+            return None
+        return page_url, None
+    return snapshot, timestamp
+
+
+def store_resolved(page_url, target, snapshot, timestamp):
+    with _db_lock:
+        db = get_db()
+        db.execute('INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?, ?)',
+                   (page_url, target, snapshot, timestamp, int(time.time())))
+        db.commit()
+
+
+def is_old(timestamp):
+    return timestamp is not None and datetime.strptime(timestamp, TS_FORMAT) < OLD_DATE
+
+
+@timed('get_archived')
 def get_archived(page_url, update_old=False, year=YEAR):
+    target = get_target(year)
+    resolved = lookup_resolved(page_url, target)
+    if resolved is not None and not (update_old and is_old(resolved[1]) and not is_offline()):
+        count('wayback_db.hit')
+        return resolved[0]
+    count('wayback_db.miss')
+    if is_offline():
+        raise OfflineCacheMiss('cannot look up the archived version of {} while offline'.format(page_url))
     try:
         waybackpy_url_obj = waybackpy.Url(page_url, USER_AGENT)
         archive_url_near = waybackpy_url_obj.near(year=year, month=MONTH, day=DAY)
@@ -24,10 +120,11 @@ def get_archived(page_url, update_old=False, year=YEAR):
         except waybackpy.exceptions.WaybackError as e:
             # print(e)
             print('  error in retrieving {} , using original url '.format(page_url))
+            store_resolved(page_url, target, None, None)
             return page_url
     url_str = archive_url_near.archive_url
+    date = archive_url_near.timestamp
     if update_old:
-        date = archive_url_near.timestamp
         if date < OLD_DATE:
             print('updating  {}'.format(url_str, date))
             archive_url_near = update_archive(waybackpy_url_obj)
@@ -35,11 +132,141 @@ def get_archived(page_url, update_old=False, year=YEAR):
                 print('  could not save page {}'.format(page_url))
             else:
                 url_str = archive_url_near.archive_url
+                date = archive_url_near.timestamp
                 print('  updated to {}'.format(url_str))
     url_str = url_str.replace(':80', '', 1)
+    store_resolved(page_url, target, url_str, date.strftime(TS_FORMAT))
     return url_str
 
 
+def get_prefix(keys):
+    """ Longest common directory of the url keys, or None if it is shallower than MIN_PREFIX_DEPTH: a prefix query
+        for e.g. sparknotes.com/lit/ would list the whole site.
+    """
+    prefix = os.path.commonprefix(keys)
+    prefix = prefix[:prefix.rfind('/') + 1]
+    if prefix.count('/') < MIN_PREFIX_DEPTH:
+        return None
+    return prefix
+
+
+def query_cdx_api(prefix, year=YEAR):
+    """ Returns {url_key: [(timestamp, original), ...]} of the 200 captures under prefix from CDX_YEARS before to
+        CDX_YEARS after year, from the CDX server, CDX_PAGE_SIZE captures per request.
+    """
+    params = {'url': prefix, 'matchType': 'prefix', 'fl': 'original,timestamp', 'filter': 'statuscode:200',
+              'from': str(year - CDX_YEARS), 'to': str(year + CDX_YEARS),
+              'limit': CDX_PAGE_SIZE, 'showResumeKey': 'true'}
+    captures = {}
+    while True:
+        response = fetch(CDX_API + '?' + urllib.parse.urlencode(params))
+        if response.status_code != 200:
+            raise IOError('CDX query for {} returned {}'.format(prefix, response.status_code))
+        lines = response.content.decode('utf-8', errors='replace').splitlines()
+        resume_key = None
+        if len(lines) >= 2 and not lines[-2].strip():  # a blank line, then the resume key of the next page
+            resume_key = lines[-1].strip()
+            lines = lines[:-2]
+        for line in lines:
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            original, timestamp = parts
+            captures.setdefault(url_key(original), []).append((timestamp, original))
+        if not resume_key:
+            return captures
+        params['resumeKey'] = resume_key
+
+
+def query_cdx_dump(keys):
+    """ Same as query_cdx_api, for the given url keys, from the local CDX dump imported by import_cdx()."""
+    captures = {}
+    with _db_lock:
+        db = get_db()
+        for key in keys:
+            rows = db.execute('SELECT timestamp, original FROM cdx WHERE urlkey = ?', (key,)).fetchall()
+            if rows:
+                captures[key] = rows
+    return captures
+
+
+def nearest(captures, target):
+    target = datetime.strptime(target, '%Y%m%d')
+    return min(captures, key=lambda c: abs((datetime.strptime(c[0], TS_FORMAT) - target).total_seconds()))
+
+
+@timed('get_archived')
+def resolve_archived(page_urls, update_old=False, year=YEAR):
+    """ Batch version of get_archived, for e.g. all the section urls of a book. Returns {page_url: archived_url}.
+
+        Urls missing from the resolution cache are looked up with one CDX prefix query for their common directory,
+        falling back to the local CDX dump (if imported), and finally to get_archived for each remaining url.
+    """
+    target = get_target(year)
+    archived = {}
+    todo = []
+    for page_url in dict.fromkeys(page_urls):
+        resolved = lookup_resolved(page_url, target)
+        if resolved is not None and not (update_old and is_old(resolved[1]) and not is_offline()):
+            archived[page_url] = resolved[0]
+        else:
+            todo.append(page_url)
+    count('wayback_db.hit', len(archived))
+    count('wayback_db.miss', len(todo))
+    if not todo:
+        return archived
+
+    keys = {page_url: url_key(page_url) for page_url in todo}
+    captures = {}
+    prefix = get_prefix(list(keys.values()))
+    if prefix and len(todo) > 1 and not is_offline():
+        try:
+            captures = query_cdx_api(prefix, year)
+        except Exception as e:
+            print('  CDX query for {} failed ({}), using local CDX dump'.format(prefix, e))
+    missing = [key for key in keys.values() if key not in captures]
+    captures.update(query_cdx_dump(missing))
+
+    for page_url in todo:
+        key_captures = captures.get(keys[page_url])
+        if not key_captures:
+            continue
+        timestamp, original = nearest(key_captures, target)
+        if update_old and is_old(timestamp):
+            continue  # let get_archived save a new version
+        archived[page_url] = to_snapshot_url(timestamp, original)
+        store_resolved(page_url, target, archived[page_url], timestamp)
+
+    for page_url in todo:
+        if page_url not in archived:
+            archived[page_url] = get_archived(page_url, update_old, year)
+    return archived
+
+
+def import_cdx(cdx_path, batch_size=100000):
+    """ Loads a CDX dump (space-separated lines: urlkey timestamp original mimetype statuscode ...) into the
+        resolution database, to be used by resolve_archived when the CDX server is unavailable.
+    """
+    with _db_lock:
+        db = get_db()
+        num_rows = 0
+        rows = []
+        with open(cdx_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 5 or parts[0] == 'CDX' or parts[4] != '200':
+                    continue
+                timestamp, original = parts[1], parts[2]
+                rows.append((url_key(original), timestamp, original))
+                if len(rows) >= batch_size:
+                    db.executemany('INSERT OR IGNORE INTO cdx VALUES (?, ?, ?)', rows)
+                    num_rows += len(rows)
+                    rows = []
+        db.executemany('INSERT OR IGNORE INTO cdx VALUES (?, ?, ?)', rows)
+        db.commit()
+    return num_rows + len(rows)
+
+
 def update_archive(waybackpy_url_obj):
     if isinstance(waybackpy_url_obj, str):
         waybackpy_url_obj = waybackpy.Url(waybackpy_url_obj, USER_AGENT)
@@ -57,4 +284,11 @@ def get_orig_url(url):
 
 
 if __name__ == "__main__":
-    print(get_archived('https://www.sparknotes.com/lit/#'))
+    parser = argparse.ArgumentParser(description='resolve archived urls')
+    parser.add_argument('urls', nargs='*', default=['https://www.sparknotes.com/lit/#'], help='urls to resolve')
+    parser.add_argument('--import-cdx', help='load a local CDX dump into {}'.format(WAYBACK_DB))
+    args = parser.parse_args()
+    if args.import_cdx:
+        print('imported {} captures from {}'.format(import_cdx(args.import_cdx), args.import_cdx))
+    for url, archived_url in resolve_archived(args.urls).items():
+        print(url, archived_url)
@@ -0,0 +1,105 @@
+"""
+bench_headings.py
+
+Microbenchmark of heading classification in _get_book_sections: the combined heading_lib.classify_heading against
+the previous approach (normalize, then re.search with each section / subsection regex), over the headings of all
+books in ids.json. Also checks that both give the same classification for every heading.
+
+Usage:
+    python scraping/bench_headings.py              # pages from the response cache; add --online to fetch missing ones
+"""
+
+import argparse
+import json
+import re
+import time
+
+from gutenberg_scrape import get_book_soup, H_TAGS
+from heading_lib import classify_heading, normalize_heading, sub_text, Heading, SUBTITLE_MARKERS, \
+                        SECTION_REGEXES, SUBSECTION_REGEXES
+from http_lib import add_http_args, configure_http
+from scrape_lib import collapse_spaces, titlecase, load_catalog, set_parser
+from scrape_vars import CATALOG_NAME, ID_FILE, SOURCE_PARSERS, additional_sect_re, num_re
+
+parser = argparse.ArgumentParser(description='benchmark heading classification')
+parser.add_argument('--ids', default=ID_FILE, help='json list of Gutenberg IDs')
+parser.add_argument('--catalog', default=CATALOG_NAME)
+parser.add_argument('--repeat', default=5, type=int, help='number of timed passes over all headings')
+add_http_args(parser)
+parser.add_argument('--online', dest='offline', action='store_false', help='fetch pages missing from the cache')
+parser.set_defaults(offline=True)
+
+
+def classify_heading_regexes(text):
+    """ The classification as _get_book_sections did it before heading_lib, as the reference."""
+    sect_title = collapse_spaces(text)
+    if not '.D.' in sect_title:
+        sect_title = sub_text(sect_title)
+    sect_title = titlecase(sect_title)
+    for marker in SUBTITLE_MARKERS:
+        sect_title = sect_title.split(marker, 1)[0].strip()
+    match_section = any(re.search(regex, sect_title) for regex in SECTION_REGEXES)
+    match_subsection = any(re.search(regex, sect_title) for regex in SUBSECTION_REGEXES)
+    match_additional_sect = re.search(additional_sect_re, sect_title)
+    match_num = re.match(num_re, sect_title)
+    return Heading(sect_title, bool(match_section), bool(match_subsection), bool(match_additional_sect),
+                   bool(match_num))
+
+
+def get_headings(ids, catalog):
+    id_title_map = {entry['id'][0]: title for title, entry in catalog.items() if entry.get('id')}
+    headings = []
+    for id_ in ids:
+        title = id_title_map.get(id_)
+        if title is None:
+            print('ID {} not in catalog, skipping'.format(id_))
+            continue
+        try:
+            soup = get_book_soup(title, catalog)
+        except Exception as e:
+            print('could not get {} ({}), skipping'.format(title, e))
+            continue
+        headings.extend(tag.text.strip() for tag in soup.find_all(H_TAGS))
+    return headings
+
+
+def time_passes(func, headings, repeat, before_pass=None):
+    best = float('inf')
+    for _ in range(repeat):
+        if before_pass:
+            before_pass()
+        start = time.perf_counter()
+        for heading in headings:
+            func(heading)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def clear_caches():
+    classify_heading.cache_clear()
+    normalize_heading.cache_clear()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    configure_http(args)
+    set_parser(SOURCE_PARSERS['gutenberg'])
+    catalog = load_catalog(args.catalog)
+    with open(args.ids, 'r') as f:
+        ids = json.load(f)
+
+    headings = get_headings(ids, catalog)
+    print('{} headings ({} distinct) from {} IDs'.format(len(headings), len(set(headings)), len(ids)))
+
+    mismatches = [x for x in set(headings) if classify_heading(x) != classify_heading_regexes(x)]
+    for heading in mismatches:
+        print('MISMATCH {!r}\n  regexes:    {}\n  classifier: {}'.format(
+            heading, classify_heading_regexes(heading), classify_heading(heading)))
+
+    results = [('regexes', time_passes(classify_heading_regexes, headings, args.repeat)),
+               ('classifier, cold', time_passes(classify_heading, headings, args.repeat, clear_caches)),
+               ('classifier, warm', time_passes(classify_heading, headings, args.repeat))]
+    for name, secs in results:
+        print('{:18} {:8.3f}s  {:6.2f} us/heading  {:5.1f}x'.format(
+            name, secs, 1e6 * secs / max(1, len(headings)), results[0][1] / secs if secs else 0))
+    print('{} mismatches'.format(len(mismatches)))
@@ -9,17 +9,20 @@ WARNING: --full flag has not been tested fully, pages will fail to be scraped du
 """
 
 import argparse
-import os
 import re
-import time
 import urllib.parse
 
 import dill as pickle
 
 from archive_lib import get_archived
+from crawl_lib import crawl
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+from rate_lib import pace
 from scrape_lib import get_soup, get_clean_text, load_catalog, find_all_stripped, gen_gutenberg_overlap, \
-                       standardize_title, load_catalog, write_sect_links, \
-                       BookSummary, CATALOG_NAME, RE_CHAPTER_NOSPACE
+                       standardize_title, load_catalog, write_sect_links, set_parser, \
+                       BookSummary, CATALOG_NAME, PARSERS, RE_CHAPTER_NOSPACE
+from scrape_vars import SOURCE_PARSERS
 
 
 BOOKS_LIST = 'http://www.bookwolf.com/Welcome_to_Bookwolf1/welcome_to_bookwolf1.html'
@@ -41,9 +44,11 @@ parser.add_argument('--archived', action='store_true', help='always use archived
 parser.add_argument('--use-pickled', action='store_true', help='use existing (partial) pickle')
 parser.add_argument('--full', action='store_true', help='get all books, not just those in Gutenberg')
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=0, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=0, type=int, help='min seconds between starting two books')
 parser.add_argument('--no-text', dest='get_text', action='store_false', help='do not get book text')
+parser.add_argument('--parser', default=SOURCE_PARSERS['bookwolf'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def num_in(string): return RE_D.search(string)
@@ -115,20 +120,15 @@ def standardize_section_titles(text):
 
 def get_summaries(title_url_map, out_name, use_pickled=False, get_text=True,
                   save_every=5, sleep=0):
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: x.title, save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([x.title for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([x.title for x in book_summaries])
 
     for title, url in title_url_map.items():  # iterate through books
         if title in done:
             continue
-        if sleep:
-            time.sleep(sleep)
+        pace('book', sleep)
 
         print('processing', title, url)
         author = ''  # TODO: figure this out
@@ -149,21 +149,23 @@ def get_summaries(title_url_map, out_name, use_pickled=False, get_text=True,
             print('no chapters found for ', url)
             continue
 
-        sects = []
+        sect_links = []
         for c in cells:  # iterate through sections
             text = get_clean_text(c)
             if 'Interpretation' in text:
                 continue
             href = c['href']
-            link_summ = urllib.parse.urljoin(url, href)
+            sect_links.append((text, urllib.parse.urljoin(url, href)))
 
-            if get_text:
-                paras = process_chapter(link_summ)
-                if not paras:
-                    print('no summaries found on ', link_summ)
-                    continue
-            else:
-                paras = []
+        if get_text:
+            sect_paras = crawl(process_chapter, [link_summ for _, link_summ in sect_links])
+        else:
+            sect_paras = [[] for _ in sect_links]
+        sects = []
+        for (text, link_summ), paras in zip(sect_links, sect_paras):
+            if get_text and not paras:
+                print('no summaries found on ', link_summ)
+                continue
             text = standardize_section_titles(text)
             sects.append((text, paras, link_summ))
 
@@ -176,15 +178,13 @@ def get_summaries(title_url_map, out_name, use_pickled=False, get_text=True,
             section_summaries=sects,
             summary_url=url)
         book_summaries.append(book_summ)
+        journal.append(book_summ.title, book_summ)
         num_books = len(book_summaries)
-        if num_books > 1 and num_books % save_every == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
 
     print('Scraped {} books from bookwolf'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
@@ -213,6 +213,8 @@ def manual_fix(book_summaries):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.full:
         title_set = None
@@ -0,0 +1,89 @@
+"""
+cache_lib.py
+
+Persistent on-disk cache of HTTP responses, used by http_lib.fetch().
+
+Bodies are zlib-compressed and stored content-addressed (by sha256 of the body) under objects/, so identical pages
+are only stored once. Each URL has a small JSON entry under urls/ pointing to its body.
+
+Wayback snapshot URLs (web.archive.org/web/<timestamp>/...) never change, so they are always served from the cache
+once stored. Live URLs are stored too, but only read back with read_live=True or in offline mode, which replays
+the cache and never touches the network.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+CACHE_DIR = 'cache/http'
+CACHEABLE_STATUSES = set([200, 404, 410])
+RE_SNAPSHOT = re.compile(r'^https?://web\.archive\.org/web/\d{14}')
+
+CachedResponse = namedtuple('CachedResponse', ['url', 'status_code', 'content', 'headers', 'from_cache'])
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+def is_snapshot(url):
+    return bool(RE_SNAPSHOT.match(url))
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResponseCache(object):
+    def __init__(self, root=CACHE_DIR, offline=False, read_live=False):
+        self.root = root
+        self.offline = offline
+        self.read_live = read_live or offline
+
+    def _url_path(self, url):
+        key = _sha256(url.encode('utf-8'))
+        return os.path.join(self.root, 'urls', key[:2], key + '.json')
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def readable(self, url):
+        return self.read_live or is_snapshot(url)
+
+    def get(self, url):
+        """ Returns a CachedResponse for url, or None if it is not cached (or is a live URL we should refetch)."""
+        if not self.readable(url):
+            return None
+        try:
+            with open(self._url_path(url), 'r') as f:
+                entry = json.load(f)
+            with open(self._object_path(entry['digest']), 'rb') as f:
+                content = zlib.decompress(f.read())
+        except (OSError, ValueError, zlib.error):
+            return None
+        return CachedResponse(url=entry['final_url'], status_code=entry['status'], content=content,
+                              headers={'Content-Type': entry.get('content_type', '')}, from_cache=True)
+
+    def put(self, url, response):
+        if response.status_code not in CACHEABLE_STATUSES:
+            return
+        content = response.content
+        digest = _sha256(content)
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, zlib.compress(content))
+        entry = {'url': url, 'final_url': response.url, 'status': response.status_code, 'digest': digest,
+                 'content_type': response.headers.get('Content-Type', ''), 'fetched_at': int(time.time())}
+        self._write_atomic(self._url_path(url), json.dumps(entry).encode('utf-8'))
@@ -7,17 +7,19 @@ Optional flags to 1) use the archived version of pages, 2) scrape all books, ins
 """
 
 import argparse
-import os
-import time
 import urllib.parse
 
 import dill as pickle
 
 from archive_lib import get_archived, get_orig_url
+from crawl_lib import crawl
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+from rate_lib import pace
 from scrape_lib import (BookSummary, gen_gutenberg_overlap, get_absolute_links,
                         get_soup, load_catalog, roman_to_int, write_sect_links,
-                        standardize_sect_title, standardize_title)
-from scrape_vars import CATALOG_NAME, NON_NOVEL_TITLES
+                        standardize_sect_title, standardize_title, PARSERS, set_parser)
+from scrape_vars import SOURCE_PARSERS, CATALOG_NAME, NON_NOVEL_TITLES
 
 PANE_NAME = 'medium-3 columns clear-padding-left clear-padding-for-small-only sidebar-navigation-gray'
 BASE_URL = 'https://www.cliffsnotes.com/'
@@ -34,9 +36,11 @@ parser.add_argument('--use-pickled', action='store_true', help='use existing (pa
 parser.add_argument('--full', action='store_true', help='get all books, not just those in Gutenberg')
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
 parser.add_argument('--update-old', action='store_true', help='update out-of-date archived version')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=0, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=0, type=int, help='min seconds between starting two books')
 parser.add_argument('--no-text', dest='get_text', action='store_false', help='do not get book text')
+parser.add_argument('--parser', default=SOURCE_PARSERS['cliffsnotes'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def get_author(soup):
@@ -161,14 +165,10 @@ def get_section_summary(url, base_url, archived=False, update_old=False):
 
 def get_summaries(books_list, base_url, out_name, use_pickled=False, archived=False, title_set=None,
                   update_old=False, get_text=True, save_every=5, sleep=0):
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: x.title, save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([x.title for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([x.title for x in book_summaries])
 
     soup = get_soup(books_list)
     title_url_map = {}
@@ -182,8 +182,7 @@ def get_summaries(books_list, base_url, out_name, use_pickled=False, archived=Fa
     for i, (book, url) in enumerate(title_url_map.items()):
         if book in done:
             continue
-        if sleep:
-            time.sleep(sleep)
+        pace('book', sleep)
         print('processing {} {}'.format(book, url))
 
         soup = get_soup(url)
@@ -196,13 +195,14 @@ def get_summaries(books_list, base_url, out_name, use_pickled=False, archived=Fa
         else:
             plot_overview = ''
 
-        section_summaries = []
-        for (section_name, summ_url) in get_sections(soup, base_url, archived, update_old):
-            if get_text:
-                summary = get_section_summary(summ_url, base_url, archived, update_old)
-            else:
-                summary = []
-            section_summaries.append((section_name, summary, summ_url))
+        sections = get_sections(soup, base_url, archived, update_old)
+        if get_text:
+            summaries = crawl(get_section_summary, [summ_url for _, summ_url in sections], base_url, archived,
+                              update_old)
+        else:
+            summaries = [[] for _ in sections]
+        section_summaries = [(section_name, summary, summ_url)
+                             for (section_name, summ_url), summary in zip(sections, summaries)]
         bs = BookSummary(title=book,
                          author=author,
                          genre=None,  # TODO: Implement retrieving genre from external source
@@ -212,15 +212,13 @@ def get_summaries(books_list, base_url, out_name, use_pickled=False, archived=Fa
                          summary_url=url)
 
         book_summaries.append(bs)
+        journal.append(bs.title, bs)
         num_books = len(book_summaries)
-        if num_books > 1  and num_books % save_every == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
 
     print('Scraped {} books from cliffsnotes'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
@@ -334,6 +332,8 @@ def manual_fix_individual(book_summaries):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.full:
         title_set = None
@@ -7,17 +7,20 @@ Optional flags to 1) use the archived version of pages, 2) scrape all books, ins
 """
 
 import argparse
-import os
 import re
-import time
 import urllib.parse
 
 import dill as pickle
 
 from archive_lib import get_archived, get_orig_url
+from crawl_lib import crawl
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+from rate_lib import pace
 from scrape_lib import BookSummary, get_soup, load_catalog, gen_gutenberg_overlap, standardize_title, clean_title, \
-                       clean_sect_summ, standardize_sect_title, fix_multibook, fix_multipart, write_sect_links
-from scrape_vars import NON_NOVEL_TITLES, RE_SUMM, CATALOG_NAME
+                       clean_sect_summ, standardize_sect_title, fix_multibook, fix_multipart, write_sect_links, \
+                       PARSERS, set_parser
+from scrape_vars import SOURCE_PARSERS, NON_NOVEL_TITLES, RE_SUMM, CATALOG_NAME
 
 PANE_NAME = 'navSection__list js--collapsible'
 BASE_URL = 'https://www.gradesaver.com/'
@@ -37,9 +40,11 @@ parser.add_argument('--use-pickled', action='store_true', help='use existing (pa
 parser.add_argument('--full', action='store_true', help='get all books, not just those in Gutenberg')
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
 parser.add_argument('--update-old', action='store_true', help='update out-of-date archived version')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=0, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=0, type=int, help='min seconds between starting two books')
 parser.add_argument('--no-text', dest='get_text', action='store_false', help='do not get book text')
+parser.add_argument('--parser', default=SOURCE_PARSERS['gradesaver'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def get_author(soup):
@@ -146,14 +151,10 @@ def get_sections(soup, pane_name, base_url, archived=False, update_old=False):
 
 def get_summaries(books_list, base_url, out_name, pane_name, use_pickled=False, title_set=None,
                   archived=False, update_old=False, get_text=True, save_every=5, sleep=0):
-    if use_pickled and os.path.exists(out_name) and os.path.getsize(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: x.title, save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([x.title for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([x.title for x in book_summaries])
 
     soup = get_soup(books_list)
     title_url_map = {}
@@ -174,8 +175,7 @@ def get_summaries(books_list, base_url, out_name, pane_name, use_pickled=False,
     for i, (book, url) in enumerate(title_url_map.items()):
         if book in done:
             continue
-        if sleep:
-            time.sleep(sleep)
+        pace('book', sleep)
         if archived:
             url = get_archived(url, update_old)
         print('processing {} {}'.format(book, url))
@@ -186,14 +186,13 @@ def get_summaries(books_list, base_url, out_name, pane_name, use_pickled=False,
         else:
             plot_overview = []
 
-        section_summaries = []
         sections = get_sections(soup, pane_name, base_url, archived, update_old)
-        for (section_name, summ_url) in sections:
-            if get_text:
-                summary = get_section_summary(summ_url)
-            else:
-                summary = []
-            section_summaries.append((section_name, summary, summ_url))
+        if get_text:
+            summaries = crawl(get_section_summary, [summ_url for _, summ_url in sections])
+        else:
+            summaries = [[] for _ in sections]
+        section_summaries = [(section_name, summary, summ_url)
+                             for (section_name, summ_url), summary in zip(sections, summaries)]
         bs = BookSummary(title=book,
                          author=author,
                          genre=None,  # TODO: Need to fix this and get genre from external source
@@ -203,16 +202,13 @@ def get_summaries(books_list, base_url, out_name, pane_name, use_pickled=False,
                          summary_url=url)
 
         book_summaries.append(bs)
+        journal.append(bs.title, bs)
         num_books = len(book_summaries)
-
-        if num_books > 1 and num_books % save_every == 0:
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
 
     print('Scraped {} books from gradesaver'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
@@ -618,6 +614,8 @@ def manual_fix_individual(book_summaries, get_text=True):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.full:
         title_set = None
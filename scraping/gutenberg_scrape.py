@@ -9,6 +9,7 @@ Optionally, scrape only a selected book, and write raw text as JSON.
 
 import argparse
 import json
+import multiprocessing
 import pickle
 import re
 import sys
@@ -17,6 +18,11 @@ from collections import Counter
 from bs4 import element
 import requests
 
+from heading_lib import classify_heading
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+import mirror_lib
+import stats_lib
 from scrape_lib import *
 from scrape_vars import *
 
@@ -26,9 +32,10 @@ SUMMARY_PATHS = ['pks/summaries_{}.pk'.format(x) for x in SOURCES]
 
 H_TAGS = set(['h1', 'h2', 'h3', 'h4', 'h5', 'center'])
 P_TAGS = set(['p', 'pre', 'blockquote', None])
-SUBTITLE_MARKERS = [':', '.', '—']
 EXCLUDED_SUB = set(['Preface', 'Scene'])
 RE_BRACKET_NUM = re.compile(r'\[([Pp]g)?\s?\d+\]')
+RE_END_GUTENBERG = re.compile(r'(?:\*\*\*)?End of(?: the|this)? Project Gutenberg.*', re.IGNORECASE)
+RE_BIBLIOGRAPHY = re.compile('SELECTED BIBLIOGRAPHY')
 
 SIDDHARTHA_D = {
     "THE SON OF THE BRAHMAN": "The Brahmin's Son",
@@ -49,6 +56,9 @@ parser.add_argument('book_title', nargs='?', help='book title')
 parser.add_argument('--summaries', '-s', nargs='*', default=SUMMARY_PATHS, help='paths to summaries')
 parser.add_argument('--out_name', '-o', help='out name (overrides default)')
 parser.add_argument('--use-pickled', action='store_true', help='use existing (partial) pickle')
+parser.add_argument('--parser', default=SOURCE_PARSERS['gutenberg'], choices=PARSERS, help='BeautifulSoup parser for pages')
+parser.add_argument('--mirror', help='local Gutenberg mirror (directory or zip) to read books from, see mirror_lib.py')
+add_http_args(parser)
 
 
 def chapter_resets(chapter_titles):
@@ -64,6 +74,11 @@ def chapter_resets(chapter_titles):
     return False
 
 
+def get_book_soup(title, catalog, encoding='utf-8'):
+    """ Gets the soup of a book's page, with the parser chosen for the book in BOOK_PARSERS (if any)."""
+    return get_soup(catalog[title]['url'][0], encoding=encoding, parser=BOOK_PARSERS.get(title))
+
+
 def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf-8'):
     """ Wrapper function to get book sections. Has manual fixes, which is why it is separate from
         the main _get_book_sections() function.
@@ -84,27 +99,27 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
     book_format = catalog[title]['book_format'][0]
     encoding = get_encoding(book_format)
     if title == 'Don Quixote':
-        soup1 = get_soup("https://www.gutenberg.org/files/5921/5921-h/5921-h.htm")
+        soup1 = get_soup("https://www.gutenberg.org/files/5921/5921-h/5921-h.htm", parser=BOOK_PARSERS.get(title))
         vol1 = _get_book_sections(title, catalog, book_soup=soup1, debug=debug)
         vol1 = {'Part 1: {}'.format(k.rsplit(': ', 1)[-1]): v for k, v in vol1.items()}
-        soup2 = get_soup("https://www.gutenberg.org/files/5946/5946-h/5946-h.htm")
+        soup2 = get_soup("https://www.gutenberg.org/files/5946/5946-h/5946-h.htm", parser=BOOK_PARSERS.get(title))
         soup2.find('h3', text=re.compile(".*OF WHAT.*")).decompose()
         vol2 = _get_book_sections(title, catalog, book_soup=soup2, debug=debug)
         vol2 = {'Part 2: {}'.format(k): v for k, v in vol2.items()}
         book = {**vol1, **vol2}
         return book
     elif title in set(['Treasure Island', "Dracula", 'Sister Carrie']):
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup = strip_subtitles(soup, 'h2')
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title in set(['Jude the Obscure']):
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         for e in soup.findAll('br'):
             e.replace_with('\n')
         soup = strip_subtitles(soup, 'h2', '\n', start_str='Part')
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Uncle Tom's Cabin":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         for e in soup.findAll('br'):
             e.replace_with('\n')
         soup = strip_subtitles(soup, 'h3', '\n')
@@ -127,7 +142,7 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
                                    'House-Warming', 'Former Inhabitants and Winter Visitors', 'Winter Animals', 'The Pond in Winter', 'Spring',
                                    'Conclusion'], range(1, 19)))
         chapter_titles.update({titlecase(k): v for k, v in chapter_titles.items()})
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         [x.decompose() for x in soup.find_all('pre', {'xml:space': 'preserve'})]
 
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug, chapter_titles=chapter_titles)
@@ -150,7 +165,7 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
                               'NOBODY KNOWS', 'GODLINESS', 'A MAN OF IDEAS', 'ADVENTURE', 'RESPECTABILITY', 'THE THINKER', 'TANDY',
                               'THE STRENGTH OF GOD', 'THE TEACHER', 'LONELINESS', 'AN AWAKENING', '"QUEER"', 'THE UNTOLD LIE', 'DRINK',
                               'DEATH', 'SOPHISTICATION', 'DEPARTURE'])
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         ps = soup.find_all('p', text="            *       *       *")
         for p in ps:
             p.decompose()
@@ -173,13 +188,13 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         book = {titlecase(k): v for k, v in book.items()}
         return book
     elif title == 'Washington Square':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         page_nums = soup.find_all('span', class_='pagenum')
         for p in page_nums:
             p.decompose()
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'Cyrano de Bergerac':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         for h3 in soup.find_all('h3'):
             scene = h3.find('a', {'name': re.compile('Scene.*')})
             if not scene:
@@ -188,13 +203,13 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
             scene.string.replace_with('Scene {}'.format(roman))
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Alice's Adventures in Wonderland":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         pres = soup.find_all('pre', text=re.compile('[(?:\*    )+|THE END]'))
         for p in pres:
             p.decompose()
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Little Women":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h2', align='center', text="\nLITTLE WOMEN PART 2\n").decompose()
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title in set(["Heart of Darkness", 'The Metamorphosis']):
@@ -208,12 +223,12 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
     elif title == "Middlemarch":
         return _get_book_sections(title, catalog, book_soup=book_soup, debug=debug, encoding='iso-8859-1')
     elif title == "Far from the Madding Crowd":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup = strip_subtitles(soup)
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return book
     elif title == 'The Three Musketeers':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         h2 = soup.find('h2', text=re.compile("AUTHOR’S PREFACE"))
         h2.string = 'Preface'
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
@@ -221,7 +236,7 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         book['Chapter 45'] = book.pop('45 a Conjugal Scene')
         return book
     elif title == "Hard Times":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup = strip_subtitles(soup)
         for h2 in soup.find_all('h2'):
             if not h2.span:
@@ -232,60 +247,60 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
             [x.decompose() for x in h3.find_all('span')]
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Bleak House":  # mistake in the numbering
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         h4 = soup.find('h4', text='CHAPTER XXIX')
         h4.string = 'CHAPTER XXIV'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "David Copperfield":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         h2 = soup.find('h2', text=re.compile('.*PREFACE TO THE.*'))
         h2.string = 'Preface'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "The Turn of the Screw":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         h2 = soup.find('h2', text='THE TURN OF THE SCREW')
         h2.string = 'Prologue'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Arms and the Man":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         h3 = soup.find('h3', text=re.compile('INTRODUCTION'))
         h3.string = 'Preface'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "The War of the Worlds":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('a', {'name': 'book01'}).parent.string = 'Book 1'
         soup.find('a', {'name': 'book02'}).parent.string = 'Book 2'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "The House of the Seven Gables":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'The Iliad':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         [x.decompose() for x in soup.find_all('span', class_='lnm')]
         [x.decompose() for x in soup.find_all('h3', class_='')]
         [x.decompose() for x in soup.find_all('span', class_='pgnm')]
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return {k: v for k, v in book.items() if 'Argument' not in k}
     elif title == 'The Trial':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         for h2 in soup.find_all('h2'):
             text = h2.text.strip()
             chapter = text.split('\n', 1)[0]
             h2.string = chapter
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'The Prince and the Pauper':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         for chap in soup.find_all('p', text=re.compile('Chapter.*')):
             chap.name = 'h2'
         soup.find('p', text=re.compile('Conclusion\.')).name = 'h2'
         soup.find('p', text=re.compile('FOOTNOTES')).name = 'h2'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'The Adventures of Tom Sawyer':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h4').name = 'p'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'The Scarlet Letter':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h2', text='The Scarlet Letter.').decompose()
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == 'The Adventures of Huckleberry Finn':
@@ -297,37 +312,37 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         book['Chapter 2'] = book.pop('Chapter Ii')
         return book
     elif title == 'The Mill on the Floss':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup = strip_subtitles(soup, start_str='Book')
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return book
     elif title == 'Oliver Twist':
-        soup = get_soup(catalog[title]['url'][0], encoding='utf-8')
+        soup = get_book_soup(title, catalog, encoding='utf-8')
         soup.find_all('h4')[-1].name = 'p'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Persuasion":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h3', align='center', text=re.compile('.*ELLIOT.*')).name = 'p'
         soup.find('h3', align='center', text=re.compile('volume one')).decompose()
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return {k.replace('(end Of Volume 1: ', ''): v for k, v in book.items()}
     elif title == "The Picture of Dorian Gray":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h3', text=re.compile('.*PREFACE.*')).string = 'Preface'
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return book
     elif title == "The Yellow Wallpaper":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h2').string = 'Chapter 1'
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         book['Book'] = book.pop('Chapter 1')
         return book
     elif title == "Vanity Fair":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         [x.decompose() for x in soup.find_all('h3', align='center', text=re.compile('.*Chapter.*'))]
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "A Connecticut Yankee in King Arthur's Court":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h3', text=re.compile('.*LOCAL.*')).name = 'p'
         soup.find('h3', text=re.compile('.*PROCLAMATION.*')).name = 'p'
         soup.find('h3', text=re.compile('.*SOLDIERS, CHAMPIONS.*')).name = 'p'
@@ -336,7 +351,7 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         final_ps.string = 'Chapter 45'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Ethan Frome":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         prologue_start = soup.find_all('h1', text=re.compile('\s*ETHAN FROME\s*'))[-1].string = 'Prologue'
         epilogue_start = soup.find('p', text=re.compile('.*THE QUER.*')).previous_sibling
         epilogue_tag = soup.new_tag('h2')
@@ -344,38 +359,38 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         epilogue_start.insert_before(epilogue_tag)
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "What Maisie Knew":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         intro_start = soup.find('p', text=re.compile('The litigation')).previous_sibling
         intro_tag = soup.new_tag('h3')
         intro_tag.append('Introduction')
         intro_start.insert_before(intro_tag)
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Pygmalion":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         sequel_start = soup.find('hr').previous_sibling
         sequel_tag = soup.new_tag('h3')
         sequel_tag.append('Sequel')
         sequel_start.insert_before(sequel_tag)
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Frankenstein":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         final_start = soup.find('p', text=re.compile('aright\.')).next_sibling
         final_tag = soup.new_tag('h2')
         final_tag.append('Final Letters')
         final_start.insert_before(final_tag)
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
     elif title == "Crime and Punishment":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h2', text=re.compile('.*EPI.*')).string = 'Part 7' # Epilogue -> Part 7
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return book
     elif title == "The Brothers Karamazov":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('span', text=re.compile('.*Epi.*')).string = 'Book 13'  # Epilogue -> Part 13
         book = _get_book_sections(title, catalog, book_soup=soup, debug=debug)
         return book
     elif title == "Ulysses":
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         pattern = re.compile("\[ (\d+) \]")
         for h2 in soup.find_all('h3'):
             match = re.match(pattern, h2.text)
@@ -396,7 +411,7 @@ def get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf
         book['Epilogue'] = book.pop("Act 5: Epilogue")
         return book
     elif title == 'A Study in Scarlet':
-        soup = get_soup(catalog[title]['url'][0], encoding=encoding)
+        soup = get_book_soup(title, catalog, encoding=encoding)
         soup.find('h2', text=re.compile('CHAPTER I\. O')).find_previous_sibling('h2').string = 'PART II'
         soup.find('h2', text=re.compile('CHAPTER VI\. A')).string = 'CHAPTER VI'
         return _get_book_sections(title, catalog, book_soup=soup, debug=debug)
@@ -412,11 +427,7 @@ def get_encoding(book_format):
         return None
 
 
-def sub_roman(sect_title): return re.sub(RE_ROMAN, lambda x: str(roman_to_int(x[0])), sect_title)
-def sub_numword(sect_title): return re.sub(RE_NUMWORD, lambda x: str(numword_to_int(x[0], numwords)), sect_title)
-def sub_text(sect_title): return sub_numword(sub_roman(sect_title))
-
-
+@stats_lib.timed('_get_book_sections')
 def _get_book_sections(title, catalog, book_soup=None, debug=False, encoding='utf-8', chapter_titles=[]):
     """ Main function to get book sections.
     """
@@ -429,7 +440,7 @@ def _get_book_sections(title, catalog, book_soup=None, debug=False, encoding='ut
     if not book_soup:
         if not book_link:
             return {}
-        book_soup = get_soup(book_link, encoding=encoding)
+        book_soup = get_soup(book_link, encoding=encoding, parser=BOOK_PARSERS.get(title))
     divs_children = book_soup.find_all('div', class_='chapter')
     divs_children2 = book_soup.find_all('div', class_='tei tei-div')
     if divs_children:
@@ -452,20 +463,13 @@ def _get_book_sections(title, catalog, book_soup=None, debug=False, encoding='ut
             if children[ind].name not in H_TAGS:
                 ind += 1
                 continue
-            sect_title = children[ind].text.strip()
-            sect_title_orig = sect_title
-            sect_title = collapse_spaces(sect_title)
-            if not '.D.' in sect_title:  # LL.D. Ph.D. etc D != 100
-                sect_title = sub_text(sect_title)
-            sect_title = titlecase(sect_title)
-            for marker in SUBTITLE_MARKERS:
-                sect_title = sect_title.split(marker, 1)[0].strip()
-            match_section = any(re.search(regex, sect_title) for regex in
-                                [book_re, act_re, part_re, volume_re, phase_re, epilogue_re])
-            match_subsection = any(re.search(regex, sect_title) for regex in
-                                   [chapter_re, scene_re, act_scene_re, additional_sub_re, letters_re, stave_re])
-            match_additional_sect = re.search(additional_sect_re, sect_title)
-            match_num = re.match(num_re, sect_title)
+            sect_title_orig = children[ind].text.strip()
+            heading = classify_heading(sect_title_orig)
+            sect_title = heading.title
+            match_section = heading.section
+            match_subsection = heading.subsection
+            match_additional_sect = heading.additional_sect
+            match_num = heading.num
 
             if sect_title == 'Contents':
                 ind += 1
@@ -537,8 +541,7 @@ def _get_book_sections(title, catalog, book_soup=None, debug=False, encoding='ut
                 if children[ind].name in P_TAGS and isinstance(children[ind], element.Tag):
                     p_text = get_text(children[ind])
                     p_text = re.sub(RE_BRACKET_NUM, '', p_text)  # remove page and line numbers
-                    if re.match(re.compile('(?:\*\*\*)?End of(?: the|this)? Project Gutenberg.*', re.IGNORECASE), p_text) or \
-                       re.match(re.compile('SELECTED BIBLIOGRAPHY'), p_text):
+                    if RE_END_GUTENBERG.match(p_text) or RE_BIBLIOGRAPHY.match(p_text):
                         break_flag = True
                         break
                     if p_text:
@@ -575,31 +578,50 @@ def get_text(tag):
         p_texts.append(t.text)
     return collapse_spaces("".join(p_texts)).strip()
 
-def get_raw_texts(titles, out_name, use_pickled=False):
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            books_d = pickle.load(f1)
+def init_worker(args):
+    global gutenberg_catalog
+    configure_http(args)
+    set_parser(args.parser)
+    mirror_lib.set_mirror(args.mirror)
+    gutenberg_catalog = load_catalog(CATALOG_NAME)
+
+
+def process_book(title):
+    """ Returns the book's sections, and the stats collected for it (to merge them in the main process)."""
+    print('processing', title)
+    print(gutenberg_catalog[title])
+    book = get_book_sections(title, gutenberg_catalog)
+    return book, stats_lib.snapshot(reset=True)
+
+
+def get_raw_texts(titles, out_name, use_pickled=False, workers=1, args=None):
+    """ Gets the sections of each book in titles. With workers > 1 (--workers), books are processed in a pool of
+        processes, each set up by init_worker(args); results are still journaled and returned in the order of titles.
+    """
+    journal, books_d = load_checkpoint(out_name, use_pickled, sync_every=5, as_dict=True)
+    if books_d:
         print('loaded {} existing raw texts, resuming'.format(len(books_d)))
-        done = list(books_d.keys())
-    else:
-        books_d = {}
-        done = set()
+    todo = [title for title in titles if title not in books_d]
 
-    for title in titles:
-        if title in done:
-            continue
-        print('processing', title)
-        print(gutenberg_catalog[title])
-        book = get_book_sections(title, gutenberg_catalog)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(args,))
+        books = pool.imap(process_book, todo)
+    else:
+        pool = None
+        books = map(process_book, todo)
+    for title, (book, stats) in zip(todo, books):
+        stats_lib.merge(stats)
         books_d[title] = book
+        journal.append(title, book)
         num_books = len(books_d)
-        if num_books > 1 and num_books % 5 == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(books_d, f)
+        if num_books % 5 == 0:
             print("Done scraping {} books".format(num_books))
 
-    with open(out_name, 'wb') as f:
-        pickle.dump(books_d, f)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    compact(journal, out_name, as_dict=True)
     print('wrote to', out_name)
     return books_d
 
@@ -618,6 +640,11 @@ def get_titles_to_scrape(summary_objs, min_count):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.workers > 1:  # each book is fetched in its own process, so the processes need to share the rate limit
+        args.shared_rate = True
+    configure_http(args)
+    set_parser(args.parser)
+    mirror_lib.set_mirror(args.mirror)
     gutenberg_catalog = load_catalog(CATALOG_NAME)
 
     if args.book_title: # get 1 book
@@ -631,4 +658,4 @@ if __name__ == "__main__":
     else: # get all books
         titles = get_titles_to_scrape(args.summaries, 1)
         out_name = args.out_name or PICKLE_NAME
-        get_raw_texts(titles, out_name, use_pickled=args.use_pickled)
+        get_raw_texts(titles, out_name, use_pickled=args.use_pickled, workers=args.workers, args=args)
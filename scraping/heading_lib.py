@@ -0,0 +1,74 @@
+"""
+heading_lib.py
+
+Classifies the headings of Gutenberg books for gutenberg_scrape._get_book_sections.
+
+A heading is normalized (numbers spelled out or in roman numerals become digits, titlecase, subtitle cut off), then
+matched once against CLASSIFIER, which combines the section, subsection and additional section regexes of
+scrape_vars. Each group of regexes is an optional lookahead from the start of the title, so one match tells whether
+any regex of each group would be found anywhere in the title (like running re.search with each regex), and its named
+groups give the classification. Results are memoized, since the same headings ("Chapter 1", ...) recur across books.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from number_lib import roman_to_int, numword_to_int, RE_NUMWORD, numwords
+from scrape_lib import collapse_spaces, titlecase
+from scrape_vars import RE_ROMAN, book_re, act_re, part_re, volume_re, phase_re, epilogue_re, chapter_re, scene_re, \
+                        act_scene_re, additional_sub_re, letters_re, stave_re, additional_sect_re, num_re
+
+SUBTITLE_MARKERS = [':', '.', '—']
+SECTION_REGEXES = [book_re, act_re, part_re, volume_re, phase_re, epilogue_re]
+SUBSECTION_REGEXES = [chapter_re, scene_re, act_scene_re, additional_sub_re, letters_re, stave_re]
+
+Heading = namedtuple('Heading', ['title', 'section', 'subsection', 'additional_sect', 'num'])
+
+
+def sub_roman(sect_title): return re.sub(RE_ROMAN, lambda x: str(roman_to_int(x[0])), sect_title)
+def sub_numword(sect_title): return re.sub(RE_NUMWORD, lambda x: str(numword_to_int(x[0], numwords)), sect_title)
+def sub_text(sect_title): return sub_numword(sub_roman(sect_title))
+
+
+def _inline(regex):
+    """ Pattern of regex (a string or compiled regex), keeping its IGNORECASE flag as a scoped flag."""
+    if isinstance(regex, str):
+        return regex
+    if regex.flags & re.IGNORECASE:
+        return '(?i:{})'.format(regex.pattern)
+    return regex.pattern
+
+
+def _search_any(name, regexes):
+    alternatives = '|'.join('(?:{})'.format(_inline(regex)) for regex in regexes)
+    return r'(?:(?=[\s\S]*?(?P<{}>{})))?'.format(name, alternatives)
+
+
+CLASSIFIER = re.compile('^' + _search_any('section', SECTION_REGEXES) +
+                        _search_any('subsection', SUBSECTION_REGEXES) +
+                        _search_any('additional_sect', [additional_sect_re]) +
+                        '(?P<num>{})?'.format(_inline(num_re)))
+
+
+@lru_cache(maxsize=None)
+def normalize_heading(text):
+    sect_title = collapse_spaces(text)
+    if not '.D.' in sect_title:  # LL.D. Ph.D. etc D != 100
+        sect_title = sub_text(sect_title)
+    sect_title = titlecase(sect_title)
+    for marker in SUBTITLE_MARKERS:
+        sect_title = sect_title.split(marker, 1)[0].strip()
+    return sect_title
+
+
+@lru_cache(maxsize=None)
+def classify_heading(text):
+    """ Returns the Heading for the (stripped) text of a heading tag."""
+    sect_title = normalize_heading(text)
+    match = CLASSIFIER.match(sect_title)
+    return Heading(title=sect_title,
+                   section=match.group('section') is not None,
+                   subsection=match.group('subsection') is not None,
+                   additional_sect=match.group('additional_sect') is not None,
+                   num=match.group('num') is not None)
@@ -0,0 +1,139 @@
+"""
+http_lib.py
+
+Process-wide HTTP session shared by get_soup and all scrapers, so that connections to the same host are pooled
+and kept alive instead of re-opened for every page.
+"""
+
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_lib import CACHE_DIR, OfflineCacheMiss, ResponseCache
+from crawl_lib import configure_crawl, get_host
+from rate_lib import BACKOFF_STATUSES, BURST, RATE, configure_rate, report_response, wait_for_host
+from stats_lib import configure_stats, count, record_request, timer
+
+POOL_HOSTS = 10  # number of per-host connection pools to keep
+POOL_SIZE = 10  # max connections kept alive per host
+RETRIES = 4
+BACKOFF_FACTOR = .3
+RETRY_STATUSES = (500, 502, 504)
+TIMEOUT = 60
+RATE_RETRIES = 3  # extra attempts after a 429/503, once the host's rate has been lowered
+
+_session = None
+_session_pid = None
+_cache = ResponseCache(CACHE_DIR)
+_session_config = {'pool_hosts': POOL_HOSTS, 'pool_size': POOL_SIZE, 'retries': RETRIES,
+                   'backoff_factor': BACKOFF_FACTOR, 'timeout': TIMEOUT}
+
+
+def add_http_args(parser):
+    """ Adds the shared HTTP options to a scraper's argparse parser."""
+    parser.add_argument('--pool-size', default=POOL_SIZE, type=int, help='max keep-alive connections per host')
+    parser.add_argument('--retries', default=RETRIES, type=int, help='retries per request (http and https)')
+    parser.add_argument('--timeout', default=TIMEOUT, type=int, help='timeout in seconds for each request')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='directory of the on-disk response cache')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='do not read or write the response cache')
+    parser.add_argument('--cache-live', action='store_true', help='also serve live (non-archived) pages from the cache')
+    parser.add_argument('--offline', action='store_true', help='replay pages from the response cache, never use the network')
+    parser.add_argument('--workers', default=1, type=int, help='max pages fetched at once from each host')
+    parser.add_argument('--host-delay', default=0, type=float, help='min seconds between starting two fetches from a host')
+    parser.add_argument('--rate', default=RATE, type=float, help='max requests per second to each host')
+    parser.add_argument('--burst', default=BURST, type=int, help='max requests sent at once to a host after being idle')
+    parser.add_argument('--shared-rate', action='store_true',
+                        help='share the per-host rate limit with other scrapers running on this machine')
+    parser.add_argument('--ignore-robots', dest='robots', action='store_false', help='ignore Crawl-delay in robots.txt')
+    parser.add_argument('--stats', help="JSON file for the run's timings and counters (default cache/stats/<script>.json, "
+                                        "'' to not write one)")
+
+
+def configure_http(args):
+    """ Applies the options added by add_http_args()."""
+    configure_session(pool_size=max(args.pool_size, args.workers), retries=args.retries, timeout=args.timeout)
+    configure_crawl(host_concurrency=args.workers, host_delay=args.host_delay)
+    configure_rate(rate=args.rate, burst=args.burst, shared=args.shared_rate, robots=args.robots,
+                   enabled=not args.offline)
+    if args.offline and not args.use_cache:
+        raise ValueError('--offline needs the response cache, cannot be used with --no-cache')
+    set_cache(ResponseCache(args.cache_dir, offline=args.offline, read_live=args.cache_live) if args.use_cache else None)
+    configure_stats(args.stats)
+
+
+def set_cache(cache):
+    """ Sets the ResponseCache used by fetch() (None disables caching)."""
+    global _cache
+    _cache = cache
+
+
+def is_offline():
+    return _cache is not None and _cache.offline
+
+
+def configure_session(pool_hosts=None, pool_size=None, retries=None, backoff_factor=None, timeout=None):
+    """ Changes the session settings. The shared session is rebuilt on the next request."""
+    global _session
+    settings = {'pool_hosts': pool_hosts, 'pool_size': pool_size, 'retries': retries,
+                'backoff_factor': backoff_factor, 'timeout': timeout}
+    _session_config.update({k: v for k, v in settings.items() if v is not None})
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def _make_session():
+    retries = Retry(total=_session_config['retries'], backoff_factor=_session_config['backoff_factor'],
+                    status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=_session_config['pool_hosts'],
+                          pool_maxsize=_session_config['pool_size'], max_retries=retries)
+    s = requests.Session()
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+def get_session():
+    """ Returns the shared session, creating it on first use (and again in each forked worker process,
+        since pooled sockets must not be shared across processes).
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = _make_session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def fetch(url, min_interval=0, **kwargs):
+    """ GETs url through the shared session, returns the requests.Response (or a cache_lib.CachedResponse, which
+        has the same url/status_code/content/headers attributes, if it was served from the response cache).
+
+        Requests that go to the network wait for the host's rate limit; min_interval (seconds) additionally caps
+        the host's rate for the rest of the run.
+    """
+    if _cache is not None:
+        response = _cache.get(url)
+        count('http_cache.hit' if response is not None else 'http_cache.miss')
+        if response is not None:
+            return response
+        if _cache.offline:
+            raise OfflineCacheMiss('{} is not in the response cache at {}'.format(url, _cache.root))
+    kwargs.setdefault('timeout', _session_config['timeout'])
+    session = get_session()
+    for _ in range(RATE_RETRIES + 1):
+        with timer('rate_wait'):
+            wait_for_host(url, session, min_interval)
+        start = time.perf_counter()
+        with timer('fetch'):
+            response = session.get(url, **kwargs)
+        record_request(get_host(url), time.perf_counter() - start, len(response.content), response.status_code)
+        report_response(url, response)
+        if response.status_code not in BACKOFF_STATUSES:
+            break
+    response.from_cache = False
+    if _cache is not None:
+        _cache.put(url, response)
+    return response
@@ -0,0 +1,173 @@
+"""
+journal_lib.py
+
+Append-only checkpoint journal for the scrapers, so that saving progress costs one record per book instead of
+rewriting the whole pickle every --save-every books.
+
+Each record is a header (key length, value length, crc32) followed by the pickled key and value. Records are
+fsync'd every sync_every appends. On open, the index (key -> offset of its latest record) is rebuilt by reading
+only the headers and keys; a torn record at the end, left by a crash, is dropped. compact() then writes the
+usual .pk output from the journal in one pass.
+"""
+
+import os
+import struct
+import zlib
+
+import dill as pickle
+
+from stats_lib import timed
+
+JOURNAL_EXT = '.journal'
+MAGIC = b'NCDJRNL1'
+HEADER = struct.Struct('<III')
+
+
+class JournalError(Exception):
+    pass
+
+
+class Journal(object):
+    def __init__(self, path, sync_every=1):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.index = {}
+        self.offsets = []
+        self._unsynced = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._f = open(path, 'a+b')
+        self._recover()
+
+    def _recover(self):
+        f = self._f
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        if size == 0:
+            f.write(MAGIC)
+            self.sync()
+            return
+        if f.read(len(MAGIC)) != MAGIC:
+            raise JournalError('{} is not a journal'.format(self.path))
+        offset = len(MAGIC)
+        while offset < size:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            key_len, value_len, crc = HEADER.unpack(header)
+            end = offset + HEADER.size + key_len + value_len
+            if end > size:
+                break
+            key_bytes = f.read(key_len)
+            if end == size:  # only the last record can be torn, so only check its crc here
+                value_bytes = f.read(value_len)
+                if zlib.crc32(value_bytes, zlib.crc32(key_bytes)) != crc:
+                    break
+            else:
+                f.seek(value_len, os.SEEK_CUR)
+            self.index[pickle.loads(key_bytes)] = offset
+            self.offsets.append(offset)
+            offset = end
+        if offset < size:
+            print('dropping torn record at the end of {}'.format(self.path))
+            f.truncate(offset)
+            self.sync()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @timed('checkpoint')
+    def append(self, key, value):
+        key_bytes = pickle.dumps(key)
+        value_bytes = pickle.dumps(value)
+        crc = zlib.crc32(value_bytes, zlib.crc32(key_bytes))
+        self._f.seek(0, os.SEEK_END)
+        offset = self._f.tell()
+        self._f.write(HEADER.pack(len(key_bytes), len(value_bytes), crc) + key_bytes + value_bytes)
+        self.index[key] = offset
+        self.offsets.append(offset)
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def _read(self, offset):
+        self._f.seek(offset)
+        key_len, value_len, crc = HEADER.unpack(self._f.read(HEADER.size))
+        key_bytes = self._f.read(key_len)
+        value_bytes = self._f.read(value_len)
+        if zlib.crc32(value_bytes, zlib.crc32(key_bytes)) != crc:
+            raise JournalError('corrupt record at offset {} of {}'.format(offset, self.path))
+        return pickle.loads(key_bytes), pickle.loads(value_bytes)
+
+    def get(self, key, default=None):
+        if key not in self.index:
+            return default
+        return self._read(self.index[key])[1]
+
+    def records(self):
+        """ Yields (key, value) of every record, in the order they were appended."""
+        self._f.flush()
+        for offset in self.offsets:
+            yield self._read(offset)
+
+    def values(self):
+        return [value for _, value in self.records()]
+
+    def to_dict(self):
+        return {key: value for key, value in self.records()}
+
+    def reset(self):
+        self._f.truncate(len(MAGIC))
+        self.index = {}
+        self.offsets = []
+        self.sync()
+
+    def close(self):
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+def load_checkpoint(out_name, resume, key_func=None, sync_every=1, as_dict=False):
+    """ Opens the journal of out_name. Returns the journal and the items done so far (a list, or a dict if as_dict).
+
+        With resume=False the journal is cleared. With resume=True, a leftover journal is resumed from; if there is
+        none, but out_name exists (e.g. from an older run), its items are loaded into a new journal.
+    """
+    journal = Journal(out_name + JOURNAL_EXT, sync_every)
+    if not resume:
+        journal.reset()
+    elif not len(journal) and os.path.exists(out_name) and os.path.getsize(out_name):
+        with open(out_name, 'rb') as f:
+            items = pickle.load(f)
+        pairs = items.items() if as_dict else ((key_func(value) if key_func else None, value) for value in items)
+        for key, value in pairs:
+            journal.append(key, value)
+        journal.sync()
+    items = journal.to_dict() if as_dict else journal.values()
+    return journal, items
+
+
+@timed('checkpoint')
+def compact(journal, out_name, as_dict=False):
+    """ Writes the journal's items to out_name as one pickle (atomically), then removes the journal."""
+    journal.sync()
+    items = journal.to_dict() if as_dict else journal.values()
+    tmp_name = out_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        pickle.dump(items, f)
+    os.replace(tmp_name, out_name)
+    journal.remove()
+    return items
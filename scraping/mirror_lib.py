@@ -0,0 +1,120 @@
+"""
+mirror_lib.py
+
+Reads Gutenberg books from a local mirror instead of gutenberg.org, so that get_soup does not go to the network for
+them. The mirror (--mirror) is one of:
+  - a directory rsync'd from a Gutenberg mirror, e.g. rsync -av --include='*/' --include='*-h.htm' \
+    --include='*-h.html' --exclude='*' aleph.gutenberg.org::gutenberg DIR, where book 1023 is under 1/0/2/1023/
+    (a 1023-h.zip there is also read);
+  - a directory with the paths of the book URLs, e.g. DIR/files/1023/1023-h/1023-h.htm or
+    DIR/cache/epub/1342/pg1342-images.html;
+  - a zip of the HTML files, whose members are looked up by path or, failing that, by file name.
+Pages not found in the mirror are fetched as usual.
+"""
+
+import os
+import posixpath
+import re
+import urllib.parse
+import zipfile
+
+from stats_lib import count
+
+GUTENBERG_HOSTS = set(['www.gutenberg.org', 'gutenberg.org'])
+RE_FILES = re.compile(r'^/files/(\d+)/(.+)$')
+RE_EBOOKS = re.compile(r'^/ebooks/(\d+)\.html\.(images|noimages)$')
+RE_CACHE = re.compile(r'^/cache/epub/\d+/.+$')
+
+_mirror = None
+
+
+def get_id_dir(id_):
+    """ Directory of book id_ in the layout of the Gutenberg mirrors: '1023' -> '1/0/2/1023', '5' -> '0/5'."""
+    return posixpath.join(*(list(id_[:-1]) or ['0']) + [id_])
+
+
+def get_mirror_paths(url):
+    """ Candidate paths of url relative to the mirror root, or [] if url is not a Gutenberg book page."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.netloc not in GUTENBERG_HOSTS:
+        return []
+    path = parts.path
+    match = RE_FILES.match(path)
+    if match:
+        id_, rest = match.groups()
+        return [path[1:], posixpath.join(get_id_dir(id_), rest)]
+    match = RE_EBOOKS.match(path)
+    if match:  # redirects to the HTML generated from the book, under cache/epub
+        id_, kind = match.groups()
+        name = 'pg{}-images.html'.format(id_) if kind == 'images' else 'pg{}.html'.format(id_)
+        return [path[1:], 'cache/epub/{}/{}'.format(id_, name)]
+    if RE_CACHE.match(path):
+        return [path[1:]]
+    return []
+
+
+class Mirror(object):
+    """ A mirror directory or zip file, see the module docstring."""
+
+    def __init__(self, root):
+        if not os.path.exists(root):
+            raise ValueError('mirror {} does not exist'.format(root))
+        self.root = root
+        self.is_zip = os.path.isfile(root)
+        self._zip = None
+        self._zip_pid = None
+        self._names = {}
+
+    def _get_zip(self):
+        # opened again in each forked worker process, like the http session
+        if self._zip is None or self._zip_pid != os.getpid():
+            self._zip = zipfile.ZipFile(self.root)
+            self._zip_pid = os.getpid()
+            self._names = {}
+            for name in self._zip.namelist():
+                self._names.setdefault(name, name)
+                self._names.setdefault(posixpath.basename(name), name)
+        return self._zip
+
+    def _read_zip(self, path):
+        zf = self._get_zip()
+        name = self._names.get(path) or self._names.get(posixpath.basename(path))
+        return zf.read(name) if name else None
+
+    def _read_dir(self, path):
+        full_path = os.path.join(self.root, *path.split('/'))
+        if os.path.isfile(full_path):
+            with open(full_path, 'rb') as f:
+                return f.read()
+        # the mirrors also have each book's HTML directory zipped: 1023-h.zip with 1023-h/1023-h.htm
+        dir_name = posixpath.dirname(path)
+        zip_path = os.path.join(self.root, *(dir_name + '.zip').split('/')) if dir_name else None
+        if zip_path and os.path.isfile(zip_path):
+            with zipfile.ZipFile(zip_path) as zf:
+                member = posixpath.join(posixpath.basename(dir_name), posixpath.basename(path))
+                if member in zf.namelist():
+                    return zf.read(member)
+        return None
+
+    def read(self, url):
+        """ Content (bytes) of url from the mirror, or None if it is not there."""
+        for path in get_mirror_paths(url):
+            content = self._read_zip(path) if self.is_zip else self._read_dir(path)
+            if content is not None:
+                return content
+        return None
+
+
+def set_mirror(root):
+    """ Sets the mirror read by read_mirror (None to not use one)."""
+    global _mirror
+    _mirror = Mirror(root) if root else None
+
+
+def read_mirror(url):
+    """ Content of url from the mirror set with set_mirror, or None if there is none or it does not have url."""
+    if _mirror is None:
+        return None
+    content = _mirror.read(url)
+    count('mirror.hit' if content is not None else 'mirror.miss')
+    return content
@@ -0,0 +1,153 @@
+"""
+bench_compose_multi_sect.py
+
+Benchmark of make_data_splits.compose_multi_sect (range index) against the previous nested scan over candidate
+'<chapter>-<last>' strings, on the sections and sources of pair_ids_expected.json. Each pair id is taken as a
+scraped summary, and the chapters of each book are taken from its single-chapter section ids, so no pickles are
+needed. Also checks that both give the same composed summaries.
+
+The scan is quadratic in the chapters of a section, the index linear, so the difference shows on long sections;
+--synthetic builds a book with many chapters for that.
+
+Usage (from the repository root):
+    PYTHONPATH=. python scraping/misc/bench_compose_multi_sect.py
+    PYTHONPATH=. python scraping/misc/bench_compose_multi_sect.py --synthetic 300
+"""
+
+import argparse
+import json
+import time
+from collections import defaultdict
+
+import make_data_splits
+from make_data_splits import compose_multi_sect, get_section_titles, split_title_sect, PAIR_IDS_NAME
+
+parser = argparse.ArgumentParser(description='benchmark compose_multi_sect')
+parser.add_argument('--pair_ids', '-pi', default=PAIR_IDS_NAME, help='path to pair ids JSON')
+parser.add_argument('--repeat', default=5, type=int, help='number of timed runs')
+parser.add_argument('--synthetic', default=0, type=int,
+                    help='instead, use one synthetic book with this many chapters, summarized in ranges of 3')
+
+
+def compose_multi_sect_scan(base_d, base_ds_source, sect_titles_expanded):
+    """ compose_multi_sect before the range index, as the reference. Returns {sect_id: [summ_d, ...]}."""
+    added_summaries = defaultdict(list)
+    for sect_id, item in base_d.items():
+        title, sect = split_title_sect(sect_id)
+        sect_titles = sect_titles_expanded[sect_id]
+        if len(sect_titles) < 2:
+            continue
+        for source, base_d_source in base_ds_source.items():
+            source_title_d = base_d_source[title]
+            if not source_title_d or sect in source_title_d:
+                continue
+            new_sect, links, added_sects_all = [], [], set()
+            i = 0
+            while i < len(sect_titles):
+                chap = sect_titles[i]
+                match = False
+                for j in range(len(sect_titles) - 1, i, -1):
+                    cand = '{}-{}'.format(chap, sect_titles[j].rsplit(' ', 1)[-1])
+                    if cand in source_title_d:
+                        curr_text, link = source_title_d[cand]
+                        new_sect.extend(curr_text)
+                        links.append(link)
+                        added_sects_all.update(sect_titles_expanded['{}.{}'.format(title, cand)])
+                        i = j + 1
+                        match = True
+                        break
+                if not match:
+                    if chap.lower() in source_title_d:
+                        chap = chap.lower()
+                    if chap not in source_title_d:
+                        break
+                    added_sects_all.update(sect_titles_expanded['{}.{}'.format(title, chap)])
+                    curr_text, link = source_title_d[chap]
+                    new_sect.extend(curr_text)
+                    links.append(link)
+                    i += 1
+                if sect_titles[-1] in added_sects_all:
+                    break
+            if sect_titles[-1] in added_sects_all:
+                added_summaries[sect_id].append({'summary': new_sect, 'source': source, 'link': links})
+    return added_summaries
+
+
+def get_workload(pair_ids):
+    """ Returns (base_d, base_ds_source, sect_titles_expanded, raw_texts) like make_data_splits builds them."""
+    base_d = {}
+    base_ds_source = defaultdict(lambda: defaultdict(dict))
+    book_chapters = defaultdict(dict)
+    for pair_id in pair_ids:
+        sect_id, source = pair_id.rsplit('.', 1)
+        title, sect = split_title_sect(sect_id)
+        summ_d = {'summary': [pair_id], 'source': source, 'link': pair_id}
+        base_d.setdefault(sect_id, {'id': sect_id, 'summaries': []})['summaries'].append(summ_d)
+        base_ds_source[source][title][sect] = ([pair_id], pair_id)
+        if '-' not in sect:
+            book_chapters[title][sect] = []
+    sect_titles_expanded = {}
+    for sect_id in base_d:
+        title, sect = split_title_sect(sect_id)
+        sect_titles_expanded[sect_id] = get_section_titles(book_chapters[title].keys(), sect, title)
+    return base_d, base_ds_source, sect_titles_expanded, book_chapters
+
+
+def get_synthetic_workload(num_chapters):
+    """ One book whose sections 'Chapter 1-k' (k = 2 .. num_chapters) are composed from source a's ranges of 3."""
+    title = 'Synthetic'
+    chapters = {'Chapter {}'.format(k): [] for k in range(1, num_chapters + 1)}
+    base_d, sect_titles_expanded = {}, {}
+    base_ds_source = defaultdict(lambda: defaultdict(dict))
+    for k in range(1, num_chapters + 1, 3):
+        last = min(k + 2, num_chapters)
+        sect = 'Chapter {}-{}'.format(k, last) if last > k else 'Chapter {}'.format(k)
+        base_ds_source['a'][title][sect] = ([sect], sect)
+    for sect in list(base_ds_source['a'][title]) + ['Chapter 1-{}'.format(k) for k in range(2, num_chapters + 1)]:
+        sect_id = '{}.{}'.format(title, sect)
+        base_d[sect_id] = {'id': sect_id, 'summaries': []}
+        sect_titles_expanded[sect_id] = get_section_titles(chapters.keys(), sect, title)
+    for chap in chapters:
+        sect_titles_expanded['{}.{}'.format(title, chap)] = (chap,)
+    base_ds_source['b'][title]['Chapter 1'] = (['b'], 'b')
+    return base_d, base_ds_source, sect_titles_expanded, {title: chapters}
+
+
+def time_runs(func, args, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.synthetic:
+        workload = get_synthetic_workload(args.synthetic)
+        print('synthetic book of {} chapters'.format(args.synthetic))
+    else:
+        with open(args.pair_ids, 'r') as f:
+            pair_ids = json.load(f)
+        workload = get_workload(pair_ids)
+        print('{} pair ids'.format(len(pair_ids)))
+    base_d, base_ds_source, sect_titles_expanded, make_data_splits.raw_texts = workload
+    num_multi = sum(1 for x in sect_titles_expanded.values() if len(x) > 1)
+    print('{} sections ({} multi-chapter), {} sources'.format(len(base_d), num_multi, len(base_ds_source)))
+
+    func_args = (base_d, base_ds_source, sect_titles_expanded)
+    secs_scan, added_scan = time_runs(compose_multi_sect_scan, func_args, args.repeat)
+    secs_index, overlay = time_runs(compose_multi_sect, func_args, args.repeat)
+    added_index = overlay.added_summaries
+
+    print('{:12} {:8.4f}s'.format('scan', secs_scan))
+    print('{:12} {:8.4f}s  {:5.1f}x'.format('range index', secs_index, secs_scan / secs_index))
+    num_added = sum(len(x) for x in added_index.values())
+    print('{} summaries composed'.format(num_added))
+    if dict(added_scan) != dict(added_index):
+        diff = set(added_scan) ^ set(added_index) or \
+            set(x for x in added_scan if added_scan[x] != added_index.get(x))
+        print('MISMATCH in {} sections, e.g. {}'.format(len(diff), sorted(diff)[:5]))
+    else:
+        print('composed summaries are identical')
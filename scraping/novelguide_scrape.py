@@ -9,7 +9,6 @@ Script is very hacky because the website is very inconsistent with formatting.
 """
 
 import argparse
-import os
 import re
 import time
 import urllib.parse
@@ -20,18 +19,23 @@ import unicodedata
 from bs4.element import NavigableString, Tag
 
 from archive_lib import get_archived, get_orig_url
+from crawl_lib import crawl
 from number_lib import roman_to_int
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+from rate_lib import pace
+from stats_lib import timed
 from scrape_lib import BookSummary, get_soup, gen_gutenberg_overlap, clean_title, clean_sect_summ, get_clean_text, \
                        standardize_title, standardize_sect_title, load_catalog, write_sect_links, \
-                       fix_multipart, fix_multibook
-from scrape_vars import CATALOG_NAME, NON_NOVEL_TITLES, RE_SUMM_START, chapter_re, RE_CHAPTER_START, \
+                       fix_multipart, fix_multibook, PARSERS, set_parser
+from scrape_vars import SOURCE_PARSERS, CATALOG_NAME, NON_NOVEL_TITLES, RE_SUMM_START, chapter_re, RE_CHAPTER_START, \
                         RE_CHAPTER_NOSPACE, RE_PART_NOSPACE
 
 
 BOOKS_LIST = 'https://novelguide.com/novelguides?items_per_page=All'
 OUT_NAME_ALL = 'pks/summaries_novelguide_all.pk'
 OUT_NAME_OVERLAP = 'pks/summaries_novelguide.pk'
-SLEEP = 0.5  # sleep, since pages fail to load if scraped too fast
+SLEEP = 0.5  # min seconds between requests, since pages fail to load if scraped too fast
 
 NONBOLD_WITH_SECTIONS = ['www.novelguide.com/hard-times/',
                          'www.novelguide.com/gullivers-travels/summaries/parti-chaptersi-iii',
@@ -66,9 +70,11 @@ parser.add_argument('--use-pickled', action='store_true', help='use existing (pa
 parser.add_argument('--full', action='store_true', help='get all books, not just those in Gutenberg')
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
 parser.add_argument('--update-old', action='store_true', help='update out-of-date archived version')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=0, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=0, type=int, help='min seconds between starting two books')
 parser.add_argument('--no-text', dest='get_text', action='store_false', help='do not get book text')
+parser.add_argument('--parser', default=SOURCE_PARSERS['novelguide'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def get_title_url_map(books_list, title_set=None):
@@ -258,6 +264,7 @@ def process_colon_and_bold_section(p, title):
     return chapters
 
 
+@timed('process_story')
 def process_story(link, title=None):
     link = link.replace('http://www.novelguide.com', 'https://www.novelguide.com', 1)
     chapters = []
@@ -889,21 +896,16 @@ def sort_cells(cells):
 
 def get_summaries(title_url_map, out_name, use_pickled=False, archived=False, update_old=False,
                   get_text=True, save_every=5, sleep=0):
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: x.title, save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([x.title for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([x.title for x in book_summaries])
 
     for title, url in title_url_map.items():
         title = title.replace("DeerSlayer", 'Deerslayer', 1)
         if title in done:
             continue
-        if sleep:
-            time.sleep(sleep)
+        pace('book', sleep)
         author = ''  # TODO: figure this out
         archived_local = archived
 
@@ -934,22 +936,34 @@ def get_summaries(title_url_map, out_name, use_pickled=False, archived=False, up
             print('  no section links found for', url)
             continue
 
-        seen_sects = set()
+        sect_links = []
+        fetch_idxs, fetch_chaps = [], set()
         for c in cells:
             section_title = get_clean_text(c)
             section_title_chap = section_title.rsplit(':', 1)[-1].strip()
+            link_summ = urllib.parse.urljoin(url, c['href'])
+            # fetch all pages at once, except repeats of a chapter, which are only fetched if the first one fails
+            if get_text and not re.match(RE_PLOT, section_title) and section_title_chap not in fetch_chaps:
+                fetch_idxs.append(len(sect_links))
+                fetch_chaps.add(section_title_chap)
+            sect_links.append((section_title, section_title_chap, link_summ))
+        fetched = crawl(process_story, [sect_links[i][2] for i in fetch_idxs], return_exceptions=True)
+        pages = dict(zip(fetch_idxs, fetched))
+
+        seen_sects = set()
+        for i, (section_title, section_title_chap, link_summ) in enumerate(sect_links):
             if section_title_chap in seen_sects:
                 print('  seen {} already, skipped'.format(section_title_chap))
                 continue
             if re.match(RE_PLOT, section_title):
                 continue
 
-            link_summ = urllib.parse.urljoin(url, c['href'])
-
             if get_text:
-                try:
-                    page_summs = process_story(link_summ)
-                except AttributeError:  # page failed to load, try again
+                if i in pages:
+                    page_summs = pages[i]
+                else:
+                    page_summs = crawl(process_story, [link_summ], return_exceptions=True)[0]
+                if isinstance(page_summs, AttributeError):  # page failed to load, try again
                     print('  retrying after 5 seconds...')
                     time.sleep(5.0)
                     try:
@@ -957,7 +971,8 @@ def get_summaries(title_url_map, out_name, use_pickled=False, archived=False, up
                     except AttributeError:
                         print(f'unable to load {link_summ}, skipping')
                         continue
-
+                elif isinstance(page_summs, Exception):
+                    raise page_summs
 
                 if page_summs:
                     section_summs.extend(page_summs)
@@ -971,21 +986,21 @@ def get_summaries(title_url_map, out_name, use_pickled=False, archived=False, up
                                 source='novelguide', section_summaries=section_summs, summary_url=url)
 
         book_summaries.append(book_summ)
+        journal.append(book_summ.title, book_summ)
         num_books = len(book_summaries)
-        if num_books > 1 and num_books % save_every == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
 
     print('Scraped {} books from novelguide'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.full:
         title_set = None
@@ -0,0 +1,137 @@
+"""
+parser_parity.py
+
+Differential test of the BeautifulSoup parsers (scrape_lib.PARSERS). Runs the section extraction of each source, and
+gutenberg_scrape.get_book_sections for Gutenberg books, over the same pages once per parser, and reports every page
+where a parser's output differs from html5lib's (the reference).
+
+Pages are read from the response cache (--offline by default), so first scrape with the reference parser to fill
+the cache. Only switch a source in SOURCE_PARSERS, or a book in BOOK_PARSERS, once it has no mismatches here.
+
+Usage:
+    python scraping/parser_parity.py                                # all sources and Gutenberg books, all parsers
+    python scraping/parser_parity.py --sources gutenberg --limit 10 --parsers lxml
+"""
+
+import argparse
+import csv
+import difflib
+import json
+import os
+import sys
+import time
+
+from http_lib import add_http_args, configure_http
+from scrape_lib import set_parser, load_catalog, PARSERS
+from scrape_vars import CATALOG_NAME
+
+import bookwolf_scrape
+import cliffsnotes_scrape
+import gradesaver_scrape
+import gutenberg_scrape
+import novelguide_scrape
+import pinkmonkey_scrape
+import sparknotes_scrape
+
+REFERENCE = 'html5lib'
+URLS_DIR = 'urls/chapter-level'
+
+# source -> function(url, section title) returning the extracted section summary
+SECTION_FUNCS = {
+    'bookwolf': lambda url, title: bookwolf_scrape.process_chapter(url),
+    'cliffsnotes': lambda url, title: cliffsnotes_scrape.get_section_summary(url, cliffsnotes_scrape.BASE_URL),
+    'gradesaver': lambda url, title: gradesaver_scrape.get_section_summary(url),
+    'novelguide': lambda url, title: novelguide_scrape.process_story(url),
+    'pinkmonkey': lambda url, title: pinkmonkey_scrape.process_story(url, title),
+    'sparknotes': lambda url, title: sparknotes_scrape.get_section_summary(url, sleep=0),
+}
+
+parser = argparse.ArgumentParser(description='check that all BeautifulSoup parsers give the same scraped output')
+parser.add_argument('--sources', nargs='+', default=list(SECTION_FUNCS) + ['gutenberg'],
+                    choices=list(SECTION_FUNCS) + ['gutenberg'])
+parser.add_argument('--parsers', nargs='+', default=[x for x in PARSERS if x != REFERENCE], choices=PARSERS,
+                    help='parsers to compare against {}'.format(REFERENCE))
+parser.add_argument('--limit', type=int, default=0, help='max pages (or books) per source, 0 for all')
+parser.add_argument('--catalog', default=CATALOG_NAME)
+parser.add_argument('--out-name', help='write mismatches to this json file')
+add_http_args(parser)
+parser.add_argument('--online', dest='offline', action='store_false', help='fetch pages missing from the cache')
+parser.set_defaults(offline=True)
+
+
+def run(func, *args):
+    """ Returns (output, seconds). An exception is treated as output, so that parsers failing alike still match."""
+    start = time.perf_counter()
+    try:
+        output = func(*args)
+    except Exception as e:
+        output = 'EXCEPTION {}: {}'.format(type(e).__name__, e)
+    return output, time.perf_counter() - start
+
+
+def show_diff(expected, actual, max_lines=20):
+    expected = json.dumps(expected, indent=1, default=str, sort_keys=True).splitlines()
+    actual = json.dumps(actual, indent=1, default=str, sort_keys=True).splitlines()
+    diff = list(difflib.unified_diff(expected, actual, REFERENCE, 'other', lineterm='', n=1))
+    return '\n'.join(diff[:max_lines])
+
+
+def get_cases(source, limit, catalog=None):
+    """ Returns (name, func, args) for each page (or Gutenberg book) of source."""
+    cases = []
+    if source == 'gutenberg':
+        for title in sorted(catalog):
+            cases.append((title, gutenberg_scrape.get_book_sections, (title, catalog)))
+    else:
+        tsv_name = os.path.join(URLS_DIR, source + '.tsv')
+        if not os.path.exists(tsv_name):
+            print('{} not found, skipping {}'.format(tsv_name, source))
+            return []
+        with open(tsv_name) as f:
+            for book_title, section_title, url in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                cases.append(('{}: {}'.format(book_title, section_title), SECTION_FUNCS[source],
+                              (url, section_title)))
+    return cases[:limit] if limit else cases
+
+
+def check_source(source, parsers, limit, catalog=None):
+    mismatches = []
+    times = {x: 0. for x in [REFERENCE] + parsers}
+    cases = get_cases(source, limit, catalog)
+    for i, (name, func, args) in enumerate(cases):
+        print('{} {}/{} {}'.format(source, i + 1, len(cases), name), end='\r')
+        set_parser(REFERENCE, force=True)
+        expected, secs = run(func, *args)
+        times[REFERENCE] += secs
+        for parser_name in parsers:
+            set_parser(parser_name, force=True)
+            actual, secs = run(func, *args)
+            times[parser_name] += secs
+            if actual != expected:
+                mismatches.append({'source': source, 'name': name, 'parser': parser_name,
+                                   'diff': show_diff(expected, actual)})
+    print()
+    for parser_name, secs in times.items():
+        num_bad = sum(1 for x in mismatches if x['parser'] == parser_name)
+        print('  {:12} {:8.1f}s  {} / {} mismatched'.format(parser_name, secs, num_bad, len(cases)))
+    return mismatches
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    configure_http(args)
+    catalog = load_catalog(args.catalog) if 'gutenberg' in args.sources else None
+
+    mismatches = []
+    for source in args.sources:
+        mismatches.extend(check_source(source, args.parsers, args.limit, catalog))
+    set_parser(REFERENCE)
+
+    for mismatch in mismatches:
+        print('MISMATCH {source} [{parser}] {name}\n{diff}\n'.format(**mismatch))
+    if args.out_name:
+        with open(args.out_name, 'w') as f:
+            json.dump(mismatches, f, indent=2)
+        print('wrote mismatches to', args.out_name)
+    print('{} mismatches'.format(len(mismatches)))
+    sys.exit(1 if mismatches else 0)
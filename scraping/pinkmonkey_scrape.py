@@ -8,19 +8,23 @@ Optional flags to 1) use the archived version of pages, 2) scrape all books, ins
 """
 
 import argparse
-import os
 import re
 import sys
-import time
 import urllib.parse
 
 import dill as pickle
 from bs4 import element
 
-from archive_lib import get_archived, get_orig_url
+from archive_lib import get_archived, get_orig_url, resolve_archived
+from crawl_lib import crawl
+from http_lib import add_http_args, configure_http
+from journal_lib import load_checkpoint, compact
+from rate_lib import pace
+from stats_lib import timed
 from scrape_lib import get_soup, get_clean_text, get_absolute_links, find_all_stripped, load_catalog, BookSummary, \
-                       gen_gutenberg_overlap, standardize_title, standardize_sect_title, fix_multibook, fix_multipart
-from scrape_vars import CATALOG_NAME, NON_NOVEL_TITLES
+                       gen_gutenberg_overlap, standardize_title, standardize_sect_title, fix_multibook, fix_multipart, \
+                       PARSERS, set_parser
+from scrape_vars import SOURCE_PARSERS, CATALOG_NAME, NON_NOVEL_TITLES
 
 tups = [
     ('monkeynotes', 'https://pinkmonkey.com', 'https://pinkmonkey.com/booknotes/notes1.asp'),
@@ -51,8 +55,10 @@ parser.add_argument('--use-pickled', action='store_true', help='use existing (pa
 parser.add_argument('--full', action='store_true', help='get all books, not just those in Gutenberg')
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
 parser.add_argument('--update-old', action='store_true', help='update out-of-date archived version')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=0, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=0, type=int, help='min seconds between starting two books')
+parser.add_argument('--parser', default=SOURCE_PARSERS['pinkmonkey'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def get_pages_titles(index_pages, books_list, title_set=None):
@@ -105,6 +111,7 @@ def is_paywall(link):
     return False
 
 
+@timed('process_story')
 def process_story(link, title=None, get_next=True, find_continued=False):
     """
     returns tuples of (title, summary list) format
@@ -282,12 +289,16 @@ def process_next_link(link, archived, update_old):
             continue
         if archived:
             orig_url = urllib.parse.urljoin(get_orig_url(link), c.get('href'))
-            url = get_archived(orig_url, update_old)
+            url = orig_url  # resolved below, in one batch
         url_title_map[url] = title
         seen_urls.add(orig_url)
+    if archived:
+        archived_urls = resolve_archived(list(url_title_map), update_old)
+        url_title_map = {archived_urls[url]: title for url, title in url_title_map.items()}
 
-    for url, title in url_title_map.items():
-        summs = process_story(url, title)
+    story_urls = list(url_title_map.keys())
+    story_summs = crawl(process_story, story_urls, extra_args=[(url_title_map[url],) for url in story_urls])
+    for summs in story_summs:
         for summ in summs:
             # print(' ', summ[0])
             if summ[1]:  # not empty text
@@ -305,7 +316,7 @@ def process_next_link(link, archived, update_old):
                            for href in extra_sections]
         else:
             links_addtl = [urllib.parse.urljoin(link, x) for x in extra_sections]
-        sect_summs_addtl = [process_story(x)  for x in links_addtl]
+        sect_summs_addtl = crawl(process_story, links_addtl)
         sect_summs_addtl = [x[0] for x in sect_summs_addtl]
         section_summs.extend(sect_summs_addtl)
     return section_summs
@@ -316,7 +327,7 @@ def process_story_link(link, archived, update_old):
     stories = soup.find_all('a', text=RE_STORY)
     if not stories:
         return None
-    section_summs = []
+    story_urls = []
     for story in stories:  # a story page has multiple chapters
         href = story.get('href')
         ## For page http://www.pinkmonkey.com/booknotes/barrons/billbud.asp , we want Typee, but not Billy Budd
@@ -327,7 +338,9 @@ def process_story_link(link, archived, update_old):
             url = get_archived(url, update_old)
         else:
             url = urllib.parse.urljoin(link, href)
-        summs = process_story(url)
+        story_urls.append(url)
+    section_summs = []
+    for summs in crawl(process_story, story_urls):
         if summs:
             section_summs.extend(summs)
     return section_summs
@@ -335,14 +348,10 @@ def process_story_link(link, archived, update_old):
 
 def get_summaries(page_title_map, out_name, use_pickled=False, archived=False, update_old=False,
                   save_every=5, sleep=0):
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: (x.title, x.source), save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([(x.title, x.source) for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([(x.title, x.source) for x in book_summaries])
 
     for page, title in page_title_map.items():
         if 'barrons' in page.lower():
@@ -351,8 +360,7 @@ def get_summaries(page_title_map, out_name, use_pickled=False, archived=False, u
             source = 'monkeynotes'
         if (title, source) in done:
             continue
-        if sleep:
-            time.sleep(sleep)
+        pace('book', sleep)
         if archived:
             page = get_archived(page, update_old)
         print('processing', title, page)
@@ -394,15 +402,13 @@ def get_summaries(page_title_map, out_name, use_pickled=False, archived=False, u
         book_summ = BookSummary(title=title, author=author, genre=None, plot_overview=None, source=source,
                                 section_summaries=sect_summs, summary_url=page)
         book_summaries.append(book_summ)
+        journal.append((book_summ.title, book_summ.source), book_summ)
         num_books = len(book_summaries)
-        if num_books > 1 and num_books % save_every == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
 
     print('Scraped {} books from pinkmonkey'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
@@ -596,6 +602,8 @@ def manual_fix_individual(book_summaries):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.full:
         title_set = None
@@ -0,0 +1,188 @@
+"""
+rate_lib.py
+
+Per-host token-bucket rate limiting for http_lib.fetch().
+
+Each host has a bucket that refills at `rate` requests per second, up to `burst` tokens. A request takes a token,
+and waits only if the bucket is empty, so time spent parsing since the last request counts towards the wait.
+The rate of a host is lowered to honour the Crawl-delay in its robots.txt (or a minimum interval requested by the
+caller), is halved when the host answers 429/503, and slowly recovers after successful requests.
+
+With shared=True the bucket state is kept in a small file per host and updated under an flock, so several scrapers
+running at once share one budget per host.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.robotparser
+
+from crawl_lib import get_host
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, buckets are then per process only
+    fcntl = None
+
+RATE = 4.0  # default requests per second per host
+BURST = 4
+MIN_RATE = 0.05
+RECOVER_STEP = 0.05  # fraction of the base rate regained after each successful request
+BACKOFF_STATUSES = set([429, 503])
+SHARED_DIR = 'cache/ratelimit'
+
+_rate_config = {'rate': RATE, 'burst': BURST, 'shared': False, 'robots': True, 'enabled': True}
+_buckets = {}
+_buckets_lock = threading.Lock()
+_pace_last = {}
+
+
+def configure_rate(rate=None, burst=None, shared=None, robots=None, enabled=None):
+    settings = {'rate': rate, 'burst': burst, 'shared': shared, 'robots': robots, 'enabled': enabled}
+    _rate_config.update({k: v for k, v in settings.items() if v is not None})
+    with _buckets_lock:
+        _buckets.clear()
+
+
+def get_crawl_delay(url, session):
+    """ Returns the Crawl-delay from the robots.txt of url's host, or None."""
+    parts = urllib.parse.urlsplit(url)
+    robots_url = '{}://{}/robots.txt'.format(parts.scheme, parts.netloc)
+    try:
+        response = session.get(robots_url, timeout=30)
+    except Exception:
+        return None
+    if response.status_code != 200:
+        return None
+    robot_parser = urllib.robotparser.RobotFileParser()
+    robot_parser.parse(response.text.splitlines())
+    return robot_parser.crawl_delay(session.headers.get('User-Agent', '*'))
+
+
+class TokenBucket(object):
+    def __init__(self, host, rate, burst):
+        self.host = host
+        self.base_rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.state = {'tokens': burst, 'updated': time.time(), 'rate': rate}
+
+    def _load(self):
+        return self.state
+
+    def _save(self, state):
+        self.state = state
+
+    def _update(self, func):
+        with self.lock:
+            state = self._load()
+            result = func(state)
+            self._save(state)
+        return result
+
+    def cap_rate(self, rate):
+        """ Never go faster than rate (e.g. from robots.txt Crawl-delay, or a caller's minimum interval)."""
+        def _cap(state):
+            state['rate'] = min(state['rate'], rate)
+        self.base_rate = min(self.base_rate, rate)
+        self._update(_cap)
+
+    def reserve(self):
+        """ Takes a token, returns how many seconds to wait before using it."""
+        def _reserve(state):
+            now = time.time()
+            elapsed = max(0., now - state['updated'])
+            state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate']) - 1
+            state['updated'] = now
+            return max(0., -state['tokens'] / state['rate'])
+        return self._update(_reserve)
+
+    def feedback(self, status_code, retry_after=None):
+        def _feedback(state):
+            if status_code in BACKOFF_STATUSES:
+                state['rate'] = max(MIN_RATE, state['rate'] / 2)
+                if retry_after:  # empty the bucket until the server says we may retry
+                    state['tokens'] = min(state['tokens'], -retry_after * state['rate'])
+            else:
+                state['rate'] = min(self.base_rate, state['rate'] + RECOVER_STEP * self.base_rate)
+        self._update(_feedback)
+
+
+class SharedTokenBucket(TokenBucket):
+    """ TokenBucket whose state lives in a file, so it is shared between processes."""
+    def __init__(self, host, rate, burst, shared_dir=SHARED_DIR):
+        super(SharedTokenBucket, self).__init__(host, rate, burst)
+        os.makedirs(shared_dir, exist_ok=True)
+        self.path = os.path.join(shared_dir, host.replace(':', '_') + '.json')
+
+    def _update(self, func):
+        with self.lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = dict(self.state)
+                result = func(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return result
+
+
+def get_bucket(url, session=None):
+    host = get_host(url)
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is not None:
+            return bucket
+        if _rate_config['shared'] and fcntl is not None:
+            bucket = SharedTokenBucket(host, _rate_config['rate'], _rate_config['burst'])
+        else:
+            bucket = TokenBucket(host, _rate_config['rate'], _rate_config['burst'])
+        _buckets[host] = bucket
+    if _rate_config['robots'] and session is not None:
+        crawl_delay = get_crawl_delay(url, session)
+        if crawl_delay:
+            print('  honouring Crawl-delay of {}s for {}'.format(crawl_delay, host))
+            bucket.cap_rate(1. / float(crawl_delay))
+    return bucket
+
+
+def wait_for_host(url, session=None, min_interval=0):
+    """ Blocks until a request to url's host is allowed."""
+    if not _rate_config['enabled']:
+        return
+    bucket = get_bucket(url, session)
+    if min_interval:
+        bucket.cap_rate(1. / min_interval)
+    wait = bucket.reserve()
+    if wait > 0:
+        time.sleep(wait)
+
+
+def report_response(url, response):
+    if not _rate_config['enabled']:
+        return
+    retry_after = response.headers.get('Retry-After', '')
+    retry_after = float(retry_after) if retry_after.isdigit() else None
+    get_bucket(url).feedback(response.status_code, retry_after)
+
+
+def pace(key, interval):
+    """ Waits until interval seconds have passed since the last pace() call with the same key, e.g. between books.
+        Unlike time.sleep(interval), time spent working since the last call is subtracted from the wait.
+    """
+    if not _rate_config['enabled'] or not interval:
+        return
+    now = time.monotonic()
+    last = _pace_last.get(key)
+    if last is not None and last + interval > now:
+        time.sleep(last + interval - now)
+    _pace_last[key] = time.monotonic()
@@ -1,9 +1,7 @@
 import dill as pickle
 import os
 import re
-import requests
 import string
-import time
 import unicodedata
 import urllib.parse
 import string
@@ -11,11 +9,12 @@ import string
 from bs4 import BeautifulSoup
 from collections import namedtuple
 from copy import deepcopy
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 
+from http_lib import fetch
+from mirror_lib import read_mirror
+from stats_lib import timed, timer
 from number_lib import str_to_int, numword_to_int, int_to_roman, roman_to_int, get_numwords, RE_NUMWORD, numwords
-from scrape_vars import TO_DELETE, EXCLUDED_IDS, ALT_ORIG_MAP, CATALOG_NAME, CATALOG_RAW_NAME, \
+from scrape_vars import TO_DELETE, EXCLUDED_IDS, ALT_ORIG_MAP, CATALOG_NAME, CATALOG_RAW_NAME, PARSER, \
                         play_re, RE_SUMM, RE_SUMM_START, RE_ANALYSIS, RE_ROMAN, \
                         RE_CHAPTER_NOSPACE, RE_CHAPTER_DASH, RE_CHAPTER, RE_CHAPTER_START, RE_PART
 
@@ -27,15 +26,32 @@ BookSummary = namedtuple('BookSummary', ['title', 'author', 'genre', 'plot_overv
 ###
 RE_SPACE = re.compile(r'\s+')
 
+# BeautifulSoup tree builders. html5lib is the slowest, but it is what all scraped output was checked against;
+# run parser_parity.py before switching a source (SOURCE_PARSERS) or a Gutenberg book (BOOK_PARSERS) to another one
+PARSERS = ['html5lib', 'lxml', 'html.parser']
+_parser_config = {'default': PARSER, 'force': None}
 
-def get_soup(url, encoding=None, sleep=0):
-    s = requests.Session()
-    retries = Retry(total=4, backoff_factor=.3)
-    s.mount('http://', HTTPAdapter(max_retries=retries))
-    page = s.get(url)
-    if sleep:
-        time.sleep(sleep)
-    return BeautifulSoup(page.content, 'html5lib', from_encoding=encoding)
+
+def set_parser(parser, force=False):
+    """ Sets the parser used by get_soup. With force=True, it also overrides parsers chosen per call (per book)."""
+    if parser not in PARSERS:
+        raise ValueError('unknown parser {}, choose from {}'.format(parser, PARSERS))
+    _parser_config['default'] = parser
+    _parser_config['force'] = parser if force else None
+
+
+def make_soup(content, encoding=None, parser=None):
+    parser = _parser_config['force'] or parser or _parser_config['default']
+    with timer('soup'):
+        return BeautifulSoup(content, parser, from_encoding=encoding)
+
+
+@timed('get_soup')
+def get_soup(url, encoding=None, sleep=0, parser=None):
+    content = read_mirror(url)  # None unless a local Gutenberg mirror is set and has url
+    if content is None:
+        content = fetch(url, min_interval=sleep).content
+    return make_soup(content, encoding, parser)
 
 def write_sect_links(outname, book_summaries):
     os.makedirs(os.path.dirname(outname), exist_ok=True)
@@ -4,6 +4,19 @@ ID_FILE = './ids.json'
 CATALOG_RAW_NAME = 'pks/gutenberg_catalog_raw.pk'
 CATALOG_NAME = 'pks/gutenberg_catalog.pk'
 
+# BeautifulSoup parser for get_soup (see scrape_lib.PARSERS), per summary source and per Gutenberg book title
+PARSER = 'html5lib'
+SOURCE_PARSERS = {
+    'bookwolf': PARSER,
+    'cliffsnotes': PARSER,
+    'gradesaver': PARSER,
+    'novelguide': PARSER,
+    'pinkmonkey': PARSER,
+    'sparknotes': PARSER,
+    'gutenberg': PARSER,
+}
+BOOK_PARSERS = {}
+
 chapter_re = r'([Cc][Hh][Aa][Pp][Tt][Ee][Rr])\s?(\w*)\.?'
 letters_re = re.compile('(?:([Ll][Ee][Tt][Tt][Ee][Rr])\s?(\w*)|Final Letters)\.?')
 act_re = r'\b([Aa][Cc][Tt])(?:\s+)?(\w*)'
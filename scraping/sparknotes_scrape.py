@@ -17,16 +17,19 @@ import argparse
 import logging
 import os
 import re
-import time
 import urllib.parse
 
 import dill as pickle
 import requests
 
-from archive_lib import get_archived, get_orig_url
+from archive_lib import get_archived, get_orig_url, resolve_archived
+from crawl_lib import crawl
+from http_lib import add_http_args, configure_http, fetch
+from journal_lib import load_checkpoint, compact
 from scrape_lib import BookSummary, get_soup, gen_gutenberg_overlap, clean_title, fix_multibook, fix_multipart, \
-                       standardize_sect_title, standardize_title, load_catalog, get_clean_text, find_all_stripped
-from scrape_vars import CATALOG_NAME, NON_NOVEL_TITLES, chapter_re
+                       standardize_sect_title, standardize_title, load_catalog, get_clean_text, find_all_stripped, \
+                       PARSERS, set_parser
+from scrape_vars import SOURCE_PARSERS, CATALOG_NAME, NON_NOVEL_TITLES, chapter_re
 
 # default variables
 GUIDES_PAGE = 'https://www.sparknotes.com/lit/#'
@@ -48,8 +51,10 @@ parser.add_argument('--full', action='store_true', help='get all books, not just
 parser.add_argument('--catalog', default=CATALOG_NAME, help='get all books, not just those in Gutenberg')
 parser.add_argument('--update-old', action='store_true', help='update out-of-date archived version')
 parser.add_argument('--verbose', action='store_true', help='verbose output')
-parser.add_argument('--save-every', default=2, type=int, help='interval to save pickled file')
-parser.add_argument('--sleep', default=SLEEP, type=int, help='sleep time between scraping each book')
+parser.add_argument('--save-every', default=2, type=int, help='number of books between fsyncs of the checkpoint journal')
+parser.add_argument('--sleep', default=SLEEP, type=float, help='min seconds between two requests to sparknotes')
+parser.add_argument('--parser', default=SOURCE_PARSERS['sparknotes'], choices=PARSERS, help='BeautifulSoup parser for pages')
+add_http_args(parser)
 
 
 def get_author(soup):
@@ -66,7 +71,7 @@ def get_author(soup):
 def get_plot_section_urls(url, base_url=BASE_URL, archived=False, update_old=False, sleep=SLEEP):
     soup = get_soup(url, sleep=sleep)
     plot_url = urllib.parse.urljoin(url, 'summary/')
-    status_code = requests.get(plot_url).status_code
+    status_code = fetch(plot_url).status_code
     if status_code in set([404, 500]):
         try:
             plot_url = get_archived(plot_url)
@@ -93,13 +98,16 @@ def get_plot_section_urls(url, base_url=BASE_URL, archived=False, update_old=Fal
         if 'section' in href:
             if archived:
                 orig_url = get_orig_url(href)
-                url = get_archived(orig_url, update_old)
+                url = orig_url  # resolved below, in one batch
             else:
                 url = urllib.parse.urljoin(base_url, item.a['href'])
                 orig_url = url
             if orig_url not in seen:
                 section_urls.append(url)
                 seen.add(orig_url)
+    if archived:
+        archived_urls = resolve_archived(section_urls, update_old)
+        section_urls = [archived_urls[url] for url in section_urls]
 
     return plot_url, section_urls
 
@@ -255,9 +263,8 @@ def get_section_summary(section_url, archived=False, update_old=False, retry=0,
 
 def get_summaries(guides_page, base_url, out_name, use_pickled=False, archived=False,
                   update_old=False, save_every=5, title_set=None, sleep=SLEEP, flatten=True):
-    def add_summaries(url, section_summaries, flatten=True):
+    def add_summaries(summary_obj, section_summaries, flatten=True):
         # helper function
-        summary_obj = get_section_summary(url, archived, update_old)
         multisect_title, sect_summs = summary_obj
         logging.info(multisect_title)
         if flatten:
@@ -272,14 +279,10 @@ def get_summaries(guides_page, base_url, out_name, use_pickled=False, archived=F
                 section_summaries.append(summary_obj_new)
         else:
             section_summaries.append(summary_obj)
-    if use_pickled and os.path.exists(out_name):
-        with open(out_name, 'rb') as f1:
-            book_summaries = pickle.load(f1)
+    journal, book_summaries = load_checkpoint(out_name, use_pickled, lambda x: x.title, save_every)
+    if book_summaries:
         print('loaded {} existing summaries, resuming'.format(len(book_summaries)))
-        done = set([x.title for x in book_summaries])
-    else:
-        book_summaries = []
-        done = set()
+    done = set([x.title for x in book_summaries])
 
     soup = get_soup(guides_page, sleep=sleep)
     title_url_map = {}
@@ -310,8 +313,8 @@ def get_summaries(guides_page, base_url, out_name, use_pickled=False, archived=F
             plot_overview = None
 
         section_summaries = []
-        for url in section_urls:
-            add_summaries(url, section_summaries)
+        for summary_obj in crawl(get_section_summary, section_urls, archived, update_old):
+            add_summaries(summary_obj, section_summaries)
         if book == 'The Yellow Wallpaper':
             section_summaries = [('Book', plot_overview)]
         if not section_summaries:
@@ -324,15 +327,13 @@ def get_summaries(guides_page, base_url, out_name, use_pickled=False, archived=F
                          section_summaries=section_summaries)
 
         book_summaries.append(bs)
+        journal.append(bs.title, bs)
         num_books = len(book_summaries)
-        if num_books > 1 and num_books % save_every == 0:
-            with open(out_name, 'wb') as f:
-                pickle.dump(book_summaries, f)
+        if num_books % save_every == 0:
             print("Done scraping {} books".format(num_books))
 
     print('Scraped {} books from sparknotes'.format(len(book_summaries)))
-    with open(out_name, 'wb') as f:
-        pickle.dump(book_summaries, f)
+    compact(journal, out_name)
     print('wrote to', out_name)
     return book_summaries
 
@@ -538,6 +539,8 @@ def manual_fix_individual(book_summaries):
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    configure_http(args)
+    set_parser(args.parser)
     catalog = load_catalog(CATALOG_NAME)
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
@@ -554,7 +557,7 @@ if __name__ == "__main__":
     base_url = BASE_URL
     book_summaries = get_summaries(guides_page, base_url, args.out_name, args.use_pickled,
                                    args.archived, args.update_old, args.save_every,
-                                   title_set=title_set, sleep=args.sleep_time)
+                                   title_set=title_set, sleep=args.sleep)
     # with open(args.out_name, 'rb') as f:
     #     book_summaries = pickle.load(f)
 
@@ -0,0 +1,183 @@
+"""
+stats_lib.py
+
+Per-stage timers and counters for the scrapers, so that a run shows where its time went (fetching, Wayback
+resolution, parsing, checkpoint writes) instead of only interleaved prints.
+
+Stages are timed with `with timer('get_soup'):` or the @timed('process_story') decorator. Times are inclusive of
+nested stages, and a stage nested in itself (e.g. a recursive call) is only timed once. Network requests are recorded
+per host (latency histogram, bytes, status codes) by http_lib.fetch. Counters named '<name>.hit' / '<name>.miss'
+(http_cache, wayback_db, mirror) are reported with their hit rate.
+
+At exit, the summary is written as JSON to --stats (default cache/stats/<script>.json), see configure_stats.
+"""
+
+import atexit
+import bisect
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+STATS_DIR = 'cache/stats'
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+_lock = threading.Lock()
+_local = threading.local()  # stages running in this thread
+_stats = {'stages': {}, 'hosts': {}, 'counters': Counter()}
+_stats_config = {'path': None, 'registered': False, 'start': time.time()}
+
+
+def get_default_path():
+    script = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+    return os.path.join(STATS_DIR, '{}.json'.format(script))
+
+
+def new_histogram():
+    return {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+
+def observe(hist, secs):
+    hist['count'] += 1
+    hist['seconds'] += secs
+    hist['max_seconds'] = max(hist['max_seconds'], secs)
+    hist['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, secs * 1000)] += 1
+
+
+@contextmanager
+def timer(stage):
+    """ Times the block as stage. Nested in a block of the same stage (in the same thread), it is not timed again."""
+    active = getattr(_local, 'active', None)
+    if active is None:
+        active = _local.active = set()
+    if stage in active:
+        yield
+        return
+    active.add(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        secs = time.perf_counter() - start
+        active.discard(stage)
+        with _lock:
+            observe(_stats['stages'].setdefault(stage, new_histogram()), secs)
+
+
+def timed(stage):
+    """ Decorator form of timer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    with _lock:
+        _stats['counters'][name] += n
+
+
+def record_request(host, secs, num_bytes, status):
+    """ Records a network request to host (not one served from the response cache)."""
+    with _lock:
+        host_d = _stats['hosts'].get(host)
+        if host_d is None:
+            host_d = _stats['hosts'][host] = {'latency': new_histogram(), 'bytes': 0, 'statuses': Counter()}
+        observe(host_d['latency'], secs)
+        host_d['bytes'] += num_bytes
+        host_d['statuses'][str(status)] += 1
+
+
+def snapshot(reset=False):
+    """ Copy of the stats collected so far in this process, as plain dicts (picklable, for merge)."""
+    with _lock:
+        snap = json.loads(json.dumps(_stats))
+        if reset:
+            _stats['stages'].clear()
+            _stats['hosts'].clear()
+            _stats['counters'].clear()
+    return snap
+
+
+def merge_histogram(hist, other):
+    hist['count'] += other['count']
+    hist['seconds'] += other['seconds']
+    hist['max_seconds'] = max(hist['max_seconds'], other['max_seconds'])
+    hist['buckets'] = [x + y for x, y in zip(hist['buckets'], other['buckets'])]
+
+
+def merge(snap):
+    """ Adds a snapshot, e.g. one taken in a worker process, to the stats of this process."""
+    with _lock:
+        for stage, hist in snap['stages'].items():
+            merge_histogram(_stats['stages'].setdefault(stage, new_histogram()), hist)
+        for host, other in snap['hosts'].items():
+            host_d = _stats['hosts'].setdefault(host, {'latency': new_histogram(), 'bytes': 0, 'statuses': Counter()})
+            merge_histogram(host_d['latency'], other['latency'])
+            host_d['bytes'] += other['bytes']
+            host_d['statuses'].update(other['statuses'])
+        _stats['counters'].update(snap['counters'])
+
+
+def format_histogram(hist):
+    labels = ['<={}ms'.format(x) for x in LATENCY_BUCKETS_MS] + ['>{}ms'.format(LATENCY_BUCKETS_MS[-1])]
+    return {
+        'count': hist['count'],
+        'seconds': round(hist['seconds'], 6),
+        'mean_ms': round(1000 * hist['seconds'] / hist['count'], 3) if hist['count'] else 0,
+        'max_ms': round(1000 * hist['max_seconds'], 3),
+        'histogram': {label: n for label, n in zip(labels, hist['buckets']) if n},
+    }
+
+
+def get_summary():
+    """ The JSON summary of the run: per-stage timings, per-host requests, counters and hit rates."""
+    snap = snapshot()
+    counters = snap['counters']
+    hit_rates = {}
+    for name in sorted(counters):
+        if name.endswith('.hit'):
+            prefix = name[:-len('.hit')]
+            hits, misses = counters[name], counters.get(prefix + '.miss', 0)
+            hit_rates[prefix] = round(hits / (hits + misses), 4) if hits + misses else 0
+    return {
+        'script': os.path.basename(sys.argv[0]),
+        'argv': sys.argv[1:],
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_stats_config['start'])),
+        'wall_seconds': round(time.time() - _stats_config['start'], 3),
+        'stages': {stage: format_histogram(hist) for stage, hist in sorted(snap['stages'].items())},
+        'hosts': {host: dict(format_histogram(d['latency']), bytes=d['bytes'], statuses=d['statuses'])
+                  for host, d in sorted(snap['hosts'].items())},
+        'counters': dict(sorted(counters.items())),
+        'hit_rates': hit_rates,
+    }
+
+
+def write_summary(path=None):
+    path = path or _stats_config['path'] or get_default_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(get_summary(), f, indent=2)
+    os.replace(tmp_path, path)
+    print('wrote run stats to', path)
+
+
+def configure_stats(path=None):
+    """ Writes the summary to path (default cache/stats/<script>.json) when the process exits. '' disables it."""
+    _stats_config['path'] = get_default_path() if path is None else path
+    if _stats_config['path'] and not _stats_config['registered']:
+        _stats_config['registered'] = True
+        atexit.register(_write_at_exit)
+
+
+def _write_at_exit():
+    if _stats_config['path']:
+        write_summary(_stats_config['path'])